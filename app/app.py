@@ -2,16 +2,27 @@ import asyncio
 import os
 import sys
 import traceback
+from typing import Dict, List, Optional, Set
 
 import aioredis
+from aiohttp import ClientTimeout
 from dotenv import load_dotenv
+from web3 import AsyncWeb3
 # Add the directory containing bot_utils to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from bot_utils.block_scheduler import BlockScheduler
+from bot_utils.event_indexer import CHECKPOINT_KEY, EventIndexer
+from bot_utils.health_engine import MarketSnapshot
 from bot_utils.helpers import parse_env_array
+from bot_utils.hot_set import HotSetScheduler
+from bot_utils.leases import LeaseManager
 from bot_utils.market_behaviour import MarketBehaviour
 from bot_utils.markets_behaviour import MarketsBehaviour
-from bot_utils.transaction_filter import get_events
+from bot_utils.oracle_watcher import OracleWatcher
+from bot_utils.position_book import PositionBook
+from bot_utils.shard_pool import ShardPool
+from bot_utils.transaction_filter import store_market_events
 
 # Load environment variables from the .env file
 load_dotenv("../.env")
@@ -25,6 +36,57 @@ redis_instance = aioredis.from_url(url=os.environ.get("REDIS_HOST"))
 markets = parse_env_array(env_var_name="MARKETS")
 development = (os.getenv('DEVELOPMENT', 'False') == 'True')
 morpho_address = os.environ.get("MORPHO_ADDRESS")
+graphql_timeout = float(os.getenv("GRAPHQL_TIMEOUT", "30"))
+graphql_max_concurrency = int(os.getenv("GRAPHQL_MAX_CONCURRENCY", "16"))
+position_fetch_mode = os.getenv("POSITION_FETCH_MODE", "batched")
+health_prefilter_margin = float(os.getenv("HEALTH_PREFILTER_MARGIN", "0.05"))
+multicall_max_batch_size = int(os.getenv("MULTICALL_MAX_BATCH_SIZE", "1000"))
+rpc_call_gas_limit = int(os.getenv("RPC_CALL_GAS_LIMIT", "50000000"))
+multicall_max_in_flight = int(os.getenv("MULTICALL_MAX_IN_FLIGHT", "8"))
+interval = int(os.getenv("INTERVAL", "10"))
+scheduler_mode = os.getenv("SCHEDULER_MODE", "interval")
+ws_rpc = os.getenv("WS_RPC_URL")
+block_poll_interval = float(os.getenv("BLOCK_POLL_INTERVAL", "2"))
+indexer_start_block = int(os.environ["INDEXER_START_BLOCK"]) if os.getenv("INDEXER_START_BLOCK") else None
+indexer_confirmations = int(os.getenv("INDEXER_CONFIRMATIONS", "2"))
+indexer_max_block_range = int(os.getenv("INDEXER_MAX_BLOCK_RANGE", "5000"))
+position_source = os.getenv("POSITION_SOURCE", "graphql")
+if position_source == "events" and indexer_start_block is None:
+    raise ValueError("INDEXER_START_BLOCK environment variable is not set. POSITION_SOURCE=events needs it set to "
+                     "the Morpho deployment block so the position book holds complete balances.")
+preflight_gas_buffer = float(os.getenv("PREFLIGHT_GAS_BUFFER", "0.2"))
+max_bundle_gas = int(os.getenv("MAX_BUNDLE_GAS", "30000000"))
+priority_fee_percentile = float(os.getenv("PRIORITY_FEE_PERCENTILE", "50"))
+max_fee_per_gas = int(float(os.environ["MAX_FEE_PER_GAS_GWEI"]) * 10 ** 9) if os.getenv("MAX_FEE_PER_GAS_GWEI") else None
+tx_replace_after = float(os.getenv("TX_REPLACE_AFTER", "30"))
+tx_receipt_timeout = float(os.getenv("TX_RECEIPT_TIMEOUT", "180"))
+native_token_price_usd = float(os.getenv("NATIVE_TOKEN_PRICE_USD", "3000"))
+max_liquidation_candidates = int(os.getenv("MAX_LIQUIDATION_CANDIDATES", "256"))
+worker_processes = int(os.getenv("WORKER_PROCESSES", "1"))
+worker_scan_timeout = float(os.getenv("WORKER_SCAN_TIMEOUT", "300"))
+node_leases = (os.getenv("NODE_LEASES", "False") == "True")
+node_id = os.getenv("NODE_ID")
+lease_ttl = float(os.getenv("LEASE_TTL", "15"))
+lease_heartbeat_interval = float(os.getenv("LEASE_HEARTBEAT_INTERVAL", "5"))
+hot_set_enabled = (os.getenv("HOT_SET", "False") == "True")
+hot_set_max_interval = int(os.getenv("HOT_SET_MAX_INTERVAL", "50"))
+hot_set_confidence = float(os.getenv("HOT_SET_CONFIDENCE", "3"))
+oracle_watcher_enabled = (os.getenv("ORACLE_WATCHER", "False") == "True")
+oracle_price_change_bps = float(os.getenv("ORACLE_PRICE_CHANGE_BPS", "50"))
+
+# MarketsBehaviour settings shared by the coordinator and the worker processes
+markets_settings = dict(
+    url=graphql_api_url, private_key=private_key,
+    liquidator_address=liquidator_address, rpc=rpc, markets=markets,
+    graphql_timeout=graphql_timeout, graphql_max_concurrency=graphql_max_concurrency,
+    fetch_mode=position_fetch_mode, prefilter_margin=health_prefilter_margin,
+    max_batch_size=multicall_max_batch_size, call_gas_limit=rpc_call_gas_limit,
+    max_in_flight=multicall_max_in_flight,
+    preflight_gas_buffer=preflight_gas_buffer, max_bundle_gas=max_bundle_gas,
+    priority_fee_percentile=priority_fee_percentile, max_fee_per_gas=max_fee_per_gas,
+    tx_replace_after=tx_replace_after, tx_receipt_timeout=tx_receipt_timeout,
+    native_token_price_usd=native_token_price_usd, max_liquidation_candidates=max_liquidation_candidates
+)
 
 
 async def main():
@@ -33,7 +95,7 @@ async def main():
     Retries the main function upon encountering an exception.
     """
     try:
-        await run_periodic_tasks(interval_minutes=10)
+        await run_periodic_tasks(interval_minutes=interval)
     except Exception as error:
         print(f"Error running task: {error}")
         asyncio.run(main())  # Retry the main function
@@ -52,31 +114,222 @@ async def perform_task(index: int, market: MarketBehaviour):
     """
     try:
         print(f"Performing task for market {index}: {market.market.unique_key}")
-        await market.init()
-        market.get_un_healthy_positions()
+        await market.scan()
         await market.start_liquidations()
         return f"Task {index} completed with data: {market.positions}"
     except Exception:
         print(f"Task {index} failed with exception: {traceback.format_exc()}")
 
 
+async def perform_ladder_task(market: MarketBehaviour, snapshot: Optional[MarketSnapshot]):
+    """
+    Liquidate the positions of a market that crossed their liquidation price, without a scan.
+
+    Args:
+        market (MarketBehaviour): The market behaviour instance.
+        snapshot (MarketSnapshot): The market snapshot of the current block.
+    """
+    try:
+        if await market.check_ladder(snapshot):
+            await market.start_liquidations()
+    except Exception:
+        print(f"Ladder check of market {market.market.unique_key} failed with exception: {traceback.format_exc()}")
+
+
+async def run_cycle(markets_behaviour: MarketsBehaviour, block_number: Optional[int] = None,
+                    shard_pool: Optional[ShardPool] = None, leases: Optional[LeaseManager] = None,
+                    hot_set: Optional[HotSetScheduler] = None, oracle_watcher: Optional[OracleWatcher] = None,
+                    unique_keys: Optional[Set[str]] = None):
+    """
+    Scan and liquidate every monitored market once.
+
+    Args:
+        markets_behaviour (MarketsBehaviour): The markets behaviour instance.
+        block_number (int): The block that triggered the cycle, if any.
+        shard_pool (ShardPool): Worker processes scanning the markets, markets are scanned in this
+        process when omitted.
+        leases (LeaseManager): Market leases shared with other bot nodes, only markets leased by
+        this node are worked on. All markets are when omitted.
+        hot_set (HotSetScheduler): Risk-adaptive scheduler, only markets due at block_number are
+        scanned. Markets that are not due are checked against their liquidation ladder when
+        scanning in this process. All markets are scanned when omitted.
+        oracle_watcher (OracleWatcher): Oracle watcher making the hot set scan markets whose price
+        moved at once, fed with the block's snapshots.
+        unique_keys (Set[str]): Only work on the markets with these unique keys.
+    """
+    if block_number is not None:
+        print(f"Running cycle for block {block_number}")
+    markets = [market for market in markets_behaviour.markets
+               if (leases is None or leases.owns(market.market.unique_key))
+               and (unique_keys is None or market.market.unique_key in unique_keys)]
+    if leases is not None:
+        print(f"Node {leases.node_id} holds {len(markets)} of {len(markets_behaviour.markets)} markets")
+    ladder_tasks = []
+    if hot_set is not None and block_number is not None:
+        snapshots = await markets_behaviour.snapshot_cache.get(block_number)
+        hot_set.observe_prices(snapshots)
+        if oracle_watcher is not None:
+            for unique_key in oracle_watcher.observe_snapshots(snapshots):
+                hot_set.trigger(unique_key)
+        held = markets
+        markets = [market for market in held if hot_set.due(market.market.unique_key, block_number)]
+        print(f"{len(markets)} of {len(held)} markets due at block {block_number}")
+        if shard_pool is None:
+            due = set(map(id, markets))
+            ladder_tasks = [perform_ladder_task(market, snapshots.get(market.market.unique_key))
+                            for market in held if id(market) not in due]
+    if not markets:
+        await asyncio.gather(*ladder_tasks)
+        return
+    if shard_pool is not None:
+        health_factors = await run_sharded_cycle(markets_behaviour, shard_pool, markets)
+    else:
+        markets_behaviour.begin_cycle()
+        tasks = [perform_task(index, market) for index, market in enumerate(markets)]
+        if markets_behaviour.fetch_mode == "batched" and markets_behaviour.position_book is None:
+            markets_behaviour.open_position_feeds(markets)
+            tasks.append(markets_behaviour.feed_positions())
+        await asyncio.gather(*tasks, *ladder_tasks)
+        health_factors = markets_behaviour.min_health_factors(
+            {market.market.unique_key.lower() for market in markets})
+    if hot_set is not None and block_number is not None:
+        # Markets whose scan failed are missing and stay due on the next block
+        for unique_key, health_factor in health_factors.items():
+            hot_set.record_scan(unique_key, block_number, health_factor)
+
+
+async def run_sharded_cycle(markets_behaviour: MarketsBehaviour, shard_pool: ShardPool,
+                            markets: Optional[List[MarketBehaviour]] = None) -> Dict[str, Optional[float]]:
+    """
+    Scan every market on the worker processes and liquidate from this process, the only one
+    sending transactions.
+
+    Args:
+        markets_behaviour (MarketsBehaviour): The markets behaviour instance of the coordinator.
+        shard_pool (ShardPool): The worker processes.
+        markets (List[MarketBehaviour]): The markets to work on, all markets if omitted.
+
+    Returns:
+        Dict[str, Optional[float]]: The lowest health factor of each scanned market.
+    """
+    markets = markets_behaviour.markets if markets is None else markets
+    unique_keys = {market.market.unique_key.lower() for market in markets}
+    unhealthy, health_factors = await shard_pool.scan(unique_keys)
+    tasks = []
+    for market in markets:
+        positions = unhealthy.pop(market.market.unique_key.lower(), None)
+        if not positions:
+            continue
+        market.assign_positions(positions)
+        tasks.append(market.start_liquidations())
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Liquidation task failed with exception: {result!r}")
+    return health_factors
+
+
+async def watch_oracles(markets_behaviour: MarketsBehaviour, oracle_watcher: OracleWatcher,
+                        cycle_lock: asyncio.Lock, shard_pool: Optional[ShardPool] = None,
+                        leases: Optional[LeaseManager] = None):
+    """
+    Re-evaluate the markets whose oracle price moved on every block, between the periodic cycles.
+
+    Args:
+        markets_behaviour (MarketsBehaviour): The markets behaviour instance.
+        oracle_watcher (OracleWatcher): The oracle watcher.
+        cycle_lock (asyncio.Lock): Lock shared with the periodic cycles so a market is never
+        scanned twice at once.
+        shard_pool (ShardPool): Worker processes scanning the markets, if any.
+        leases (LeaseManager): Market leases shared with other bot nodes, if any.
+    """
+    async def on_block(block_number: int):
+        moved = await oracle_watcher.poll(block_number)
+        if moved:
+            async with cycle_lock:
+                await run_cycle(markets_behaviour, block_number, shard_pool, leases, unique_keys=moved)
+
+    scheduler = BlockScheduler(web3=markets_behaviour.async_web3, ws_url=ws_rpc, poll_interval=block_poll_interval)
+    await scheduler.run(on_block)
+
+
 async def run_periodic_tasks(interval_minutes: int):
     """
-    Run periodic tasks at specified intervals.
+    Run periodic tasks at specified intervals, or on every new block when SCHEDULER_MODE is "block".
 
     Args:
         interval_minutes (int): Interval in minutes between task executions.
     """
-    await get_events(rpc=rpc, morpho_address=morpho_address)
-    markets_behaviour = MarketsBehaviour(
-        url=graphql_api_url, private_key=private_key,
-        liquidator_address=liquidator_address, rpc=rpc, markets=markets
+    indexer = EventIndexer(
+        web3=AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(rpc, request_kwargs={'timeout': ClientTimeout(total=60)})),
+        morpho_address=morpho_address, start_block=indexer_start_block,
+        confirmations=indexer_confirmations, max_chunk_size=indexer_max_block_range
     )
+    indexer.subscribe(store_market_events)
+    position_book = None
+    if position_source == "events":
+        position_book = PositionBook()
+        await position_book.load()
+        checkpoint = await indexer.load_checkpoint()
+        if position_book.applied_through < 0 and checkpoint is not None and checkpoint["block"] >= indexer_start_block:
+            # The indexer already ran without the book, the events before its checkpoint would be missed
+            raise ValueError(f"The event indexer checkpoint is at block {checkpoint['block']} but the position book "
+                             f"is empty. Delete the {CHECKPOINT_KEY} Redis key to index from INDEXER_START_BLOCK.")
+        indexer.subscribe(position_book.on_events, on_reorg=position_book.on_reorg)
+    await indexer.sync()
+    indexer_task = asyncio.create_task(indexer.run())
+    markets_behaviour = MarketsBehaviour(**markets_settings, position_book=position_book)
     await markets_behaviour.init()
-    while True:
-        tasks = [perform_task(index, market) for index, market in enumerate(markets_behaviour.markets)]
-        await asyncio.gather(*tasks)
-        await asyncio.sleep(interval_minutes * 60)
+    shard_pool = None
+    if worker_processes > 1 and position_book is not None:
+        # The position book is fed by this process's indexer, workers could not see it
+        print("WORKER_PROCESSES is ignored with POSITION_SOURCE=events, scanning in this process")
+    elif worker_processes > 1:
+        shard_pool = ShardPool(settings=markets_settings, processes=worker_processes,
+                               scan_timeout=worker_scan_timeout)
+        shard_pool.start([market.market.unique_key for market in markets_behaviour.markets])
+    leases = None
+    lease_task = None
+    if node_leases:
+        leases = LeaseManager(node_id=node_id, ttl=lease_ttl, heartbeat_interval=lease_heartbeat_interval)
+        unique_keys = [market.market.unique_key for market in markets_behaviour.markets]
+        await leases.rebalance(unique_keys)
+        lease_task = asyncio.create_task(leases.run(unique_keys))
+    oracle_watcher = None
+    watcher_task = None
+    if oracle_watcher_enabled:
+        oracle_watcher = OracleWatcher(web3=markets_behaviour.async_web3,
+                                       liquidator_contract=markets_behaviour.async_liquidator_contract,
+                                       markets=[market.market for market in markets_behaviour.markets],
+                                       change_bps=oracle_price_change_bps)
+    try:
+        if scheduler_mode == "block":
+            scheduler = BlockScheduler(web3=markets_behaviour.async_web3, ws_url=ws_rpc,
+                                       poll_interval=block_poll_interval)
+            hot_set = None
+            if hot_set_enabled:
+                hot_set = HotSetScheduler(max_interval=hot_set_max_interval, confidence=hot_set_confidence)
+            elif oracle_watcher is not None:
+                print("ORACLE_WATCHER has no effect in block mode without HOT_SET, every market is scanned each block")
+            await scheduler.run(lambda block_number: run_cycle(markets_behaviour, block_number, shard_pool,
+                                                               leases, hot_set, oracle_watcher))
+            return
+        cycle_lock = asyncio.Lock()
+        if oracle_watcher is not None:
+            watcher_task = asyncio.create_task(
+                watch_oracles(markets_behaviour, oracle_watcher, cycle_lock, shard_pool, leases))
+        while True:
+            async with cycle_lock:
+                await run_cycle(markets_behaviour, shard_pool=shard_pool, leases=leases)
+            await asyncio.sleep(interval_minutes * 60)
+    finally:
+        indexer_task.cancel()
+        if lease_task is not None:
+            lease_task.cancel()
+        if watcher_task is not None:
+            watcher_task.cancel()
+        if shard_pool is not None:
+            shard_pool.close()
 
 
 # Run the main function
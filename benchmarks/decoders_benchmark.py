@@ -0,0 +1,170 @@
+"""
+@:dev Micro-benchmark of the schema-compiled decoders against the from_union parsing they replaced.
+
+Usage:
+    python benchmarks/decoders_benchmark.py [--items 100000] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Any, Callable, List
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models import market_positions, markets as market_models
+from models.market_positions import MarketsPositionResponse, MarketPosition, interned_markets
+from models.markets import MarketsResponse
+
+
+def legacy_from_union(fs, x):
+    for f in fs:
+        try:
+            return f(x)
+        except:
+            pass
+    assert False
+
+
+def legacy_from_int(x: Any) -> int:
+    assert isinstance(x, int) and not isinstance(x, bool)
+    return x
+
+
+def legacy_from_str(x: Any) -> str:
+    assert isinstance(x, str)
+    return x
+
+
+def legacy_from_float(x: Any) -> float:
+    assert isinstance(x, (float, int)) and not isinstance(x, bool)
+    return float(x)
+
+
+def legacy_from_none(x: Any) -> Any:
+    assert x is None
+    return x
+
+
+def legacy_asset(obj: dict) -> market_models.Asset:
+    assert isinstance(obj, dict)
+    return market_models.Asset(legacy_from_str(obj.get("address")), legacy_from_str(obj.get("symbol")))
+
+
+def legacy_state(obj: dict) -> market_models.State:
+    if not isinstance(obj, dict):
+        return None
+    return market_models.State(legacy_from_float(obj.get("borrowApy")),
+            legacy_from_union([legacy_from_int, legacy_from_str], obj.get("borrowAssets")),
+            legacy_from_float(obj.get("supplyApy")),
+            legacy_from_union([legacy_from_int, legacy_from_str], obj.get("supplyAssets")),
+            legacy_from_int(obj.get("fee")),
+            legacy_from_float(obj.get("utilization")),
+            legacy_from_union([legacy_from_float, legacy_from_none], obj.get("borrowAssetsUsd")),
+            legacy_from_union([legacy_from_float, legacy_from_none], obj.get("supplyAssetsUsd")))
+
+
+def legacy_market(obj: dict) -> market_models.Market:
+    assert isinstance(obj, dict)
+    return market_models.Market(
+        legacy_from_str(obj.get("uniqueKey")), obj.get("lltv"), legacy_from_str(obj.get("oracleAddress")),
+        obj.get("irmAddress"), legacy_asset(obj.get("loanAsset")), legacy_state(obj.get("state")),
+        legacy_from_union([legacy_asset, legacy_from_none], obj.get("collateralAsset")))
+
+
+# Markets shared by the legacy positions like interned_markets, so both paths intern and the
+# speedup measures the decoders alone
+legacy_interned_markets = {}
+
+
+def legacy_interned_market(obj: dict) -> market_models.Market:
+    unique_key = obj.get("uniqueKey")
+    interned = legacy_interned_markets.get(unique_key.lower()) if isinstance(unique_key, str) else None
+    if interned is not None:
+        if obj.get("state") is not None:
+            interned.state = legacy_state(obj.get("state"))
+        return interned
+    result = legacy_market(obj)
+    if isinstance(unique_key, str):
+        legacy_interned_markets[unique_key.lower()] = result
+    return result
+
+
+def legacy_position(obj: dict) -> MarketPosition:
+    return MarketPosition(
+        legacy_from_union([legacy_from_int, legacy_from_str], obj.get("supplyShares")),
+        legacy_from_union([legacy_from_int, legacy_from_str], obj.get("supplyAssets")),
+        legacy_from_float(obj.get("supplyAssetsUsd")),
+        legacy_from_union([legacy_from_int, legacy_from_str], obj.get("borrowShares")),
+        legacy_from_union([legacy_from_int, legacy_from_str], obj.get("borrowAssets")),
+        legacy_from_float(obj.get("borrowAssetsUsd")),
+        legacy_from_union([legacy_from_int, legacy_from_str], obj.get("collateral")),
+        legacy_from_float(obj.get("collateralUsd")),
+        legacy_interned_market(obj.get("market")),
+        market_positions.User(legacy_from_str(obj.get("user").get("address"))),
+        obj.get("liquidated", False), obj.get("health_factor", 10000.0), obj.get("healthy", False))
+
+
+def market(index: int) -> dict:
+    return {"uniqueKey": f"0x{index:064x}", "lltv": "860000000000000000",
+            "oracleAddress": f"0x{index:040x}", "irmAddress": f"0x{index + 1:040x}",
+            "loanAsset": {"address": f"0x{index + 2:040x}", "symbol": "USDC"},
+            "collateralAsset": {"address": f"0x{index + 3:040x}", "symbol": "WETH"},
+            "state": {"borrowApy": 0.05, "borrowAssets": "123456789012345678901234", "supplyApy": 0.04,
+                      "supplyAssets": "223456789012345678901234", "fee": 0, "utilization": 0.9,
+                      "borrowAssetsUsd": 1000.5, "supplyAssetsUsd": None}}
+
+
+def position(index: int, markets: List[dict]) -> dict:
+    # Big ints are string encoded like the API's BigInt scalars
+    return {"supplyShares": "0", "supplyAssets": "0", "supplyAssetsUsd": 0,
+            "borrowShares": str(10 ** 24 + index), "borrowAssets": str(10 ** 18 + index),
+            "borrowAssetsUsd": 1234.5, "collateral": str(10 ** 19 + index), "collateralUsd": 2345.5,
+            "market": markets[index % len(markets)], "user": {"address": f"0x{index:040x}"}}
+
+
+def measure(name: str, decode: Callable[[], Any], repeat: int, items: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        interned_markets.clear()
+        legacy_interned_markets.clear()
+        start = time.perf_counter()
+        decode()
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<48} {best * 1000:>9.1f} ms  {items / best:>12,.0f} items/s")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    markets = [market(index) for index in range(20)]
+    positions = [position(index, markets) for index in range(args.items)]
+    position_response = {"data": {"marketPositions": {"items": positions}}}
+    markets_response = {"data": {"markets": {"items": [market(index) for index in range(args.items)]}}}
+    cached = [MarketPosition.from_dict(item).to_dict() for item in positions]
+
+    print(f"Decoding {args.items:,} items, best of {args.repeat}")
+    legacy = measure("from_union MarketsPositionResponse",
+                     lambda: [legacy_position(item) for item in positions], args.repeat, args.items)
+    compiled = measure("compiled MarketsPositionResponse",
+                       lambda: MarketsPositionResponse.from_dict(position_response), args.repeat, args.items)
+    print(f"{'speedup':<48} {legacy / compiled:>9.1f} x")
+    legacy = measure("from_union MarketsResponse",
+                     lambda: [legacy_market(item) for item in markets_response["data"]["markets"]["items"]],
+                     args.repeat, args.items)
+    compiled = measure("compiled MarketsResponse",
+                       lambda: MarketsResponse.from_dict(markets_response), args.repeat, args.items)
+    print(f"{'speedup':<48} {legacy / compiled:>9.1f} x")
+    legacy = measure("from_union cached positions",
+                     lambda: [legacy_position(item) for item in cached], args.repeat, args.items)
+    compiled = measure("compiled cached positions",
+                       lambda: [MarketPosition.from_dict(item) for item in cached], args.repeat, args.items)
+    print(f"{'speedup':<48} {legacy / compiled:>9.1f} x")
+
+
+if __name__ == "__main__":
+    main()
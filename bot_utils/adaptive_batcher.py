@@ -0,0 +1,171 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+K = TypeVar("K")
+Call = Tuple[str, Any]
+# Executes a batch of calls and returns their return data plus the gas used when it was measured
+Executor = Callable[[List[Call], bool], Awaitable[Tuple[List[bytes], Optional[int]]]]
+
+
+class AdaptiveBatcher:
+    size: int
+    min_size: int
+    max_size: int
+    target_latency: float
+    max_response_bytes: int
+    gas_limit: int
+
+    def __init__(self, initial_size: int = 100, min_size: int = 1, max_size: int = 1000,
+                 target_latency: float = 2.0, max_response_bytes: int = 4 * 1024 * 1024,
+                 gas_limit: int = 50_000_000, gas_sample_interval: int = 50, max_in_flight: int = 8):
+        """
+        @:dev Sizes multicall batches from what the provider is observed to handle.
+
+        @:dev The batch size grows while batches return quickly and shrinks when latency, response
+        size or gas approach their limits. A failing batch is bisected until the failing calls are
+        isolated, every result stays attached to the key of the call that produced it. Batches are
+        dispatched concurrently up to a shared in-flight limit.
+
+        Args:
+            initial_size (int): The batch size used before anything has been observed.
+            min_size (int): The smallest batch size.
+            max_size (int): The largest batch size the provider accepts.
+            target_latency (float): The round trip time in seconds a batch should take.
+            max_response_bytes (int): The largest response a batch should produce.
+            gas_limit (int): The provider's gas cap for a single eth_call.
+            gas_sample_interval (int): Gas is measured on the first batch and then every n batches.
+            max_in_flight (int): The number of batches in flight at once across all callers.
+        """
+        self.size = initial_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.max_response_bytes = max_response_bytes
+        self.gas_limit = gas_limit
+        self.gas_sample_interval = gas_sample_interval
+        self.gas_per_call: Optional[float] = None
+        self.batches = 0
+        self.max_in_flight = max_in_flight
+        self._in_flight: Optional[asyncio.Semaphore] = None
+
+    def measure_gas(self) -> bool:
+        """
+        @:dev Whether the next batch should also measure its gas.
+
+        Returns:
+            bool: True if gas should be measured.
+        """
+        return self.batches % self.gas_sample_interval == 0
+
+    def record(self, size: int, latency: float, response_bytes: int, gas_used: Optional[int] = None):
+        """
+        @:dev Adjust the batch size from a successful batch.
+
+        Args:
+            size (int): The number of calls in the batch.
+            latency (float): The round trip time of the batch in seconds.
+            response_bytes (int): The total size of the returned data.
+            gas_used (int): The gas used by the batch, if it was measured.
+        """
+        self.batches += 1
+        if gas_used:
+            self.gas_per_call = gas_used / size
+        if size < self.size:
+            # Small remainder batches say little about how far the size can grow
+            return
+        if latency > self.target_latency:
+            new_size = int(size * self.target_latency / latency)
+        elif latency < self.target_latency / 2:
+            new_size = int(size * 1.5) + 1
+        else:
+            new_size = size
+        if response_bytes > 0:
+            new_size = min(new_size, int(self.max_response_bytes * size / response_bytes))
+        if self.gas_per_call:
+            new_size = min(new_size, int(self.gas_limit * 0.8 / self.gas_per_call))
+        self.size = max(self.min_size, min(self.max_size, new_size))
+
+    def failed(self, size: int):
+        """
+        @:dev Shrink the batch size after a batch failed.
+
+        Args:
+            size (int): The number of calls in the failed batch.
+        """
+        self.size = max(self.min_size, min(self.size, size // 2))
+
+    async def run(self, items: List[Tuple[K, Call]], execute: Executor) -> List[Tuple[K, Optional[bytes]]]:
+        """
+        @:dev Execute all calls in adaptively sized batches, several batches at once.
+
+        @:dev Each batch is sliced only once a slot is free, so its size already reflects the
+        batches that completed before it.
+
+        Args:
+            items (List[Tuple[K, Call]]): The calls to execute, each paired with its key.
+            execute (Executor): Executes one batch of calls.
+
+        Returns:
+            List[Tuple[K, Optional[bytes]]]: Every key paired with its return data, None if its
+            call failed.
+        """
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks = []
+        start = 0
+        while start < len(items):
+            await self._in_flight.acquire()
+            batch = items[start:start + self.size]
+            start += len(batch)
+            tasks.append(asyncio.create_task(self.__run_slot(batch, execute)))
+        results = []
+        for batch_results in await asyncio.gather(*tasks):
+            results += batch_results
+        return results
+
+    async def __run_slot(self, batch: List[Tuple[K, Call]], execute: Executor) -> List[Tuple[K, Optional[bytes]]]:
+        """
+        @:dev Execute one batch and release its in-flight slot, bisections reuse the same slot.
+
+        Args:
+            batch (List[Tuple[K, Call]]): The calls to execute, each paired with its key.
+            execute (Executor): Executes one batch of calls.
+
+        Returns:
+            List[Tuple[K, Optional[bytes]]]: Every key paired with its return data.
+        """
+        try:
+            return await self.run_batch(batch, execute)
+        finally:
+            self._in_flight.release()
+
+    async def run_batch(self, batch: List[Tuple[K, Call]], execute: Executor) -> List[Tuple[K, Optional[bytes]]]:
+        """
+        @:dev Execute one batch, bisecting it on failure to isolate the failing calls.
+
+        Args:
+            batch (List[Tuple[K, Call]]): The calls to execute, each paired with its key.
+            execute (Executor): Executes one batch of calls.
+
+        Returns:
+            List[Tuple[K, Optional[bytes]]]: Every key paired with its return data, None if its
+            call failed.
+        """
+        calls = [call for _, call in batch]
+        started = time.monotonic()
+        try:
+            return_data, gas_used = await execute(calls, self.measure_gas())
+        except Exception as error:
+            failure = error
+        else:
+            self.record(len(batch), time.monotonic() - started,
+                        sum(len(data) for data in return_data if data is not None), gas_used)
+            return [(key, data) for (key, _), data in zip(batch, return_data)]
+
+        self.failed(len(batch))
+        if len(batch) == 1:
+            print(f"Multicall call failed on its own, skipping it: {failure}")
+            return [(batch[0][0], None)]
+        middle = len(batch) // 2
+        return await self.run_batch(batch[:middle], execute) + await self.run_batch(batch[middle:], execute)
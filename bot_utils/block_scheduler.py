@@ -0,0 +1,123 @@
+import asyncio
+import traceback
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from web3 import AsyncWeb3, WebsocketProviderV2
+
+
+class BlockScheduler:
+    web3: AsyncWeb3
+    ws_url: Optional[str]
+    poll_interval: float
+
+    def __init__(self, web3: AsyncWeb3, ws_url: Optional[str] = None, poll_interval: float = 2.0):
+        """
+        @:dev Drives work from new block headers instead of a fixed sleep.
+
+        @:dev Headers come from a newHeads websocket subscription when a websocket URL is
+        configured, otherwise and whenever the subscription drops eth_blockNumber is polled.
+
+        Args:
+            web3 (AsyncWeb3): AsyncWeb3 instance used for polling.
+            ws_url (str): Optional websocket RPC URL used to subscribe to new headers.
+            poll_interval (float): Seconds between eth_blockNumber polls.
+        """
+        self.web3 = web3
+        self.ws_url = ws_url
+        self.poll_interval = poll_interval
+
+    async def blocks(self) -> AsyncIterator[int]:
+        """
+        @:dev Yield every new block number, retrying the websocket after each polling fallback.
+
+        Yields:
+            int: The number of the newest block.
+        """
+        last_block = None
+        while True:
+            if self.ws_url:
+                try:
+                    async for block_number in self.__subscribe():
+                        if last_block is None or block_number > last_block:
+                            last_block = block_number
+                            yield block_number
+                except Exception:
+                    print("Block subscription failed, falling back to polling")
+                    print(traceback.format_exc())
+            async for block_number in self.__poll(last_block, retry_subscription=bool(self.ws_url)):
+                last_block = block_number
+                yield block_number
+
+    async def __subscribe(self) -> AsyncIterator[int]:
+        """
+        @:dev Subscribe to newHeads over the websocket.
+
+        Yields:
+            int: The number of each new header.
+        """
+        async with AsyncWeb3.persistent_websocket(WebsocketProviderV2(self.ws_url)) as w3:
+            await w3.eth.subscribe("newHeads")
+            async for message in w3.ws.process_subscriptions():
+                number = message["result"]["number"]
+                yield int(number, 16) if isinstance(number, str) else number
+
+    async def __poll(self, last_block: Optional[int], retry_subscription: bool) -> AsyncIterator[int]:
+        """
+        @:dev Poll eth_blockNumber until a new block appears.
+
+        Args:
+            last_block (int): The last block already yielded.
+            retry_subscription (bool): Stop after a minute of polling so the websocket is retried.
+
+        Yields:
+            int: The number of each new block.
+        """
+        polls = 0
+        while not retry_subscription or polls * self.poll_interval < 60:
+            polls += 1
+            try:
+                block_number = await self.web3.eth.block_number
+                if last_block is None or block_number > last_block:
+                    last_block = block_number
+                    yield block_number
+            except Exception:
+                print("Error polling block number")
+                print(traceback.format_exc())
+            await asyncio.sleep(self.poll_interval)
+
+    async def run(self, on_block: Callable[[int], Awaitable]):
+        """
+        @:dev Call on_block for new blocks, never running two calls at once.
+
+        @:dev Blocks that arrive while a call is still running are coalesced, the next call
+        receives only the newest block so slow cycles never pile up.
+
+        Args:
+            on_block (Callable[[int], Awaitable]): The work to run for a block.
+        """
+        latest_block = None
+        wake = asyncio.Event()
+
+        async def listen():
+            nonlocal latest_block
+            async for block_number in self.blocks():
+                latest_block = block_number
+                wake.set()
+
+        listener = asyncio.create_task(listen())
+        handled_block = None
+        try:
+            while True:
+                await wake.wait()
+                wake.clear()
+                block_number = latest_block
+                if handled_block is not None and block_number - handled_block > 1:
+                    print(f"Coalesced {block_number - handled_block - 1} blocks while the last cycle ran")
+                try:
+                    await on_block(block_number)
+                except Exception:
+                    print(f"Error handling block {block_number}")
+                    print(traceback.format_exc())
+                handled_block = block_number
+        finally:
+            listener.cancel()
@@ -0,0 +1,159 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict
+
+import msgpack
+
+# Encoded values start with MAGIC, the codec id and the schema version. Legacy JSON values can
+# never start with a zero byte, so they are still read as plain JSON.
+MAGIC = 0
+SCHEMA_VERSION = 1
+HEADER_SIZE = 3
+
+# msgpack only packs 64 bit integers, larger ones (uint256 shares and prices) use this extension
+BIG_INT_EXT = 1
+
+
+class Codec(ABC):
+    name: str
+    codec_id: int
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        """
+        @:dev Serialize a value without the header.
+
+        Args:
+            value: The value to serialize.
+
+        Returns:
+            bytes: The serialized value.
+        """
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        """
+        @:dev Deserialize a value without the header.
+
+        Args:
+            data (bytes): The serialized value.
+
+        Returns:
+            The deserialized value.
+        """
+
+    def encode(self, value: Any) -> bytes:
+        """
+        @:dev Serialize a value and prefix it with the codec id and schema version.
+
+        Args:
+            value: The value to serialize.
+
+        Returns:
+            bytes: The tagged value.
+        """
+        return bytes((MAGIC, self.codec_id, SCHEMA_VERSION)) + self.dumps(value)
+
+
+class JsonCodec(Codec):
+    name = "json"
+    codec_id = 1
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+def pack_big_int(value: Any) -> msgpack.ExtType:
+    """
+    @:dev msgpack default hook packing integers that do not fit 64 bits.
+
+    Args:
+        value: The value msgpack could not pack.
+
+    Returns:
+        msgpack.ExtType: The integer as signed big endian bytes.
+
+    Raises:
+        TypeError: If the value is not an integer.
+    """
+    if isinstance(value, int):
+        return msgpack.ExtType(BIG_INT_EXT, value.to_bytes(value.bit_length() // 8 + 1, "big", signed=True))
+    raise TypeError(f"Cannot encode {type(value).__name__} in the cache")
+
+
+def unpack_big_int(code: int, data: bytes) -> Any:
+    """
+    @:dev msgpack extension hook reading integers packed by pack_big_int.
+
+    Args:
+        code (int): The extension type.
+        data (bytes): The extension payload.
+
+    Returns:
+        The decoded integer, or the raw extension for unknown types.
+    """
+    if code == BIG_INT_EXT:
+        return int.from_bytes(data, "big", signed=True)
+    return msgpack.ExtType(code, data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    codec_id = 2
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=pack_big_int, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, ext_hook=unpack_big_int, raw=False)
+
+
+CODECS: Dict[str, Codec] = {codec.name: codec for codec in (JsonCodec(), MsgpackCodec())}
+CODECS_BY_ID: Dict[int, Codec] = {codec.codec_id: codec for codec in CODECS.values()}
+
+
+def get_codec(name: str) -> Codec:
+    """
+    @:dev Get a codec by name.
+
+    Args:
+        name (str): The codec name, json or msgpack.
+
+    Returns:
+        Codec: The codec.
+
+    Raises:
+        ValueError: If the codec is unknown.
+    """
+    codec = CODECS.get(name.lower())
+    if codec is None:
+        raise ValueError(f"Unknown cache codec {name}, expected one of {', '.join(CODECS)}")
+    return codec
+
+
+def decode(data: bytes) -> Any:
+    """
+    @:dev Decode a cached value written by any codec, or a legacy untagged JSON value.
+
+    Args:
+        data (bytes): The cached value.
+
+    Returns:
+        The decoded value.
+
+    Raises:
+        ValueError: If the value was written by an unknown codec or a newer schema.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    if not data or data[0] != MAGIC:
+        return json.loads(data)
+    codec = CODECS_BY_ID.get(data[1])
+    if codec is None:
+        raise ValueError(f"Unknown cache codec id {data[1]}")
+    if data[2] > SCHEMA_VERSION:
+        raise ValueError(f"Cached value has schema version {data[2]}, this version reads up to {SCHEMA_VERSION}")
+    return codec.loads(data[HEADER_SIZE:])
@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import traceback
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from eth_utils import event_abi_to_log_topic
+from web3 import AsyncWeb3
+from web3.types import EventData
+
+from bot_utils.helpers import get_cache, store_cache
+
+INDEXED_EVENTS = ["CreateMarket", "Supply", "Withdraw", "Borrow", "Repay", "SupplyCollateral",
+                  "WithdrawCollateral", "Liquidate", "AccrueInterest"]
+CHECKPOINT_KEY = "indexer:checkpoint"
+
+EventHandler = Callable[[List[EventData]], Awaitable]
+ReorgHandler = Callable[[int], Awaitable]
+
+
+class EventIndexer:
+    web3: AsyncWeb3
+    morpho_address: str
+    confirmations: int
+    chunk_size: int
+
+    def __init__(self, web3: AsyncWeb3, morpho_address: str, start_block: Optional[int] = None,
+                 confirmations: int = 2, max_chunk_size: int = 5000, min_chunk_size: int = 1,
+                 poll_interval: float = 12, reorg_depth: int = 64):
+        """
+        @:dev Long running indexer of the Morpho events the bot depends on.
+
+        @:dev Logs are fetched with eth_getLogs in block ranges that shrink when the provider
+        rejects a request and grow back while requests succeed. The last processed block and its
+        hash are checkpointed in Redis after every range, so a restart resumes where it stopped.
+        A changed checkpoint hash means a reorg, handlers are told where the chain forked and the
+        forked blocks are indexed again.
+
+        Args:
+            web3 (AsyncWeb3): AsyncWeb3 instance for blockchain interactions.
+            morpho_address (str): The address of the Morpho contract.
+            start_block (int): The first block to index when there is no checkpoint, 300 blocks
+            behind the head if omitted.
+            confirmations (int): The number of blocks kept between the head and the indexed range.
+            max_chunk_size (int): The largest block range requested at once.
+            min_chunk_size (int): The smallest block range requested at once.
+            poll_interval (float): Seconds to wait for new blocks once the indexer is caught up.
+            reorg_depth (int): The number of recent checkpoints kept to find a fork point.
+        """
+        script_dir = os.path.dirname(__file__)
+        with open(os.path.join(script_dir, '../data/morpho_abi.json')) as f:
+            abi = json.load(f)
+        self.web3 = web3
+        self.morpho_address = AsyncWeb3.to_checksum_address(morpho_address)
+        self.morpho = web3.eth.contract(address=self.morpho_address, abi=abi)
+        self.start_block = start_block
+        self.confirmations = confirmations
+        self.max_chunk_size = max_chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.chunk_size = max_chunk_size
+        self.poll_interval = poll_interval
+        self.reorg_depth = reorg_depth
+        self.events_by_topic = {}
+        for event_abi in abi:
+            if event_abi.get("type") == "event" and event_abi.get("name") in INDEXED_EVENTS:
+                topic = AsyncWeb3.to_hex(event_abi_to_log_topic(event_abi))
+                self.events_by_topic[topic] = self.morpho.events[event_abi["name"]]()
+        self.handlers: List[EventHandler] = []
+        self.reorg_handlers: List[ReorgHandler] = []
+        self.checkpoint: Optional[Dict] = None
+
+    def subscribe(self, handler: EventHandler, on_reorg: Optional[ReorgHandler] = None):
+        """
+        @:dev Register a handler for every range of decoded events, in block order.
+
+        Args:
+            handler (EventHandler): Called with the decoded events of each block range.
+            on_reorg (ReorgHandler): Called with the first forked block when a reorg is detected.
+        """
+        self.handlers.append(handler)
+        if on_reorg is not None:
+            self.reorg_handlers.append(on_reorg)
+
+    async def load_checkpoint(self) -> Optional[Dict]:
+        """
+        @:dev Load the last processed block, its hash and the recent checkpoints from Redis.
+
+        Returns:
+            dict: The checkpoint, or None if the indexer never ran.
+        """
+        checkpoint = await get_cache(CHECKPOINT_KEY)
+        return checkpoint.get("data") or None
+
+    async def save_checkpoint(self, block_number: int, block_hash: str):
+        """
+        @:dev Persist the last processed block together with the recent checkpoints.
+
+        Args:
+            block_number (int): The last processed block.
+            block_hash (str): The hash of the last processed block.
+        """
+        recent = (self.checkpoint or {}).get("recent", []) + [[block_number, block_hash]]
+        self.checkpoint = {"block": block_number, "hash": block_hash, "recent": recent[-self.reorg_depth:]}
+        await store_cache(CHECKPOINT_KEY, self.checkpoint)
+
+    async def block_hash(self, block_number: int) -> str:
+        """
+        @:dev Get the hash of a block.
+
+        Args:
+            block_number (int): The block number.
+
+        Returns:
+            str: The block hash.
+        """
+        block = await self.web3.eth.get_block(block_number)
+        return AsyncWeb3.to_hex(block["hash"])
+
+    async def check_reorg(self) -> bool:
+        """
+        @:dev Compare the checkpointed hashes with the chain and rewind to the fork point if needed.
+
+        @:dev An empty checkpoint hash is unknown, e.g. before the first range or after a rewind
+        past every recent checkpoint, and is not compared.
+
+        Returns:
+            bool: True if a reorg was detected.
+        """
+        if self.checkpoint is None or not self.checkpoint["hash"]:
+            return False
+        if await self.block_hash(self.checkpoint["block"]) == self.checkpoint["hash"]:
+            return False
+        recent = list(self.checkpoint.get("recent", []))
+        fork_block = recent[0][0] - self.reorg_depth if recent else self.checkpoint["block"] - self.reorg_depth
+        while recent:
+            block_number, block_hash = recent.pop()
+            if await self.block_hash(block_number) == block_hash:
+                fork_block = block_number + 1
+                recent.append([block_number, block_hash])
+                break
+        fork_block = max(fork_block, 0)
+        print(f"Reorg detected, re-indexing from block {fork_block}")
+        fork_parent_hash = recent[-1][1] if recent and recent[-1][0] == fork_block - 1 else ""
+        self.checkpoint = {"block": fork_block - 1, "hash": fork_parent_hash, "recent": recent}
+        for on_reorg in self.reorg_handlers:
+            await on_reorg(fork_block)
+        return True
+
+    async def fetch_logs(self, from_block: int, to_block: int) -> List[dict]:
+        """
+        @:dev Fetch the raw logs of the indexed events in a block range.
+
+        Args:
+            from_block (int): The first block of the range.
+            to_block (int): The last block of the range.
+
+        Returns:
+            List[dict]: The raw logs.
+        """
+        return await self.web3.eth.get_logs({
+            "address": self.morpho_address,
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": [list(self.events_by_topic)],
+        })
+
+    def decode(self, logs: List[dict]) -> List[EventData]:
+        """
+        @:dev Decode raw logs into events, skipping logs that cannot be decoded.
+
+        Args:
+            logs (List[dict]): The raw logs.
+
+        Returns:
+            List[EventData]: The decoded events in block order.
+        """
+        events = []
+        for log in logs:
+            event = self.events_by_topic.get(AsyncWeb3.to_hex(log["topics"][0]))
+            if event is None:
+                continue
+            try:
+                events.append(event.process_log(log))
+            except Exception:
+                print(f"Error decoding log {log}")
+                print(traceback.format_exc())
+        return events
+
+    async def sync(self) -> int:
+        """
+        @:dev Index every confirmed block after the checkpoint.
+
+        Returns:
+            int: The number of events processed.
+        """
+        if self.checkpoint is None:
+            self.checkpoint = await self.load_checkpoint()
+        head = await self.web3.eth.block_number - self.confirmations
+        if self.checkpoint is None:
+            start_block = self.start_block if self.start_block is not None else head - 300
+            self.checkpoint = {"block": start_block - 1, "hash": "", "recent": []}
+        else:
+            await self.check_reorg()
+        processed = 0
+        from_block = self.checkpoint["block"] + 1
+        while from_block <= head:
+            to_block = min(from_block + self.chunk_size - 1, head)
+            try:
+                # The checkpointed hash is read before the logs, a reorg of to_block in between
+                # makes it stale and the next check re-indexes the range
+                to_block_hash = await self.block_hash(to_block)
+                logs = await self.fetch_logs(from_block, to_block)
+            except Exception as error:
+                if self.chunk_size <= self.min_chunk_size:
+                    raise
+                self.chunk_size = max(self.min_chunk_size, self.chunk_size // 2)
+                print(f"eth_getLogs rejected blocks {from_block}-{to_block} ({error}), "
+                      f"retrying with ranges of {self.chunk_size} blocks")
+                continue
+            if any(log["blockNumber"] == to_block and AsyncWeb3.to_hex(log["blockHash"]) != to_block_hash
+                   for log in logs):
+                print(f"Block {to_block} reorged while fetching logs, retrying")
+                continue
+            events = self.decode(logs)
+            for handler in self.handlers:
+                await handler(events)
+            await self.save_checkpoint(to_block, to_block_hash)
+            processed += len(events)
+            from_block = to_block + 1
+            self.chunk_size = min(self.max_chunk_size, self.chunk_size * 2)
+        return processed
+
+    async def run(self):
+        """
+        @:dev Keep indexing new blocks until cancelled.
+        """
+        while True:
+            try:
+                processed = await self.sync()
+                if processed:
+                    print(f"Indexed {processed} Morpho events up to block {self.checkpoint['block']}")
+            except Exception:
+                print("Error in event indexer")
+                print(traceback.format_exc())
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,87 @@
+import asyncio
+import traceback
+from typing import Optional
+
+import aiohttp
+
+
+class GraphQLClient:
+    url: str
+    timeout: float
+    max_concurrency: int
+    max_connections: int
+
+    def __init__(self, url: str, timeout: float = 30, max_concurrency: int = 16,
+                 max_connections: int = 32, keepalive_timeout: float = 60):
+        """
+        @:dev Shared asynchronous GraphQL client used for all API traffic.
+
+        @:dev A single aiohttp session keeps connections alive between requests, every request
+        is bounded by its own timeout and a semaphore caps the number of requests in flight so
+        a large market list cannot flood the API.
+
+        Args:
+            url (str): The GraphQL API endpoint URL.
+            timeout (float): Total timeout in seconds applied to each request.
+            max_concurrency (int): Maximum number of requests in flight at once.
+            max_connections (int): Maximum number of pooled connections.
+            keepalive_timeout (float): Seconds an idle pooled connection is kept open.
+        """
+        self.url = url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def session(self) -> aiohttp.ClientSession:
+        """
+        @:dev Lazily create the pooled session, it must be created inside the running event loop.
+
+        Returns:
+            aiohttp.ClientSession: The shared session.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                             keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def post(self, query: str, variables: Optional[dict] = None) -> Optional[dict]:
+        """
+        @:dev Send a GraphQL query and return the decoded JSON body.
+
+        Args:
+            query (str): The GraphQL query string.
+            variables (dict): Optional query variables.
+
+        Returns:
+            dict: The decoded response, or None if the request failed.
+        """
+        session = await self.session()
+        payload = {"query": query}
+        if variables is not None:
+            payload["variables"] = variables
+        async with self._semaphore:
+            try:
+                async with session.post(self.url, json=payload) as response:
+                    if response.status == 200:
+                        return await response.json()
+                    print(f"Error in GraphQL request: {response.status}, {await response.text()}")
+            except asyncio.TimeoutError:
+                print(f"GraphQL request timed out after {self.timeout}s")
+            except Exception:
+                print("Error in GraphQL request")
+                print(traceback.format_exc())
+        return None
+
+    async def close(self):
+        """
+        @:dev Close the pooled session and release its connections.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,100 @@
+import bisect
+import hashlib
+from typing import Dict, Generic, Iterable, List, TypeVar
+
+N = TypeVar("N")
+
+
+def ring_hash(value: str) -> int:
+    """
+    @:dev Hash a string onto the ring, stable across processes and runs unlike hash().
+
+    Args:
+        value (str): The value to hash.
+
+    Returns:
+        int: The 64 bit position on the ring.
+    """
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class ConsistentHashRing(Generic[N]):
+    points: List[int]
+    owners: List[N]
+
+    def __init__(self, nodes: Iterable[N] = (), replicas: int = 64):
+        """
+        @:dev Consistent hash ring assigning keys to nodes.
+
+        @:dev Every node is placed on the ring replicas times so keys spread evenly, and adding or
+        removing a node only moves the keys of the ring segments it takes over or gives up.
+
+        Args:
+            nodes (Iterable[N]): The initial nodes, identified by their string form.
+            replicas (int): The number of virtual points of each node.
+        """
+        self.replicas = replicas
+        self.points = []
+        self.owners = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(self.points) // self.replicas
+
+    def add(self, node: N):
+        """
+        @:dev Place a node on the ring.
+
+        Args:
+            node (N): The node.
+        """
+        for replica in range(self.replicas):
+            point = ring_hash(f"{node}#{replica}")
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def remove(self, node: N):
+        """
+        @:dev Take a node off the ring.
+
+        Args:
+            node (N): The node.
+        """
+        kept = [(point, owner) for point, owner in zip(self.points, self.owners) if owner != node]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def node_for(self, key: str) -> N:
+        """
+        @:dev Get the node owning a key, the first point clockwise from the key's hash.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            N: The node.
+
+        Raises:
+            ValueError: If the ring has no nodes.
+        """
+        if not self.points:
+            raise ValueError("The hash ring has no nodes")
+        index = bisect.bisect(self.points, ring_hash(key)) % len(self.points)
+        return self.owners[index]
+
+    def assign(self, keys: Iterable[str]) -> Dict[N, List[str]]:
+        """
+        @:dev Group keys by the node owning them.
+
+        Args:
+            keys (Iterable[str]): The keys.
+
+        Returns:
+            Dict[N, List[str]]: The keys of every node that owns at least one.
+        """
+        assigned: Dict[N, List[str]] = {}
+        for key in keys:
+            assigned.setdefault(self.node_for(key), []).append(key)
+        return assigned
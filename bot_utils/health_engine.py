@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from bot_utils.helpers import to_assets_up, calculate_max_borrow, WAD, MAX_UINT256
+from models.market_positions import MarketPosition
+
+
+@dataclass
+class MarketSnapshot:
+    unique_key: str
+    price: int
+    total_borrow_assets: int
+    total_borrow_shares: int
+    lltv: int
+    last_update: int = 0
+    block_number: Optional[int] = None
+
+
+def health_factor(borrow_shares: int, collateral: int, snapshot: MarketSnapshot) -> int:
+    """
+    @:dev Compute a position's health factor exactly as Liquidator.userHealthFactor does.
+
+    Args:
+        borrow_shares (int): The borrow shares of the position.
+        collateral (int): The collateral of the position.
+        snapshot (MarketSnapshot): The market totals, oracle price and LLTV.
+
+    Returns:
+        int: The WAD scaled health factor, MAX_UINT256 if the position has no debt.
+    """
+    borrowed = to_assets_up(borrow_shares, snapshot.total_borrow_assets, snapshot.total_borrow_shares)
+    if borrowed == 0:
+        return MAX_UINT256
+    max_borrow = calculate_max_borrow(collateral, snapshot.price, snapshot.lltv)
+    return max_borrow * WAD // borrowed
+
+
+def prefilter_positions(positions: List[MarketPosition], snapshot: MarketSnapshot,
+                        margin: float) -> Tuple[List[MarketPosition], List[MarketPosition]]:
+    """
+    @:dev Split positions into those that need on-chain confirmation and those that are safely
+    healthy, using exact integer math against a single market snapshot.
+
+    @:dev API balances can lag the chain and interest accrues between snapshots, so every
+    position whose off-chain health factor is below 1 + margin is sent on for confirmation.
+    Positions with missing balances are always sent on.
+
+    Args:
+        positions (List[MarketPosition]): The positions of the snapshot's market.
+        snapshot (MarketSnapshot): The market totals, oracle price and LLTV.
+        margin (float): The distance above a health factor of 1 still treated as borderline.
+
+    Returns:
+        Tuple[List[MarketPosition], List[MarketPosition]]: The borderline positions and the
+        healthy positions.
+    """
+    threshold = WAD + int(margin * WAD)
+    borderline = []
+    healthy = []
+    for position in positions:
+        if position.borrow_shares is None or position.collateral is None:
+            borderline.append(position)
+            continue
+        factor = health_factor(int(position.borrow_shares), int(position.collateral), snapshot)
+        if factor < threshold:
+            borderline.append(position)
+        else:
+            position.health_factor = factor / WAD
+            healthy.append(position)
+    return borderline, healthy
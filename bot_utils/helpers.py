@@ -1,13 +1,15 @@
-import json
 import os
 import sys
 from typing import List
 
 import aioredis
 from dotenv import load_dotenv
+from eth_abi import decode
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from bot_utils import codec
+
 env_path = os.path.join(os.path.dirname(__file__), '../.env')
 load_dotenv(env_path)
 
@@ -20,6 +22,9 @@ print("REDIS_HOST: ", redis_host)
 # Create an instance of the Redis client
 redis_instance = aioredis.from_url(url=redis_host)
 
+# Codec used for new cache entries, entries written by any other codec are still readable
+cache_codec = codec.get_codec(os.environ.get("CACHE_CODEC", "msgpack"))
+
 
 async def get_cache(key: str) -> dict:
     """
@@ -40,7 +45,7 @@ async def get_cache(key: str) -> dict:
     else:
         return {
             "success": True,
-            "data": json.loads(data)
+            "data": codec.decode(data)
         }
 
 
@@ -56,7 +61,7 @@ async def store_cache(key: str, data) -> bool:
         bool: True if the data was successfully stored, False otherwise.
     """
     try:
-        await redis_instance.set(key, json.dumps(data))
+        await redis_instance.set(key, cache_codec.encode(data))
         return True
     except Exception as e:
         print(f"Error storing cache with key: {key}, data: {data}, error: {e}")
@@ -83,6 +88,25 @@ def unique_items(items: list, key: str) -> list:
     return unique_list
 
 
+def revert_reason(data: bytes) -> str:
+    """
+    @:dev Decode the revert data of a failed call.
+
+    Args:
+        data (bytes): The revert data.
+
+    Returns:
+        str: The Error(string) message, or the raw data as hex for custom errors and panics.
+    """
+    data = bytes(data or b"")
+    if data[:4] == ERROR_STRING_SELECTOR:
+        try:
+            return decode(["string"], data[4:])[0]
+        except Exception:
+            pass
+    return "0x" + data.hex() if data else "no revert data"
+
+
 def pow10(exponent: int) -> int:
     """
     @:dev Compute 10 raised to the power of the given exponent.
@@ -232,4 +256,5 @@ WAD = pow10(18)
 SECONDS_PER_YEAR = 3600 * 24 * 365
 VIRTUAL_ASSETS = 1
 VIRTUAL_SHARES = 10 ** 6
+ERROR_STRING_SELECTOR = bytes.fromhex("08c379a0")
 MAX_UINT256 = int("0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF", 16)
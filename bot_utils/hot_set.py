@@ -0,0 +1,161 @@
+import math
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from bot_utils.health_engine import MarketSnapshot
+
+
+@dataclass
+class MarketRisk:
+    # Lowest health factor of the market's positions at its last scan, None if it has none
+    min_health_factor: Optional[float] = None
+    # Oracle price when min_health_factor was measured
+    scan_price: Optional[int] = None
+    last_price: Optional[int] = None
+    # EWMA of squared per-block log returns of the oracle price
+    variance: float = 0.0
+    interval: int = 1
+    next_block: int = 0
+    scanned: bool = False
+
+
+class HotSetScheduler:
+    risks: Dict[str, MarketRisk]
+
+    def __init__(self, max_interval: int = 50, confidence: float = 3.0, decay: float = 0.94,
+                 min_volatility: float = 5e-4, hot_margin: float = 0.02):
+        """
+        @:dev Decides which markets are scanned on each block from how close they are to a
+        liquidation.
+
+        @:dev A position's health factor moves in proportion to the collateral price, so the
+        market's lowest health factor h is liquidated after a log price move of ln(h). With a
+        per-block volatility sigma, from an EWMA of the oracle's log returns, such a move takes
+        about (ln(h) / (confidence * sigma))^2 blocks and that is the market's scan interval,
+        between 1 (hot) and max_interval (cold).
+        @:dev Prices of all markets are observed every block from the shared snapshot read, a
+        market whose health factor estimated at the current price falls within hot_margin of 1 is
+        due at once whatever its interval.
+
+        Args:
+            max_interval (int): The most blocks between two scans of a market.
+            confidence (float): The number of standard deviations of price moves covered by the
+            interval.
+            decay (float): The EWMA weight of past observations.
+            min_volatility (float): Floor of the per-block volatility, for fixed or idle oracles.
+            hot_margin (float): Markets with an estimated health factor below 1 + margin are hot.
+        """
+        self.max_interval = max_interval
+        self.confidence = confidence
+        self.decay = decay
+        self.min_volatility = min_volatility
+        self.hot_margin = hot_margin
+        self.risks = {}
+
+    def risk(self, unique_key: str) -> MarketRisk:
+        """
+        @:dev Get the risk state of a market, created on first use.
+
+        Args:
+            unique_key (str): The market unique key.
+
+        Returns:
+            MarketRisk: The risk state.
+        """
+        unique_key = unique_key.lower()
+        risk = self.risks.get(unique_key)
+        if risk is None:
+            risk = self.risks[unique_key] = MarketRisk()
+        return risk
+
+    def volatility(self, unique_key: str) -> float:
+        """
+        @:dev Get the per-block volatility of a market's oracle price.
+
+        Args:
+            unique_key (str): The market unique key.
+
+        Returns:
+            float: The standard deviation of per-block log returns, at least min_volatility.
+        """
+        return max(math.sqrt(self.risk(unique_key).variance), self.min_volatility)
+
+    def observe_prices(self, snapshots: Dict[str, MarketSnapshot]):
+        """
+        @:dev Update price volatilities from a block's snapshots and flag markets turning hot.
+
+        Args:
+            snapshots (Dict[str, MarketSnapshot]): The snapshots of the block keyed by unique key.
+        """
+        for unique_key, snapshot in snapshots.items():
+            risk = self.risk(unique_key)
+            price = snapshot.price
+            if price <= 0:
+                continue
+            if risk.last_price:
+                log_return = math.log(price / risk.last_price)
+                risk.variance = self.decay * risk.variance + (1 - self.decay) * log_return ** 2
+            risk.last_price = price
+            if risk.min_health_factor is not None and risk.scan_price:
+                estimated = risk.min_health_factor * price / risk.scan_price
+                if estimated < 1 + self.hot_margin:
+                    risk.next_block = 0
+
+    def record_scan(self, unique_key: str, block_number: int, min_health_factor: Optional[float]):
+        """
+        @:dev Record a complete scan of a market and schedule its next one. Scans that failed or
+        were cut short must not be recorded, the market then keeps its previous health factor and
+        stays due.
+
+        Args:
+            unique_key (str): The market unique key.
+            block_number (int): The block the market was scanned at.
+            min_health_factor (float): The lowest health factor found, None if it has no debt.
+        """
+        risk = self.risk(unique_key)
+        risk.scanned = True
+        risk.min_health_factor = min_health_factor
+        risk.scan_price = risk.last_price
+        risk.interval = self.interval(unique_key)
+        risk.next_block = block_number + risk.interval
+
+    def interval(self, unique_key: str) -> int:
+        """
+        @:dev Get the number of blocks until a market needs its next scan.
+
+        Args:
+            unique_key (str): The market unique key.
+
+        Returns:
+            int: The interval, between 1 and max_interval, the latter for markets without debt.
+        """
+        health = self.risk(unique_key).min_health_factor
+        if health is None or math.isinf(health):
+            return self.max_interval
+        if health < 1 + self.hot_margin:
+            return 1
+        blocks = (math.log(health) / (self.confidence * self.volatility(unique_key))) ** 2
+        return max(1, min(self.max_interval, int(blocks)))
+
+    def due(self, unique_key: str, block_number: int) -> bool:
+        """
+        @:dev Check whether a market is scanned at a block, markets never scanned always are.
+
+        Args:
+            unique_key (str): The market unique key.
+            block_number (int): The block number.
+
+        Returns:
+            bool: True if the market should be scanned.
+        """
+        risk = self.risk(unique_key)
+        return not risk.scanned or block_number >= risk.next_block
+
+    def trigger(self, unique_key: str):
+        """
+        @:dev Make a market due on the next block, e.g. after an oracle update.
+
+        Args:
+            unique_key (str): The market unique key.
+        """
+        self.risk(unique_key).next_block = 0
@@ -0,0 +1,182 @@
+import asyncio
+import math
+import os
+import socket
+import traceback
+import uuid
+from typing import Iterable, List, Optional, Set
+
+from bot_utils.hash_ring import ConsistentHashRing
+from bot_utils.helpers import redis_instance
+
+NODES_KEY = "leases:nodes"
+
+# Extend or delete a lease only while this node still holds it
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def lease_key(unique_key: str) -> str:
+    """
+    @:dev Get the Redis key of a market's lease.
+
+    Args:
+        unique_key (str): The market unique key.
+
+    Returns:
+        str: The lease key.
+    """
+    return f"lease:market:{unique_key.lower()}"
+
+
+class LeaseManager:
+    node_id: str
+    owned: Set[str]
+
+    def __init__(self, node_id: Optional[str] = None, ttl: float = 15, heartbeat_interval: float = 5):
+        """
+        @:dev Per-market work leases shared by every bot node through Redis.
+
+        @:dev A lease is a key holding the owner's node id with a TTL, taken with SET NX PX and
+        renewed or released by Lua scripts that check the owner first. Nodes heartbeat into a
+        sorted set scored by Redis time, those silent for a TTL are considered dead and their
+        leases expire on their own, so live nodes take the markets over.
+        @:dev Each node holds at most its fair share, ceil(markets / live nodes), preferring the
+        markets a consistent hash ring of the live nodes assigns to it so ownership stays put
+        while the set of nodes is stable. Nodes above their share after another node joined
+        release the extra markets.
+
+        Args:
+            node_id (str): The id of this node, hostname, pid and a random suffix if omitted.
+            ttl (float): Seconds a lease and a heartbeat stay valid without renewal.
+            heartbeat_interval (float): Seconds between heartbeats, well below ttl.
+        """
+        self.node_id = node_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.ttl_ms = int(ttl * 1000)
+        self.heartbeat_interval = heartbeat_interval
+        self.owned = set()
+        self.renew_script = redis_instance.register_script(RENEW_SCRIPT)
+        self.release_script = redis_instance.register_script(RELEASE_SCRIPT)
+
+    def owns(self, unique_key: str) -> bool:
+        """
+        @:dev Check whether this node holds a market's lease.
+
+        Args:
+            unique_key (str): The market unique key.
+
+        Returns:
+            bool: True if the market is worked on by this node.
+        """
+        return unique_key.lower() in self.owned
+
+    async def run(self, unique_keys: Iterable[str]):
+        """
+        @:dev Heartbeat and rebalance until cancelled, then release every lease.
+
+        Args:
+            unique_keys (Iterable[str]): The unique keys of all markets.
+        """
+        unique_keys = list(unique_keys)
+        try:
+            while True:
+                await asyncio.sleep(self.heartbeat_interval)
+                try:
+                    await self.rebalance(unique_keys)
+                except Exception:
+                    print("Error renewing market leases")
+                    print(traceback.format_exc())
+        finally:
+            await self.release_all()
+
+    async def rebalance(self, unique_keys: Iterable[str]) -> Set[str]:
+        """
+        @:dev Heartbeat, renew held leases and move towards this node's fair share.
+
+        Args:
+            unique_keys (Iterable[str]): The unique keys of all markets.
+
+        Returns:
+            Set[str]: The lowercased unique keys of the markets this node holds.
+        """
+        keys = sorted({unique_key.lower() for unique_key in unique_keys})
+        nodes = await self.heartbeat()
+        share = math.ceil(len(keys) / len(nodes)) if keys else 0
+        ring = ConsistentHashRing(nodes)
+        preferred = {key for key in keys if ring.node_for(key) == self.node_id}
+
+        for key in list(self.owned):
+            if key not in keys or not await self.renew_script(keys=[lease_key(key)],
+                                                              args=[self.node_id, self.ttl_ms]):
+                self.owned.discard(key)
+
+        if len(self.owned) > share:
+            extra = sorted(self.owned, key=lambda key: key in preferred)[:len(self.owned) - share]
+            for key in extra:
+                await self.release(key)
+
+        candidates = [key for key in keys if key not in self.owned]
+        if len(self.owned) < share and candidates:
+            # Preferred markets first, then markets of dead or overloaded nodes
+            candidates.sort(key=lambda key: key not in preferred)
+            holders = await redis_instance.mget([lease_key(key) for key in candidates])
+            for key, holder in zip(candidates, holders):
+                if len(self.owned) >= share:
+                    break
+                if holder is None and await redis_instance.set(lease_key(key), self.node_id,
+                                                               nx=True, px=self.ttl_ms):
+                    self.owned.add(key)
+        return self.owned
+
+    async def heartbeat(self) -> List[str]:
+        """
+        @:dev Record this node as alive and drop nodes silent for longer than the TTL.
+
+        Returns:
+            List[str]: The ids of the live nodes, this one included.
+        """
+        seconds, microseconds = await redis_instance.time()
+        now = seconds * 1000 + microseconds // 1000
+        pipe = redis_instance.pipeline(transaction=True)
+        pipe.zadd(NODES_KEY, {self.node_id: now})
+        pipe.zremrangebyscore(NODES_KEY, "-inf", now - self.ttl_ms)
+        pipe.zrange(NODES_KEY, 0, -1)
+        _, _, members = await pipe.execute()
+        nodes = [member.decode() if isinstance(member, bytes) else member for member in members]
+        if self.node_id not in nodes:
+            nodes.append(self.node_id)
+        return nodes
+
+    async def release(self, unique_key: str):
+        """
+        @:dev Give up a market's lease if this node still holds it.
+
+        Args:
+            unique_key (str): The market unique key.
+        """
+        self.owned.discard(unique_key.lower())
+        await self.release_script(keys=[lease_key(unique_key)], args=[self.node_id])
+
+    async def release_all(self):
+        """
+        @:dev Give up every lease and leave the set of live nodes, e.g. on shutdown.
+        """
+        for key in list(self.owned):
+            try:
+                await self.release(key)
+            except Exception:
+                print(f"Error releasing lease of market {key}")
+        try:
+            await redis_instance.zrem(NODES_KEY, self.node_id)
+        except Exception:
+            print("Error leaving the set of live nodes")
@@ -0,0 +1,159 @@
+import bisect
+import math
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from bot_utils.health_engine import MarketSnapshot
+from bot_utils.helpers import ORACLE_PRICE_SCALE, VIRTUAL_ASSETS, VIRTUAL_SHARES, WAD, to_assets_up
+
+# Relative float error tolerated when bisecting, candidates are confirmed with exact integer math.
+# Rounding of borrowed assets can exceed it only for dust positions a few wei from their threshold
+RATIO_TOLERANCE = 1e-9
+
+
+def liquidation_price(borrowed: int, collateral: int, lltv: int) -> Union[int, float]:
+    """
+    @:dev Compute the lowest oracle price at which a position is healthy.
+
+    @:dev Inverts the rounding of Morpho's health check, a position is liquidatable iff
+    floor(floor(collateral * price / ORACLE_PRICE_SCALE) * lltv / WAD) < borrowed, i.e. iff the
+    price is below ceil(ceil(borrowed * WAD / lltv) * ORACLE_PRICE_SCALE / collateral).
+
+    Args:
+        borrowed (int): The borrowed assets of the position.
+        collateral (int): The collateral of the position.
+        lltv (int): The WAD scaled liquidation loan-to-value of the market.
+
+    Returns:
+        Union[int, float]: The liquidation price, 0 without debt and math.inf for debt without
+        collateral, which no price makes healthy.
+    """
+    if borrowed == 0:
+        return 0
+    if collateral == 0 or lltv == 0:
+        return math.inf
+    max_borrow_needed = -(-borrowed * WAD // lltv)
+    return -(-max_borrow_needed * ORACLE_PRICE_SCALE // collateral)
+
+
+class LiquidationLadder:
+    entries: List[Tuple[float, str]]
+    balances: Dict[str, Tuple[int, int]]
+
+    def __init__(self):
+        """
+        @:dev The borrow positions of one market sorted by their liquidation price.
+
+        @:dev A position's liquidation price is its borrow shares per unit of collateral times the
+        market's share price and a market constant, so the order of positions by
+        borrow_shares / collateral is the order of their liquidation prices at any oracle price
+        and any borrow totals. The ladder keeps that ratio sorted, a new price then maps to a
+        threshold ratio and the liquidatable positions are everything above it, found by
+        bisection and confirmed with exact integer math.
+        """
+        self.entries = []
+        self.balances = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def update(self, borrower: str, borrow_shares: Optional[int], collateral: Optional[int]):
+        """
+        @:dev Insert or move a position, positions without debt are removed.
+
+        Args:
+            borrower (str): The borrower address, in any case.
+            borrow_shares (int): The position's borrow shares.
+            collateral (int): The position's collateral.
+        """
+        borrower = borrower.lower()
+        if borrow_shares is None or collateral is None:
+            return
+        borrow_shares = int(borrow_shares)
+        collateral = int(collateral)
+        known = self.balances.get(borrower)
+        if known == (borrow_shares, collateral):
+            return
+        if known is not None:
+            self.__discard(borrower, known)
+        if borrow_shares <= 0:
+            self.balances.pop(borrower, None)
+            return
+        self.balances[borrower] = (borrow_shares, collateral)
+        bisect.insort(self.entries, (self.ratio(borrow_shares, collateral), borrower))
+
+    def remove(self, borrower: str):
+        """
+        @:dev Remove a position.
+
+        Args:
+            borrower (str): The borrower address, in any case.
+        """
+        borrower = borrower.lower()
+        known = self.balances.pop(borrower, None)
+        if known is not None:
+            self.__discard(borrower, known)
+
+    def retain(self, borrowers: Iterable[str]):
+        """
+        @:dev Remove every position whose borrower is not in the given set.
+
+        Args:
+            borrowers (Iterable[str]): The lowercased addresses of the borrowers to keep.
+        """
+        kept = set(borrowers)
+        if all(borrower in kept for borrower in self.balances):
+            return
+        self.balances = {borrower: balances for borrower, balances in self.balances.items() if borrower in kept}
+        self.entries = [entry for entry in self.entries if entry[1] in kept]
+
+    def __discard(self, borrower: str, balances: Tuple[int, int]):
+        """
+        @:dev Delete a position's entry found by bisection on its ratio.
+
+        Args:
+            borrower (str): The lowercased borrower address.
+            balances (Tuple[int, int]): The borrow shares and collateral the entry was made with.
+        """
+        entry = (self.ratio(*balances), borrower)
+        index = bisect.bisect_left(self.entries, entry)
+        if index < len(self.entries) and self.entries[index] == entry:
+            del self.entries[index]
+
+    @staticmethod
+    def ratio(borrow_shares: int, collateral: int) -> float:
+        """
+        @:dev Get the ladder key of a position.
+
+        Args:
+            borrow_shares (int): The position's borrow shares.
+            collateral (int): The position's collateral.
+
+        Returns:
+            float: borrow_shares / collateral, infinite without collateral.
+        """
+        return borrow_shares / collateral if collateral > 0 else math.inf
+
+    def liquidatable(self, snapshot: MarketSnapshot) -> List[str]:
+        """
+        @:dev Get the positions liquidatable at a snapshot's oracle price and borrow totals.
+
+        Args:
+            snapshot (MarketSnapshot): The market's oracle price, borrow totals and LLTV.
+
+        Returns:
+            List[str]: The lowercased addresses of the liquidatable borrowers, most indebted per
+            unit of collateral last.
+        """
+        if not self.entries:
+            return []
+        # Position liquidatable iff ratio > price * lltv / (share price * ORACLE_PRICE_SCALE * WAD)
+        share_price = (snapshot.total_borrow_assets + VIRTUAL_ASSETS) / (snapshot.total_borrow_shares + VIRTUAL_SHARES)
+        threshold = snapshot.price * snapshot.lltv / (share_price * ORACLE_PRICE_SCALE * WAD)
+        start = bisect.bisect_left(self.entries, (threshold * (1 - RATIO_TOLERANCE), ""))
+        liquidatable = []
+        for _, borrower in self.entries[start:]:
+            borrow_shares, collateral = self.balances[borrower]
+            borrowed = to_assets_up(borrow_shares, snapshot.total_borrow_assets, snapshot.total_borrow_shares)
+            if snapshot.price < liquidation_price(borrowed, collateral, snapshot.lltv):
+                liquidatable.append(borrower)
+        return liquidatable
@@ -0,0 +1,191 @@
+import heapq
+import itertools
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar
+
+from bot_utils.helpers import WAD
+from bot_utils.preflight import Call
+from models.market_positions import MarketPosition
+
+K = TypeVar("K")
+
+# Morpho Blue's liquidation incentive parameters
+MAX_LIQUIDATION_INCENTIVE_FACTOR = 1.15
+LIQUIDATION_CURSOR = 0.3
+
+# Largest number of knapsack capacity slots, gas weights are rounded up to budget / slots
+MAX_CAPACITY_SLOTS = 2000
+
+
+def liquidation_incentive_factor(lltv: int) -> float:
+    """
+    @:dev Compute Morpho Blue's liquidation incentive factor of a market.
+
+    Args:
+        lltv (int): The WAD scaled liquidation loan-to-value of the market.
+
+    Returns:
+        float: The factor applied to repaid assets to get the seized collateral value.
+    """
+    return min(MAX_LIQUIDATION_INCENTIVE_FACTOR,
+               1 / (1 - LIQUIDATION_CURSOR * (1 - lltv / WAD)))
+
+
+def expected_profit_usd(position: MarketPosition) -> Optional[float]:
+    """
+    @:dev Estimate the USD value earned by fully liquidating a position, before gas.
+
+    @:dev The seized collateral is worth the debt times the incentive factor, or all the
+    collateral once the position is underwater. The profit is the incentive share of it.
+
+    Args:
+        position (MarketPosition): The position.
+
+    Returns:
+        float: The expected profit, None if the position has no USD values or LLTV.
+    """
+    if (position.borrow_assets_usd is None or position.collateral_usd is None
+            or position.market is None or position.market.lltv is None):
+        return None
+    factor = liquidation_incentive_factor(position.market.lltv)
+    seized = min(position.collateral_usd, position.borrow_assets_usd * factor)
+    return seized * (1 - 1 / factor)
+
+
+class LiquidationQueue(Generic[K]):
+
+    def __init__(self, native_token_price_usd: float = 3000.0, max_candidates: int = 256):
+        """
+        @:dev Priority queue of liquidation candidates ranked by expected profit.
+
+        @:dev Candidates with USD values are ranked by expected profit, those without (e.g.
+        positions from the position book) come after them in the order they were pushed. Only
+        the best max_candidates are simulated per cycle, the rest wait for the next one.
+
+        Args:
+            native_token_price_usd (float): The USD price of the token gas is paid in.
+            max_candidates (int): The largest number of candidates taken per cycle.
+        """
+        self.native_token_price_usd = native_token_price_usd
+        self.max_candidates = max_candidates
+        self.heap: List[Tuple[bool, float, int, K, Call]] = []
+        self.profits: Dict[K, Optional[float]] = {}
+        self.counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def push(self, key: K, call: Call, position: MarketPosition):
+        """
+        @:dev Add a candidate.
+
+        Args:
+            key (K): The key of the candidate, unique within the queue.
+            call (Call): The liquidation call.
+            position (MarketPosition): The position being liquidated.
+        """
+        profit = expected_profit_usd(position)
+        self.profits[key] = profit
+        heapq.heappush(self.heap, (profit is None, -(profit or 0.0), next(self.counter), key, call))
+
+    def ranked(self) -> List[Tuple[K, Call]]:
+        """
+        @:dev Pop the best candidates in priority order.
+
+        Returns:
+            List[Tuple[K, Call]]: At most max_candidates candidates, most profitable first.
+        """
+        ranked = []
+        while self.heap and len(ranked) < self.max_candidates:
+            _, _, _, key, call = heapq.heappop(self.heap)
+            ranked.append((key, call))
+        return ranked
+
+    def gas_cost_usd(self, gas: int, gas_price: int) -> float:
+        """
+        @:dev Convert gas to its USD cost.
+
+        Args:
+            gas (int): The gas used.
+            gas_price (int): The price per gas, in wei.
+
+        Returns:
+            float: The USD cost.
+        """
+        return gas * gas_price / WAD * self.native_token_price_usd
+
+    def pack(self, keys: List[K], gas_per_call: List[int], budget: int, gas_price: int) -> List[int]:
+        """
+        @:dev Choose the calls of a bundle maximizing the expected profit within a gas budget.
+
+        @:dev Calls whose profit does not cover their own gas are left out. The rest is packed
+        with a 0/1 knapsack over gas rounded up to at most MAX_CAPACITY_SLOTS slots, so the
+        chosen calls always fit. Candidates without a USD value fill the gas left afterwards in
+        rank order.
+
+        Args:
+            keys (List[K]): The keys of the simulated calls in rank order.
+            gas_per_call (List[int]): The gas estimate of each call.
+            budget (int): The gas available to the calls.
+            gas_price (int): The price per gas the bundle pays at most, in wei.
+
+        Returns:
+            List[int]: The indices of the chosen calls in rank order.
+        """
+        priced = []
+        unpriced = []
+        for index, (key, gas) in enumerate(zip(keys, gas_per_call)):
+            profit = self.profits.get(key)
+            if profit is None:
+                unpriced.append(index)
+                continue
+            value = profit - self.gas_cost_usd(gas, gas_price)
+            if value > 0:
+                priced.append((index, gas, value))
+
+        if sum(gas for _, gas, _ in priced) <= budget:
+            chosen = [index for index, _, _ in priced]
+        else:
+            chosen = knapsack(priced, budget)
+        used = sum(gas_per_call[index] for index in chosen)
+        for index in unpriced:
+            if used + gas_per_call[index] <= budget:
+                used += gas_per_call[index]
+                chosen.append(index)
+        return sorted(chosen)
+
+
+def knapsack(items: List[Tuple[int, int, float]], budget: int) -> List[int]:
+    """
+    @:dev Solve a 0/1 knapsack over gas.
+
+    @:dev Exact for budgets up to MAX_CAPACITY_SLOTS gas. Above that, gas is rounded up to whole
+    slots, so the chosen items always fit but the packing can fall slightly short of the optimum.
+
+    Args:
+        items (List[Tuple[int, int, float]]): The index, gas and value of each item.
+        budget (int): The gas available.
+
+    Returns:
+        List[int]: The indices of the chosen items.
+    """
+    slot = max(1, -(-budget // MAX_CAPACITY_SLOTS))
+    capacity = budget // slot
+    best = [0.0] * (capacity + 1)
+    taken = []
+    for _, gas, value in items:
+        weight = -(-gas // slot)
+        row = bytearray(capacity + 1)
+        for remaining in range(capacity, weight - 1, -1):
+            candidate = best[remaining - weight] + value
+            if candidate > best[remaining]:
+                best[remaining] = candidate
+                row[remaining] = 1
+        taken.append(row)
+
+    chosen = []
+    remaining = capacity
+    for (index, gas, _), row in zip(reversed(items), reversed(taken)):
+        if row[remaining]:
+            chosen.append(index)
+            remaining -= -(-gas // slot)
+    return chosen
@@ -0,0 +1,88 @@
+from dataclasses import dataclass, field
+from typing import Generic, List, Optional, TypeVar, Union, Type
+
+from eth_utils import event_abi_to_log_topic
+from web3.contract import AsyncContract, Contract
+from web3.types import TxReceipt
+
+K = TypeVar("K")
+
+
+@dataclass
+class LiquidationOutcome(Generic[K]):
+    key: K
+    call_index: int
+    borrower: str
+    seized_assets: int
+    repaid_assets: int
+    loan_token: str
+    balance: int
+    # Morpho invoked the liquidator's callback for this call
+    callback: bool
+
+
+@dataclass
+class ReceiptResults(Generic[K]):
+    outcomes: List[LiquidationOutcome[K]] = field(default_factory=list)
+    failed: List[K] = field(default_factory=list)
+
+
+def decode_receipt(liquidator_contract: Union[Type[Contract], Contract, AsyncContract], receipt: TxReceipt,
+                   keys: List[K], borrowers: Optional[List[str]] = None) -> ReceiptResults[K]:
+    """
+    @:dev Attribute the events of a liquidation bundle's receipt to the calls of the bundle.
+
+    @:dev Only logs emitted by the liquidator are decoded, matched on their event topic. Liqudated
+    indexes a struct, only its hash is logged so its presence is all that is used.
+    @:dev Calls run in bundle order and every successful liquidation emits Liqudated from Morpho's
+    callback and then LiquidationResults, so each LiquidationResults belongs to the next call of
+    its borrower. Calls skipped over emitted nothing and reverted inside tryAggregate.
+
+    Args:
+        liquidator_contract: The liquidator contract the bundle was sent to.
+        receipt (TxReceipt): The receipt of the bundle.
+        keys (List[K]): The key of each call in bundle order.
+        borrowers (List[str]): The borrower of each call, the keys themselves when omitted.
+
+    Returns:
+        ReceiptResults[K]: The outcome of each successful call and the keys of failed calls.
+    """
+    borrowers = [str(borrower).lower() for borrower in (borrowers if borrowers is not None else keys)]
+    results = ReceiptResults()
+    if receipt.get("status", 0) != 1:
+        results.failed = list(keys)
+        return results
+
+    results_event = liquidator_contract.events.LiquidationResults()
+    results_topic = event_abi_to_log_topic(results_event.abi)
+    callback_topic = event_abi_to_log_topic(liquidator_contract.events.Liqudated().abi)
+    address = liquidator_contract.address.lower()
+    next_call = 0
+    callback = False
+    for log in receipt["logs"]:
+        if log["address"].lower() != address or not log["topics"]:
+            continue
+        topic = bytes(log["topics"][0])
+        if topic == callback_topic:
+            callback = True
+            continue
+        if topic != results_topic:
+            continue
+        args = results_event.process_log(log)["args"]
+        borrower = args["borrower"].lower()
+        index = next_call
+        while index < len(borrowers) and borrowers[index] != borrower:
+            index += 1
+        if index == len(borrowers):
+            print(f"LiquidationResults for {borrower} matches no call of the bundle")
+            continue
+        results.failed += keys[next_call:index]
+        results.outcomes.append(LiquidationOutcome(key=keys[index], call_index=index, borrower=borrower,
+                                                   seized_assets=args["seizedAssets"],
+                                                   repaid_assets=args["repaidAssets"],
+                                                   loan_token=args["loanToken"], balance=args["balance"],
+                                                   callback=callback))
+        next_call = index + 1
+        callback = False
+    results.failed += keys[next_call:]
+    return results
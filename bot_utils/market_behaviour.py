@@ -1,52 +1,152 @@
+import asyncio
 import traceback
-from typing import List, Union, Type
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple, Union, Type
 
-import requests
 from eth_account.signers.local import LocalAccount
 from eth_typing import HexStr
 from web3 import Web3
-from web3.contract import Contract
+from web3.contract import AsyncContract, Contract
+from web3.types import TxReceipt
 
-from bot_utils.helpers import get_cache, div_down_wad, store_cache
-from models.market_positions import MarketPosition, MarketsPositionResponse
+from bot_utils.adaptive_batcher import AdaptiveBatcher
+from bot_utils.graphql_client import GraphQLClient
+from bot_utils.health_engine import MarketSnapshot, prefilter_positions
+from bot_utils.market_snapshot import MarketSnapshotCache
+from bot_utils.position_book import PositionBook, BookEntry
+from bot_utils.position_index import PositionIndex, PositionSource
+from bot_utils.helpers import div_down_wad, revert_reason
+from bot_utils.liquidation_ladder import LiquidationLadder
+from bot_utils.liquidation_queue import LiquidationQueue
+from bot_utils.liquidation_results import decode_receipt
+from bot_utils.preflight import Preflight
+from bot_utils.tx_manager import TransactionManager
+from bot_utils.position_store import load_positions, store_positions
+from bot_utils.position_stream import PositionFetchError, stream_market_positions, MAX_PAGE_SIZE
+from models.market_positions import MarketPosition
 from models.markets import Market
 
 
 class MarketBehaviour:
     market: Market
     positions: List[MarketPosition]
-    url: str
+    graphql_client: GraphQLClient
     liquidator_contract: Union[Type[Contract], Contract]
+    async_liquidator_contract: AsyncContract
+    snapshot_cache: MarketSnapshotCache
+    batcher: AdaptiveBatcher
+    position_book: Optional[PositionBook]
     web3: Web3
     account: LocalAccount
+    prefilter_margin: float
 
-    def __init__(self, market: Market, url: str, web3: Web3,
+    def __init__(self, market: Market, graphql_client: GraphQLClient, web3: Web3,
                  liquidator_contract: Contract,
-                 account: LocalAccount):
+                 account: LocalAccount, snapshot_cache: MarketSnapshotCache = None,
+                 prefilter_margin: float = 0.05, batcher: AdaptiveBatcher = None,
+                 async_liquidator_contract: AsyncContract = None, position_book: PositionBook = None,
+                 preflight: Preflight = None, tx_manager: TransactionManager = None,
+                 native_token_price_usd: float = 3000.0, max_liquidation_candidates: int = 256):
         """
-        @:dev Initialize the MarketBehaviour instance with market data, URL, Web3 instance,
+        @:dev Initialize the MarketBehaviour instance with market data, GraphQL client, Web3 instance,
         liquidator contract, multi-call contract, and account.
         Args:
          market: Market data
-         url: URL for API requests
+         graphql_client: Shared GraphQL client for API requests
          web3: Web3 instance for blockchain interactions
          liquidator_contract: Contract instance for liquidations
          account: LocalAccount instance for transactions
+         snapshot_cache: Shared per block cache of market totals and oracle prices
+         prefilter_margin: Positions whose off-chain health factor is above 1 + margin skip
+         on-chain confirmation
+         batcher: Shared adaptive batcher sizing the health check multicalls
+         async_liquidator_contract: AsyncWeb3 contract instance used for non-blocking reads
+         position_book: Event-sourced position book, positions are read from it instead of the API
+         when set
+         preflight: Shared pre-flight stage simulating and sizing liquidation bundles
+         tx_manager: Shared transaction manager sending liquidations from the account
+         native_token_price_usd: USD price of the gas token, used to weigh profits against gas
+         max_liquidation_candidates: Largest number of liquidations simulated per cycle, the most
+         profitable first
         """
         self.market = market
-        self.url = url
+        self.graphql_client = graphql_client
         self.web3 = web3
         self.liquidator_contract = liquidator_contract
+        self.async_liquidator_contract = async_liquidator_contract
         self.account = account
+        self.snapshot_cache = snapshot_cache
+        self.batcher = batcher if batcher is not None else AdaptiveBatcher()
+        self.prefilter_margin = prefilter_margin
         self.positions = []
+        self.min_health_factor: Optional[float] = None
+        # False while a scan runs and after a scan whose positions could not all be fetched
+        self.scan_complete = False
+        self.index = PositionIndex()
+        self.ladder = LiquidationLadder()
+        self.page_size = MAX_PAGE_SIZE
+        self.position_feed: Optional[asyncio.Queue] = None
+        self.position_book = position_book
+        self.book_positions: Dict[str, MarketPosition] = {}
+        # Lowercased borrowers liquidated by a sent transaction that is not mined yet
+        self.in_flight: Set[str] = set()
+        if preflight is None and async_liquidator_contract is not None:
+            preflight = Preflight(web3=async_liquidator_contract.w3,
+                                  liquidator_contract=async_liquidator_contract)
+        self.preflight = preflight
+        if tx_manager is None and async_liquidator_contract is not None:
+            tx_manager = TransactionManager(web3=async_liquidator_contract.w3, account=account)
+        self.tx_manager = tx_manager
+        self.native_token_price_usd = native_token_price_usd
+        self.max_liquidation_candidates = max_liquidation_candidates
 
-    async def init(self):
+    async def scan(self) -> bool:
         """
-        @:dev Initialize the market positions by fetching them from the API.
+        @:dev Fetch and evaluate the market positions page by page.
+
+        @:dev Every API page is evaluated as soon as it arrives while the next page is still
+        loading. Positions are merged into the position index first, so a borrower is evaluated
+        once per cycle, and cached positions the API did not return are evaluated last. Only
+        unhealthy positions are retained.
+
+        Returns:
+            bool: True if every position was fetched, False if the scan was cut short by an
+            error, in which case min_health_factor only covers the positions seen.
         """
-        await self.get_positions()
+        self.index = PositionIndex()
+        self.min_health_factor = None
+        self.scan_complete = False
         await self.get_positions_db()
-        self.positions = [position for position in self.positions if not position.liquidated]
+        unhealthy = []
+        try:
+            async for page in self.stream_positions():
+                print(f"Found {len(page)} positions on market {self.market.unique_key}")
+                fresh = self.index.merge(page, PositionSource.LIVE)
+                unhealthy += await self.evaluate_positions(fresh, await self.get_snapshot())
+            self.scan_complete = True
+        except Exception:
+            print("Error in scan")
+            print(traceback.format_exc())
+        cached = self.index.pending(PositionSource.CACHE)
+        if cached:
+            unhealthy += await self.evaluate_positions(cached, await self.get_snapshot())
+        self.positions = unhealthy
+        self.sync_ladder(self.scan_complete)
+        print("Market {} has {} potential positions to be liquidated".format(
+            self.market.unique_key,
+            len(self.positions)))
+        return self.scan_complete
+
+    def assign_positions(self, positions: List[MarketPosition]):
+        """
+        @:dev Take over unhealthy positions scanned elsewhere, e.g. by a worker process, so they
+        can be liquidated from here.
+
+        Args:
+            positions (List[MarketPosition]): The unhealthy positions of this market.
+        """
+        self.index = PositionIndex()
+        self.index.merge(positions, PositionSource.LIVE)
+        self.positions = self.index.pending()
 
     async def start_liquidations(self):
         """
@@ -54,17 +154,29 @@ class MarketBehaviour:
 
         @:dev This function encodes liquidation calls for each unhealthy position and
         executes them using a multi-call function within the liquidation contract via delegatecall.
+        @:dev Candidates are ranked by expected profit and the bundle is packed knapsack-style
+        within the gas limit, so the most profitable liquidations go first and those that do not
+        pay for their own gas are skipped.
+        @:dev The bundle goes through the pre-flight stage first: calls that would revert are
+        dropped and the gas limit is sized from the bundle's own estimate. The transaction itself
+        uses tryAggregate so a call that starts failing after the simulation only reverts its own
+        liquidation, and is sent through the shared transaction manager which returns once it is
+        broadcast. Borrowers of a transaction still in flight are left out of later bundles.
+        @:dev Results are decoded from the transaction's own receipt in the background and
+        attributed to the calls of the bundle, only borrowers liquidated by this transaction are
+        marked.
         """
         print("Attempting to liquidate {} positions".format(len(self.positions)))
         if len(self.positions) == 0:
             return
 
-        calls = []
-        liquidated_positions = []
+        queue = LiquidationQueue(native_token_price_usd=self.native_token_price_usd,
+                                 max_candidates=self.max_liquidation_candidates)
 
         for index, position in enumerate(self.positions):
             try:
                 if (position.user is None
+                        or position.user.address.lower() in self.in_flight
                         or position.market is None
                         or position.market.loan_asset is None
                         or position.market.collateral_asset is None
@@ -76,87 +188,235 @@ class MarketBehaviour:
                 call = self.liquidator_contract.encodeABI(fn_name='fullLiquidationWithoutCollat',
                                                           args=[market_param,
                                                                 position.user.address, True])
-                calls.append((self.liquidator_contract.address, call))
+                queue.push(position.user.address, (self.liquidator_contract.address, call), position)
             except Exception as e:
                 print(f"Error processing position {index} for liquidation: {e}")
                 print(traceback.format_exc())
                 continue
 
         try:
-            block = self.web3.eth.get_block('latest')
-            block_number = block.get('number', 'latest')
-            multi_call_tx = self.liquidator_contract.functions.aggregate(calls).transact(
-                transaction={
-                    "from": self.account.address,
-                    "nonce": self.web3.eth.get_transaction_count(self.account.address),
-                    "gas": 30000000
-                })
-            receipt = self.web3.eth.get_transaction_receipt(transaction_hash=multi_call_tx)
-            events = self.liquidator_contract.events.LiquidationResults.get_logs(
-                fromBlock=block_number - 300 if isinstance(block_number, int) else 'latest')
-            print("liquidation transaction status: ", receipt.get('status', 0), " events: ", events)
-
-            for event in events:
-                liquidated_user = event['args']['borrower']
-                for position in self.positions:
-                    if position.user.address == liquidated_user:
-                        position.liquidated = True
-                        liquidated_positions.append(position.to_dict())
-
-            await store_cache(self.market.unique_key, liquidated_positions)
+            entries = queue.ranked()
+            if len(queue):
+                print(f"Deferring {len(queue)} less profitable liquidations to the next cycle")
+            max_fee, _ = await self.tx_manager.fee_strategy.fees()
+            bundle = await self.preflight.run(
+                entries, self.account.address,
+                pack=lambda keys, gas_per_call, budget: queue.pack(keys, gas_per_call, budget, max_fee))
+            for borrower, reason in bundle.failed:
+                print(f"Liquidation of {borrower} dropped by pre-flight: {reason}")
+            if not bundle.calls:
+                return
+            print(f"Sending {len(bundle.calls)} liquidations with a gas limit of {bundle.gas_limit}")
+            keys = list(bundle.keys)
+            borrowers = {key.lower() for key in keys}
+            self.in_flight |= borrowers
+            try:
+                await self.tx_manager.send(
+                    self.async_liquidator_contract.functions.tryAggregate(False, bundle.calls), gas=bundle.gas_limit,
+                    on_receipt=lambda receipt: self.on_liquidation_receipt(receipt, keys))
+            except Exception:
+                self.in_flight -= borrowers
+                raise
         except Exception:
             print("Error executing liquidation transactions")
             print(traceback.format_exc())
 
-    async def get_positions(self):
+    async def on_liquidation_receipt(self, receipt: Optional[TxReceipt], keys: List[str]):
         """
-        @:dev Fetch market positions from the API and update the instance's positions
-        attribute.
+        @:dev Record the results of a mined liquidation transaction.
 
-        This function also handles any exceptions that occur during the process and prints traceback
-        information for debugging.
+        Args:
+            receipt (TxReceipt): The receipt of the transaction, None if it was never mined.
+            keys (List[str]): The borrowers of the bundle's calls, in call order.
         """
         try:
-            query = self.__build_market_query()
-            variables = {"uniqueKey": self.market.unique_key}
-            response = requests.post(url=self.url, json={"query": query, "variables": variables})
-            if response.status_code == 200:
-                position_data = response.json()
-                positions = MarketsPositionResponse.from_dict(position_data).market_positions
-                self.positions += positions
-                print(f"Found {len(self.positions)} positions on market {self.market.unique_key}")
+            if receipt is None:
+                return
+            results = decode_receipt(self.liquidator_contract, receipt, keys)
+            print(f"Liquidation transaction {receipt['transactionHash'].hex()} status {receipt.get('status', 0)}: "
+                  f"{len(results.outcomes)} of {len(keys)} liquidations succeeded")
+            for outcome in results.outcomes:
+                print(f"Liquidated {outcome.borrower} (call {outcome.call_index}): seized {outcome.seized_assets}, "
+                      f"repaid {outcome.repaid_assets} of {outcome.loan_token}")
+            for borrower in results.failed:
+                print(f"Liquidation of {borrower} reverted in the bundle")
+
+            liquidated = self.index.mark_liquidated(outcome.borrower for outcome in results.outcomes)
+            for outcome in results.outcomes:
+                self.ladder.remove(outcome.borrower)
+            await store_positions(self.market.unique_key, [position.to_dict() for position in liquidated])
+        finally:
+            self.in_flight -= {key.lower() for key in keys}
+
+    def sync_ladder(self, complete: bool):
+        """
+        @:dev Bring the liquidation ladder in line with the positions of the position index.
+
+        @:dev Borrowers missing from the index are only removed after a complete scan, a scan cut
+        short did not see them and the ladder keeps their last known balances.
+
+        Args:
+            complete (bool): True if the index holds every position of the market.
+        """
+        pending = self.index.pending()
+        for position in pending:
+            self.ladder.update(position.user.address, position.borrow_shares, position.collateral)
+        if complete:
+            self.ladder.retain(position.user.address.lower() for position in pending)
+
+    async def check_ladder(self, snapshot: Optional[MarketSnapshot] = None) -> int:
+        """
+        @:dev Find the positions made liquidatable by a new oracle price without a full scan.
+
+        @:dev The liquidation ladder gives the positions below their liquidation price at the
+        snapshot by bisection, only those are confirmed on-chain and retained for liquidation.
+        Positions the last scan did not fetch are rebuilt from their balances in the ladder.
+
+        Args:
+            snapshot (MarketSnapshot): The market snapshot, the latest block's if omitted.
+
+        Returns:
+            int: The number of positions retained for liquidation.
+        """
+        snapshot = snapshot if snapshot is not None else await self.get_snapshot()
+        self.positions = []
+        if snapshot is None:
+            return 0
+        candidates = []
+        for borrower in self.ladder.liquidatable(snapshot):
+            position = self.index.get(borrower)
+            if position is None:
+                # Kept from an earlier scan while the last one was cut short
+                borrow_shares, collateral = self.ladder.balances[borrower]
+                position = self.__position_from_book(Web3.to_checksum_address(borrower),
+                                                     BookEntry(0, borrow_shares, collateral))
+            if not position.liquidated:
+                candidates.append(position)
+        if candidates:
+            print(f"Market {self.market.unique_key}: {len(candidates)} positions crossed their liquidation price")
+            self.positions = await self.evaluate_positions(candidates, snapshot)
+        return len(self.positions)
+
+    async def stream_positions(self) -> AsyncIterator[List[MarketPosition]]:
+        """
+        @:dev Stream the market's borrow positions from the API one page at a time.
+
+        @:dev When a position feed is attached by MarketsBehaviour the pages come from the shared
+        multi-market query instead of a query of this market's own. The feed ends with None, or
+        with the error that stopped the shared query.
+        @:dev When a position book is set its borrow positions are yielded as a single page and
+        the API is not queried at all.
+
+        Yields:
+            List[MarketPosition]: The positions of each page as it arrives.
+
+        Raises:
+            PositionFetchError: If a page could not be fetched.
+        """
+        if self.position_book is not None:
+            self.sync_book_positions()
+            if self.book_positions:
+                yield list(self.book_positions.values())
+            return
+        if self.position_feed is None:
+            async for page in stream_market_positions(self.graphql_client, [self.market.unique_key],
+                                                      self.page_size):
+                yield page
+            return
+        feed = self.position_feed
+        while True:
+            page = await feed.get()
+            if page is None or isinstance(page, Exception):
+                self.position_feed = None
+                if page is not None:
+                    raise PositionFetchError(f"Shared positions query failed: {page}") from page
+                return
+            yield page
+
+    def sync_book_positions(self):
+        """
+        @:dev Refresh the positions of borrowers whose book entries changed since the last cycle.
+        """
+        book = self.position_book.positions(self.market.unique_key)
+        for borrower in self.position_book.drain_dirty(self.market.unique_key):
+            entry = book.get(borrower)
+            if entry is None or entry.borrow_shares <= 0:
+                self.book_positions.pop(borrower, None)
+                continue
+            position = self.book_positions.get(borrower)
+            if position is None:
+                self.book_positions[borrower] = self.__position_from_book(borrower, entry)
             else:
-                print(f"Error fetching positions: {response.status_code}, {response.text}")
-        except Exception:
-            print("Error in get_positions")
-            print(traceback.format_exc())
+                position.supply_shares = entry.supply_shares
+                position.borrow_shares = entry.borrow_shares
+                position.collateral = entry.collateral
+
+    def __position_from_book(self, borrower: str, entry: BookEntry) -> MarketPosition:
+        """
+        @:dev Build a market position from a position book entry.
+
+        Args:
+            borrower (str): The owner of the position.
+            entry (BookEntry): The position's balances.
+
+        Returns:
+            MarketPosition: The market position.
+        """
+        market = {"uniqueKey": self.market.unique_key, "lltv": str(self.market.lltv),
+                  "oracleAddress": self.market.oracle_address, "irmAddress": self.market.irm_address,
+                  "loanAsset": self.market.loan_asset.to_dict(),
+                  "collateralAsset": self.market.collateral_asset.to_dict()}
+        return MarketPosition.from_dict({"supplyShares": entry.supply_shares,
+                                         "borrowShares": entry.borrow_shares,
+                                         "collateral": entry.collateral,
+                                         "market": market, "user": {"address": borrower}})
 
     async def get_positions_db(self):
         """
-        @:dev Fetch market positions from the the cache/db
+        @:dev Fetch market positions from the the cache/db and merge them into the position index
 
         @:dev This function also handles any exceptions that occur during the process and prints traceback
         information for debugging.
         """
         try:
-            db_positions = await get_cache(self.market.unique_key)
-            db_positions = db_positions.get('data', [])
+            db_positions = await load_positions(self.market.unique_key)
             positions = [MarketPosition.from_dict(position) for position in db_positions]
-            self.positions += positions
+            self.index.merge(positions, PositionSource.CACHE)
         except Exception:
             print("Error in get_positions_db")
             print(traceback.format_exc())
 
-    def get_un_healthy_positions(self):
+    async def get_snapshot(self) -> Optional[MarketSnapshot]:
+        """
+        @:dev Get the market's snapshot for the latest block from the shared cache.
+
+        Returns:
+            MarketSnapshot: The market snapshot, or None if it is unavailable.
+        """
+        if self.snapshot_cache is None:
+            return None
+        try:
+            return await self.snapshot_cache.snapshot(self.market.unique_key)
+        except Exception:
+            print(f"Error reading market snapshot for {self.market.unique_key}")
+            print(traceback.format_exc())
+            return None
+
+    async def evaluate_positions(self, positions: List[MarketPosition],
+                           snapshot: Optional[MarketSnapshot] = None) -> List[MarketPosition]:
         """
-        @:dev Evaluate all positions to determine if they are unhealthy and should be considered for
+        @:dev Evaluate the given positions to determine if they are unhealthy and should be considered for
         liquidation.
         @:dev A position is said to be unhealthy if its health factor is less than 1 and
         healthy if its health factor greater than 0 This method iterates through the positions,
         checks for the required attributes, and calculates whether each position is healthy or
         not based on the borrow assets and the maximum borrowable amount.
          @:dev A Position deemed unhealthy are retained for potential liquidation.
-         @:dev Processing of positions is done in batches of 100 to optimise for contract calls
+         @:dev Positions are first prefiltered off-chain against a market snapshot, only borderline
+         positions are confirmed on-chain.
+         @:dev Processing of positions is done in adaptively sized batches, each result is matched
+         to its position explicitly and a failing call only loses its own position
+         @:dev The lowest health factor seen is kept in min_health_factor for the hot set scheduler
 
         Attributes checked:
         - position.market
@@ -166,122 +426,81 @@ class MarketBehaviour:
         - position.market.state
         - position.collateral
 
-        Finally, the list of positions is filtered to retain only those that are unhealthy.
+        Args:
+            positions (List[MarketPosition]): The positions to evaluate.
+            snapshot (MarketSnapshot): The market snapshot used to prefilter positions off-chain.
+
+        Returns:
+            List[MarketPosition]: The positions that are unhealthy.
         """
-        if len(self.positions) > 0:
-            batch_size = 100
-            calls = []
-            for index, position in enumerate(self.positions):
-                try:
-                    if position.market is None or position.market.loan_asset is None or position.market.collateral_asset is None or position.market.irm_address is None:
-                        continue
-                    market_param = position.market.to_market_param()
-                    call = self.liquidator_contract.encodeABI(
-                        fn_name='userHealthFactor',
-                        args=[
-                            market_param,
-                            self.web3.to_bytes(hexstr=HexStr(self.market.unique_key)),
-                            position.user.address,
-                        ]
-                    )
-                    calls.append((self.liquidator_contract.address, call))
-                    if len(calls) >= batch_size:
-                        results = self.liquidator_contract.functions.aggregate(calls).call()
-                        return_data = results[1]
-                        for idx, result in enumerate(return_data):
-                            self.positions[
-                                index - batch_size + 1 + idx].health_factor = self.web3.to_int(
-                                primitive=result)
-                        calls = []
-                except Exception:
-                    print(f"Error processing position")
-                    print(traceback.format_exc())
+        if snapshot is not None:
+            total = len(positions)
+            positions, healthy = prefilter_positions(positions, snapshot, self.prefilter_margin)
+            self.__track_health_factors(healthy)
+            print(f"Market {self.market.unique_key}: {len(positions)} of {total} positions need on-chain checks")
+        entries = []
+        for position in positions:
+            try:
+                if position.market is None or position.market.loan_asset is None or position.market.collateral_asset is None or position.market.irm_address is None:
                     continue
+                market_param = position.market.to_market_param()
+                call = self.liquidator_contract.encodeABI(
+                    fn_name='userHealthFactor',
+                    args=[
+                        market_param,
+                        self.web3.to_bytes(hexstr=HexStr(self.market.unique_key)),
+                        position.user.address,
+                    ]
+                )
+                entries.append((position, (self.liquidator_contract.address, call)))
+            except Exception:
+                print(f"Error processing position")
+                print(traceback.format_exc())
+                continue
 
-            if calls:
-                try:
-                    results = self.liquidator_contract.functions.aggregate(calls).call()
-                    return_data = results[1]
-                    for idx, result in enumerate(return_data):
-                        self.positions[
-                            len(self.positions) - len(calls) + idx].health_factor = div_down_wad(
-                            self.web3.to_int(
-                                primitive=result))
-                except Exception:
-                    print(f"Error processing remaining positions")
-                    print(traceback.format_exc())
-                    if calls:
-                        results = self.liquidator_contract.functions.aggregate(calls).call()
-                        return_data = results[1]
-                        for idx, result in enumerate(return_data):
-                            self.positions[
-                                len(self.positions) - len(
-                                    calls) + idx].health_factor = div_down_wad(self.web3.to_int(
-                                primitive=result))
-                except Exception as e:
-                    print(f"Error in final batch of health checks: {e}")
-                    print(traceback.format_exc())
-
-            self.positions = [position for position in self.positions if position.health_factor < 1]
-            print("Market {} has {} potential positions to be liquidated".format(
-                self.market.unique_key,
-                len(self.positions)))
-
-    def __build_market_query(self) -> str:
+        unhealthy = []
+        if entries:
+            for position, result in await self.batcher.run(entries, self.__aggregate):
+                if result is None:
+                    continue
+                position.health_factor = div_down_wad(self.web3.to_int(primitive=result))
+                self.__track_health_factors([position])
+                if position.health_factor < 1:
+                    unhealthy.append(position)
+        return unhealthy
+
+    def __track_health_factors(self, positions: List[MarketPosition]):
         """
-        Build the GraphQL query string to fetch market positions.
+        @:dev Lower min_health_factor to the lowest health factor of the given positions.
 
-        :return: A formatted GraphQL query string
+        Args:
+            positions (List[MarketPosition]): Positions whose health factor was just computed.
         """
-        query = f"""
-        query  {{
-          marketPositions(
-            first: 1000
-            orderBy: SupplyShares
-            orderDirection: Desc
-            where: {{
-              marketUniqueKey_in: ["{self.market.unique_key}"]
-            }}
-          ) {{
-            items {{
-              supplyShares
-              supplyAssets
-              supplyAssetsUsd
-              borrowShares
-              borrowAssets
-              borrowAssetsUsd
-              collateral
-              collateralUsd
-              market {{
-                uniqueKey
-                lltv
-                oracleAddress
-                irmAddress
-                loanAsset {{
-                  address
-                  symbol
-                }}
-                collateralAsset {{
-                  address
-                  symbol
-                }}
-                state {{
-                  borrowApy
-                  borrowAssets
-                  borrowAssetsUsd
-                  supplyApy
-                  supplyAssets
-                  supplyAssetsUsd
-                  fee
-                  utilization
-                }}
-              }}
-              user {{
-                address
-              }}
-            }}
-          }}
-        }}
+        for position in positions:
+            if position.health_factor is not None and (self.min_health_factor is None
+                                                       or position.health_factor < self.min_health_factor):
+                self.min_health_factor = position.health_factor
+
+    async def __aggregate(self, calls: list, measure_gas: bool) -> Tuple[List[bytes], Optional[int]]:
         """
-        return query
+        @:dev Execute a batch of calls through the liquidator's multicall without blocking the loop.
 
+        @:dev Calls go through tryAggregate, a reverting call only loses its own result.
+
+        Args:
+            calls (list): The (target, call data) pairs to execute.
+            measure_gas (bool): Whether to also estimate the gas used by the batch.
+
+        Returns:
+            Tuple[List[Optional[bytes]], Optional[int]]: The return data of each call, None if it
+            reverted, and the gas used, if measured.
+        """
+        function = self.async_liquidator_contract.functions.tryAggregate(False, calls)
+        results = await function.call()
+        gas_used = await function.estimate_gas() if measure_gas else None
+        return_data = []
+        for success, data in results:
+            if not success:
+                print(f"Health check call failed, skipping it: {revert_reason(data)}")
+            return_data.append(data if success else None)
+        return return_data, gas_used
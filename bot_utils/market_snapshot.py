@@ -0,0 +1,143 @@
+import asyncio
+import traceback
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from eth_abi import decode
+from web3 import AsyncWeb3
+from web3.contract import AsyncContract
+
+from bot_utils.health_engine import MarketSnapshot
+from bot_utils.helpers import revert_reason
+from models.markets import Market
+
+
+class MarketSnapshotCache:
+    web3: AsyncWeb3
+    liquidator_contract: AsyncContract
+    markets: Dict[str, Market]
+
+    def __init__(self, web3: AsyncWeb3, liquidator_contract: AsyncContract, markets: List[Market],
+                 max_blocks: int = 4):
+        """
+        @:dev Per block cache of the oracle price and borrow totals of every monitored market.
+
+        @:dev All markets are read with a single Liquidator.aggregate call of marketSnapshot, so
+        every position evaluated in a block reuses one oracle read per market.
+
+        Args:
+            web3 (AsyncWeb3): AsyncWeb3 instance for blockchain interactions.
+            liquidator_contract (AsyncContract): The liquidator contract exposing marketSnapshot.
+            markets (List[Market]): The monitored markets.
+            max_blocks (int): The number of most recent blocks kept in the cache.
+        """
+        self.web3 = web3
+        self.liquidator_contract = liquidator_contract
+        self.markets = {market.unique_key: market for market in markets}
+        self.max_blocks = max_blocks
+        self._snapshots: "OrderedDict[int, Dict[str, MarketSnapshot]]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    def add_markets(self, markets: List[Market]):
+        """
+        @:dev Start tracking more markets, cached blocks are dropped so the next read includes them.
+
+        Args:
+            markets (List[Market]): The markets to add.
+        """
+        for market in markets:
+            self.markets[market.unique_key] = market
+        self._snapshots.clear()
+
+    async def latest(self) -> Dict[str, MarketSnapshot]:
+        """
+        @:dev Get the snapshots of all markets at the latest block.
+
+        Returns:
+            Dict[str, MarketSnapshot]: The snapshots keyed by market unique key.
+        """
+        block_number = await self.web3.eth.block_number
+        return await self.get(block_number)
+
+    async def get(self, block_number: int) -> Dict[str, MarketSnapshot]:
+        """
+        @:dev Get the snapshots of all markets at the given block, reading them once per block.
+
+        Args:
+            block_number (int): The block number.
+
+        Returns:
+            Dict[str, MarketSnapshot]: The snapshots keyed by market unique key, empty on failure.
+        """
+        snapshots = self._snapshots.get(block_number)
+        if snapshots is not None:
+            return snapshots
+        async with self._lock:
+            snapshots = self._snapshots.get(block_number)
+            if snapshots is None:
+                snapshots = await self.__fetch(block_number)
+                if snapshots:
+                    self._snapshots[block_number] = snapshots
+                    while len(self._snapshots) > self.max_blocks:
+                        self._snapshots.popitem(last=False)
+        return snapshots
+
+    async def snapshot(self, unique_key: str, block_number: Optional[int] = None) -> Optional[MarketSnapshot]:
+        """
+        @:dev Get the snapshot of a single market.
+
+        Args:
+            unique_key (str): The market unique key.
+            block_number (int): The block number, the latest block if omitted.
+
+        Returns:
+            MarketSnapshot: The market snapshot, or None if it could not be read.
+        """
+        snapshots = await (self.latest() if block_number is None else self.get(block_number))
+        return snapshots.get(unique_key)
+
+    async def __fetch(self, block_number: int) -> Dict[str, MarketSnapshot]:
+        """
+        @:dev Read the snapshots of all markets with one multicall pinned to the given block.
+
+        Args:
+            block_number (int): The block number.
+
+        Returns:
+            Dict[str, MarketSnapshot]: The snapshots keyed by market unique key.
+        """
+        keys = []
+        calls = []
+        for unique_key, market in self.markets.items():
+            try:
+                call = self.liquidator_contract.encodeABI(fn_name='marketSnapshot',
+                                                          args=[market.to_market_param()])
+                calls.append((self.liquidator_contract.address, call))
+                keys.append(unique_key)
+            except Exception:
+                print(f"Error encoding market snapshot for {unique_key}")
+                print(traceback.format_exc())
+        if not calls:
+            return {}
+        try:
+            results = await self.liquidator_contract.functions.tryAggregate(False, calls).call(
+                block_identifier=block_number)
+        except Exception:
+            print(f"Error reading market snapshots at block {block_number}")
+            print(traceback.format_exc())
+            return {}
+        snapshots = {}
+        for unique_key, (success, result) in zip(keys, results):
+            if not success:
+                # A market with a broken oracle is left out, its positions are checked on-chain
+                print(f"Error reading market snapshot for {unique_key}: {revert_reason(result)}")
+                continue
+            price, total_borrow_assets, total_borrow_shares, last_update = decode(
+                ['uint256', 'uint256', 'uint256', 'uint256'], result)
+            snapshots[unique_key] = MarketSnapshot(unique_key=unique_key, price=price,
+                                                   total_borrow_assets=total_borrow_assets,
+                                                   total_borrow_shares=total_borrow_shares,
+                                                   lltv=int(self.markets[unique_key].lltv),
+                                                   last_update=last_update,
+                                                   block_number=block_number)
+        return snapshots
@@ -1,30 +1,49 @@
+import asyncio
 import json
 import os
 import string
 import sys
 import traceback
-from typing import List
+from typing import Dict, List, Optional, Set
 
-import requests
+from aiohttp import ClientTimeout
 from eth_account import Account
-from web3 import Web3
+from web3 import AsyncWeb3, Web3
 from web3.middleware import construct_sign_and_send_raw_middleware
 
-from bot_utils.helpers import get_cache
+from bot_utils.adaptive_batcher import AdaptiveBatcher
+from bot_utils.graphql_client import GraphQLClient
 from bot_utils.market_behaviour import MarketBehaviour
+from bot_utils.market_snapshot import MarketSnapshotCache
+from bot_utils.position_book import PositionBook
+from bot_utils.preflight import Preflight
+from bot_utils.tx_manager import FeeStrategy, TransactionManager
+from bot_utils.position_store import load_markets
+from bot_utils.position_stream import PositionFetchError, stream_market_positions, MAX_PAGE_SIZE
+from models.market_positions import MarketPosition, interned_markets
 from models.markets import MarketsResponse, Market
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 class MarketsBehaviour:
     markets: List[MarketBehaviour]
     url: str
+    graphql_client: GraphQLClient
     liquidator_address: str
     multi_call_address: str
     private_key: str
     rpc: str
     markets: List[str]
 
-    def __init__(self, url: str, liquidator_address: str, private_key: str, rpc: str, markets: List[str]):
+    def __init__(self, url: str, liquidator_address: str, private_key: str, rpc: str, markets: List[str],
+                 graphql_timeout: float = 30, graphql_max_concurrency: int = 16,
+                 fetch_mode: str = "batched", page_size: int = MAX_PAGE_SIZE,
+                 prefilter_margin: float = 0.05, max_batch_size: int = 1000,
+                 call_gas_limit: int = 50_000_000, max_in_flight: int = 8,
+                 position_book: PositionBook = None, preflight_gas_buffer: float = 0.2,
+                 max_bundle_gas: int = 30_000_000, priority_fee_percentile: float = 50,
+                 max_fee_per_gas: Optional[int] = None, tx_replace_after: float = 30,
+                 tx_receipt_timeout: float = 180, native_token_price_usd: float = 3000.0,
+                 max_liquidation_candidates: int = 256, unique_keys: Optional[List[str]] = None):
         """
         @:dev Initializes the MarketsBehaviour class.
 
@@ -34,12 +53,56 @@ class MarketsBehaviour:
             private_key (str): The private key for signing transactions.
             rpc (str): The RPC URL for connecting to the blockchain.
             markets (List[str]): List of market addresses to be monitored.
+            graphql_timeout (float): Timeout in seconds for each GraphQL request.
+            graphql_max_concurrency (int): Maximum number of GraphQL requests in flight.
+            fetch_mode (str): "batched" to query positions of all markets together, "per_market" to
+            query each market on its own.
+            page_size (int): The number of positions requested per page.
+            prefilter_margin (float): Positions whose off-chain health factor is above 1 + margin
+            skip on-chain confirmation.
+            max_batch_size (int): The largest number of calls the provider accepts in one multicall.
+            call_gas_limit (int): The provider's gas cap for a single eth_call.
+            max_in_flight (int): The number of multicall batches in flight at once.
+            position_book (PositionBook): Event-sourced position book replacing the API as the
+            source of positions when set.
+            preflight_gas_buffer (float): Fraction added on top of a liquidation bundle's gas estimate.
+            max_bundle_gas (int): The largest gas limit of a liquidation bundle.
+            priority_fee_percentile (float): Percentile of recent priority fees bid by liquidations.
+            max_fee_per_gas (int): Optional cap on the max fee per gas of liquidations, in wei.
+            tx_replace_after (float): Seconds a liquidation may stay pending before it is replaced
+            with higher fees.
+            tx_receipt_timeout (float): Seconds after which a pending liquidation is given up.
+            native_token_price_usd (float): USD price of the gas token, used to weigh liquidation
+            profits against gas.
+            max_liquidation_candidates (int): The largest number of liquidations simulated per
+            market and cycle.
+            unique_keys (List[str]): Only monitor and snapshot the markets with these unique keys,
+            e.g. the shard of a worker process. All markets when omitted.
         """
         self.url = url
+        self.graphql_client = GraphQLClient(url=url, timeout=graphql_timeout,
+                                            max_concurrency=graphql_max_concurrency)
         self.liquidator_address = liquidator_address
         self.private_key = private_key
         self.rpc = rpc
         self.markets = markets
+        self.fetch_mode = fetch_mode
+        self.page_size = page_size
+        self.prefilter_margin = prefilter_margin
+        self.batcher = AdaptiveBatcher(max_size=max_batch_size, gas_limit=call_gas_limit,
+                                       max_in_flight=max_in_flight)
+        self.position_book = position_book
+        self.preflight_gas_buffer = preflight_gas_buffer
+        self.max_bundle_gas = max_bundle_gas
+        self.priority_fee_percentile = priority_fee_percentile
+        self.max_fee_per_gas = max_fee_per_gas
+        self.tx_replace_after = tx_replace_after
+        self.tx_receipt_timeout = tx_receipt_timeout
+        self.native_token_price_usd = native_token_price_usd
+        self.max_liquidation_candidates = max_liquidation_candidates
+        self.unique_keys = {unique_key.lower() for unique_key in unique_keys} if unique_keys is not None else None
+        self.position_feeds: Dict[str, List[asyncio.Queue]] = {}
+        self.position_feed_keys: List[str] = []
 
     async def init(self):
         """
@@ -54,12 +117,12 @@ class MarketsBehaviour:
         query = self.__build_markets_query()
         print("Fetching markets from GraphQL")
         try:
-            response = requests.post(url=self.url, json={"query": query})
-            if response.status_code == 200:
-                market_data = response.json()
+            market_data = await self.graphql_client.post(query=query)
+            if market_data is not None:
                 print(f"Done fetching markets from GraphQL, found any: {len(market_data.get('data', {}).get('items', [])) > 0}")
                 markets = MarketsResponse.from_dict(market_data).markets
-                new_markets = [market for market in markets if market.collateral_asset is not None and market.collateral_asset.address in self.markets]
+                new_markets = [market for market in markets if market.collateral_asset is not None and market.collateral_asset.address in self.markets
+                               and self.__is_retained(market)]
                 w3 = Web3(Web3.HTTPProvider(self.rpc, request_kwargs={'timeout': 60}))
                 w3.strict_bytes_type_checking = False
                 account = Account.from_key(self.private_key)
@@ -69,23 +132,179 @@ class MarketsBehaviour:
                 with open(json_path) as f:
                     data = json.load(f)
                     liquidator_contract = w3.eth.contract(address=self.liquidator_address, abi=data['abi'])
-                    self.account = account
-                    self.markets = [
-                        MarketBehaviour(market=market, url=self.url, liquidator_contract=liquidator_contract, web3=w3, account=account)
-                        for market in new_markets
-                    ]
-                    db_markets = await get_cache("markets")
-                    db_markets = db_markets.get('data', [])
-                    if db_markets:
-                        dev_markets = [
-                            MarketBehaviour(market=Market.from_dict(market), url=self.url, liquidator_contract=liquidator_contract, web3=w3, account=account)
-                            for market in db_markets
-                        ]
-                        self.markets += dev_markets
+                async_w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(
+                    self.rpc, request_kwargs={'timeout': ClientTimeout(total=60)}))
+                async_w3.strict_bytes_type_checking = False
+                async_liquidator_contract = async_w3.eth.contract(address=self.liquidator_address,
+                                                                  abi=data['abi'])
+                self.account = account
+                self.web3 = w3
+                self.async_web3 = async_w3
+                self.liquidator_contract = liquidator_contract
+                self.async_liquidator_contract = async_liquidator_contract
+                self.preflight = Preflight(web3=async_w3, liquidator_contract=async_liquidator_contract,
+                                           gas_buffer=self.preflight_gas_buffer, max_gas=self.max_bundle_gas)
+                fee_strategy = FeeStrategy(web3=async_w3, priority_fee_percentile=self.priority_fee_percentile,
+                                           max_fee_per_gas=self.max_fee_per_gas)
+                self.tx_manager = TransactionManager(web3=async_w3, account=account, fee_strategy=fee_strategy,
+                                                     replace_after=self.tx_replace_after,
+                                                     receipt_timeout=self.tx_receipt_timeout)
+                self.snapshot_cache = MarketSnapshotCache(web3=async_w3,
+                                                          liquidator_contract=async_liquidator_contract,
+                                                          markets=new_markets)
+                self.markets = [self.__create_market_behaviour(market) for market in new_markets]
+                db_markets = [market for market in map(Market.from_dict, await load_markets())
+                              if self.__is_retained(market)]
+                if db_markets:
+                    dev_markets = [self.__create_market_behaviour(market) for market in db_markets]
+                    self.snapshot_cache.add_markets([market.market for market in dev_markets])
+                    self.markets += dev_markets
         except Exception:
             print("Error executing liquidation transactions")
             print(traceback.format_exc())
 
+    def __create_market_behaviour(self, market: Market) -> MarketBehaviour:
+        """
+        @:dev Create the behaviour of a single market sharing this instance's clients and contracts.
+
+        Args:
+            market (Market): The market to monitor.
+
+        Returns:
+            MarketBehaviour: The market behaviour.
+        """
+        return MarketBehaviour(market=market, graphql_client=self.graphql_client,
+                               liquidator_contract=self.liquidator_contract, web3=self.web3,
+                               account=self.account, snapshot_cache=self.snapshot_cache,
+                               prefilter_margin=self.prefilter_margin, batcher=self.batcher,
+                               async_liquidator_contract=self.async_liquidator_contract,
+                               position_book=self.position_book, preflight=self.preflight,
+                               tx_manager=self.tx_manager,
+                               native_token_price_usd=self.native_token_price_usd,
+                               max_liquidation_candidates=self.max_liquidation_candidates)
+
+    def __is_retained(self, market: Market) -> bool:
+        """
+        @:dev Check whether a market is monitored by this instance.
+
+        Args:
+            market (Market): The market.
+
+        Returns:
+            bool: True if no unique keys were given or the market's is one of them.
+        """
+        return self.unique_keys is None or (market.unique_key is not None
+                                            and market.unique_key.lower() in self.unique_keys)
+
+    def begin_cycle(self):
+        """
+        @:dev Start a scan cycle, dropping the markets interned while decoding the previous one so
+        the registry only holds the markets of current payloads.
+        """
+        interned_markets.clear()
+
+    async def scan_all(self, unique_keys: Optional[Set[str]] = None) -> Dict[str, List[MarketPosition]]:
+        """
+        @:dev Scan every market once without liquidating anything.
+
+        Args:
+            unique_keys (Set[str]): Only scan the markets with these lowercased unique keys.
+
+        Returns:
+            Dict[str, List[MarketPosition]]: The unhealthy positions keyed by lowercased market
+            unique key.
+        """
+        self.begin_cycle()
+        markets = [market for market in self.markets
+                   if unique_keys is None or market.market.unique_key.lower() in unique_keys]
+        tasks = [market.scan() for market in markets]
+        if markets and self.fetch_mode == "batched" and self.position_book is None:
+            self.open_position_feeds(markets)
+            tasks.append(self.feed_positions())
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"Error scanning markets: {result!r}")
+        unhealthy: Dict[str, List[MarketPosition]] = {}
+        for market in markets:
+            unhealthy.setdefault(market.market.unique_key.lower(), []).extend(market.positions)
+        return unhealthy
+
+    def min_health_factors(self, unique_keys: Optional[Set[str]] = None) -> Dict[str, Optional[float]]:
+        """
+        @:dev Get the lowest health factor each market found in its last scan.
+
+        @:dev Markets whose last scan did not fetch every position are left out, their lowest
+        health factor is unknown.
+
+        Args:
+            unique_keys (Set[str]): Only include the markets with these lowercased unique keys.
+
+        Returns:
+            Dict[str, Optional[float]]: The health factors keyed by lowercased market unique key,
+            None for markets without positions.
+        """
+        health_factors: Dict[str, Optional[float]] = {}
+        incomplete = set()
+        for market in self.markets:
+            unique_key = market.market.unique_key.lower()
+            if unique_keys is not None and unique_key not in unique_keys:
+                continue
+            if not market.scan_complete:
+                incomplete.add(unique_key)
+                continue
+            known = health_factors.get(unique_key)
+            if known is None or (market.min_health_factor is not None and market.min_health_factor < known):
+                health_factors[unique_key] = market.min_health_factor
+        for unique_key in incomplete:
+            health_factors.pop(unique_key, None)
+        return health_factors
+
+    def open_position_feeds(self, markets: Optional[List[MarketBehaviour]] = None):
+        """
+        @:dev Attach a position feed to every market so their scans consume the shared
+        multi-market query started by feed_positions.
+
+        Args:
+            markets (List[MarketBehaviour]): The markets scanned this cycle, all markets if omitted.
+        """
+        markets = self.markets if markets is None else markets
+        self.position_feeds = {}
+        self.position_feed_keys = list({market.market.unique_key for market in markets})
+        for market in markets:
+            market.position_feed = asyncio.Queue()
+            self.position_feeds.setdefault(market.market.unique_key.lower(), []).append(market.position_feed)
+
+    async def feed_positions(self):
+        """
+        @:dev Page through the positions of all monitored markets with a single query and hand each
+        page's positions to their market by market.uniqueKey.
+
+        @:dev Every feed is closed once paging ends so no scan waits forever, with None when every
+        page was fetched and with the error otherwise, so scans know their positions are incomplete.
+        """
+        feeds = self.position_feeds
+        unique_keys = self.position_feed_keys
+        end: Optional[Exception] = PositionFetchError("Shared positions query was cancelled")
+        try:
+            async for page in stream_market_positions(self.graphql_client, unique_keys, self.page_size):
+                grouped: Dict[str, list] = {}
+                for position in page:
+                    if position.market is None or position.market.unique_key is None:
+                        continue
+                    grouped.setdefault(position.market.unique_key.lower(), []).append(position)
+                for unique_key, positions in grouped.items():
+                    for feed in feeds.get(unique_key, []):
+                        feed.put_nowait(positions)
+            end = None
+        except Exception as error:
+            print("Error in feed_positions")
+            print(traceback.format_exc())
+            end = error
+        finally:
+            for market_feeds in feeds.values():
+                for feed in market_feeds:
+                    feed.put_nowait(end)
+
     @staticmethod
     def __build_markets_query() -> str:
         """
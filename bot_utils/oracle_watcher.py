@@ -0,0 +1,134 @@
+import traceback
+from typing import Dict, List, Set
+
+from eth_abi import decode
+from web3 import AsyncWeb3
+from web3.contract import AsyncContract
+
+from bot_utils.health_engine import MarketSnapshot
+from bot_utils.helpers import revert_reason
+from models.markets import Market
+
+
+class OracleWatcher:
+    web3: AsyncWeb3
+    liquidator_contract: AsyncContract
+    oracles: Dict[str, Set[str]]
+    market_oracles: Dict[str, str]
+    reference_prices: Dict[str, int]
+
+    def __init__(self, web3: AsyncWeb3, liquidator_contract: AsyncContract, markets: List[Market],
+                 change_bps: float = 50):
+        """
+        @:dev Watches the oracles of the monitored markets and reports the markets whose price moved.
+
+        @:dev Oracles shared by several markets are read once, all of them with a single
+        tryAggregate of Liquidator.oraclePrice per block, or taken from the market snapshots
+        already read for the block. An oracle's price is compared with its reference price, the
+        price at which its markets were last reported, so slow drifts add up until they cross the
+        threshold.
+
+        Args:
+            web3 (AsyncWeb3): AsyncWeb3 instance for blockchain interactions.
+            liquidator_contract (AsyncContract): The liquidator contract exposing oraclePrice.
+            markets (List[Market]): The monitored markets.
+            change_bps (float): The price move, in basis points, that makes markets re-evaluated.
+        """
+        self.web3 = web3
+        self.liquidator_contract = liquidator_contract
+        self.change_bps = change_bps
+        self.oracles = {}
+        self.market_oracles = {}
+        self.reference_prices = {}
+        self.add_markets(markets)
+
+    def add_markets(self, markets: List[Market]):
+        """
+        @:dev Start watching the oracles of more markets.
+
+        Args:
+            markets (List[Market]): The markets to add.
+        """
+        for market in markets:
+            if market.oracle_address is None or market.unique_key is None:
+                continue
+            self.oracles.setdefault(market.oracle_address.lower(), set()).add(market.unique_key)
+            self.market_oracles[market.unique_key.lower()] = market.oracle_address.lower()
+
+    async def poll(self, block_number: int) -> Set[str]:
+        """
+        @:dev Read every oracle at a block and get the markets whose price moved.
+
+        @:dev The first price read of an oracle only sets its reference, the bot's scans cover
+        its markets at start-up.
+
+        Args:
+            block_number (int): The block number.
+
+        Returns:
+            Set[str]: The unique keys of the markets whose oracle moved by change_bps or more.
+        """
+        oracles = list(self.oracles)
+        if not oracles:
+            return set()
+        calls = [(self.liquidator_contract.address,
+                  self.liquidator_contract.encodeABI(fn_name='oraclePrice',
+                                                     args=[AsyncWeb3.to_checksum_address(oracle)]))
+                 for oracle in oracles]
+        try:
+            results = await self.liquidator_contract.functions.tryAggregate(False, calls).call(
+                block_identifier=block_number)
+        except Exception:
+            print(f"Error reading oracle prices at block {block_number}")
+            print(traceback.format_exc())
+            return set()
+        moved = set()
+        for oracle, (success, result) in zip(oracles, results):
+            if not success:
+                print(f"Error reading oracle {oracle}: {revert_reason(result)}")
+                continue
+            moved |= self.__observe(oracle, decode(['uint256'], result)[0], block_number)
+        return moved
+
+    def observe_snapshots(self, snapshots: Dict[str, MarketSnapshot]) -> Set[str]:
+        """
+        @:dev Get the markets whose price moved from a block's market snapshots, which already
+        carry every oracle price, instead of reading the oracles again.
+
+        Args:
+            snapshots (Dict[str, MarketSnapshot]): The snapshots of the block keyed by unique key.
+
+        Returns:
+            Set[str]: The unique keys of the markets whose oracle moved by change_bps or more.
+        """
+        moved = set()
+        observed = set()
+        for unique_key, snapshot in snapshots.items():
+            oracle = self.market_oracles.get(unique_key.lower())
+            if oracle is None or oracle in observed:
+                continue
+            observed.add(oracle)
+            moved |= self.__observe(oracle, snapshot.price, snapshot.block_number)
+        return moved
+
+    def __observe(self, oracle: str, price: int, block_number: int) -> Set[str]:
+        """
+        @:dev Compare an oracle's price with its reference price.
+
+        Args:
+            oracle (str): The lowercased oracle address.
+            price (int): The oracle price.
+            block_number (int): The block the price was read at.
+
+        Returns:
+            Set[str]: The unique keys of the oracle's markets if it moved, an empty set otherwise.
+        """
+        reference = self.reference_prices.get(oracle)
+        if reference is None:
+            self.reference_prices[oracle] = price
+            return set()
+        if reference == 0 or abs(price - reference) * 10_000 >= self.change_bps * reference:
+            print(f"Oracle {oracle} moved from {reference} to {price} at block {block_number}")
+            self.reference_prices[oracle] = price
+            return set(self.oracles[oracle])
+        return set()
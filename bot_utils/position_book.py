@@ -0,0 +1,221 @@
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Set, Tuple
+
+from web3 import Web3
+from web3.types import EventData
+
+from bot_utils.position_store import get_hash, store_hashes
+
+BOOK_META_KEY = "position_book:meta"
+BOOK_MARKETS_KEY = "position_book:markets"
+
+
+def book_key(market_id: str) -> str:
+    """
+    @:dev Get the Redis hash holding the book entries of a market.
+
+    Args:
+        market_id (str): The market unique key.
+
+    Returns:
+        str: The Redis key.
+    """
+    return f"position_book:{market_id.lower()}"
+
+
+@dataclass
+class BookEntry:
+    supply_shares: int = 0
+    borrow_shares: int = 0
+    collateral: int = 0
+
+    def is_empty(self) -> bool:
+        return self.supply_shares == 0 and self.borrow_shares == 0 and self.collateral == 0
+
+
+class PositionBook:
+    entries: Dict[str, Dict[str, BookEntry]]
+    applied_through: int
+
+    def __init__(self, reorg_depth: int = 64):
+        """
+        @:dev In-memory book of every position, keyed by market id and borrower, maintained from
+        decoded Morpho events.
+
+        @:dev Every applied change is kept in an undo log for the last reorg_depth blocks so a
+        reorg can be rolled back. Changed borrowers are tracked per market so consumers only
+        refresh what moved since they last looked.
+
+        Args:
+            reorg_depth (int): The number of recent blocks whose changes can be rolled back.
+        """
+        self.entries = {}
+        self.applied_through = -1
+        self.reorg_depth = reorg_depth
+        self.dirty: Dict[str, Set[str]] = {}
+        self.unsaved: Dict[str, Set[str]] = {}
+        self.undo: Deque[Tuple[int, str, str, BookEntry]] = deque()
+
+    async def load(self):
+        """
+        @:dev Load the persisted book from Redis.
+        """
+        meta = await get_hash(BOOK_META_KEY)
+        if not meta:
+            return
+        self.applied_through = meta.get("applied_through", -1)
+        for market_id in await get_hash(BOOK_MARKETS_KEY):
+            positions = await get_hash(book_key(market_id))
+            self.entries[market_id] = {borrower: BookEntry(*values) for borrower, values in positions.items()}
+            self.dirty[market_id] = set(positions)
+
+    async def save(self) -> bool:
+        """
+        @:dev Persist the entries changed since the last save together with the last block the
+        book reflects, in a single transaction.
+
+        Returns:
+            bool: True if the book was successfully stored, False otherwise.
+        """
+        writes = {BOOK_META_KEY: {"applied_through": self.applied_through},
+                  BOOK_MARKETS_KEY: {market_id: True for market_id in self.unsaved}}
+        deletes = {}
+        for market_id, borrowers in self.unsaved.items():
+            positions = self.entries.get(market_id, {})
+            writes[book_key(market_id)] = {
+                borrower: [positions[borrower].supply_shares, positions[borrower].borrow_shares,
+                           positions[borrower].collateral]
+                for borrower in borrowers if borrower in positions
+            }
+            deletes[book_key(market_id)] = [borrower for borrower in borrowers if borrower not in positions]
+        if not await store_hashes(writes, deletes=deletes):
+            return False
+        self.unsaved = {}
+        return True
+
+    def positions(self, market_id: str) -> Dict[str, BookEntry]:
+        """
+        @:dev Get the positions of a market.
+
+        Args:
+            market_id (str): The market unique key.
+
+        Returns:
+            Dict[str, BookEntry]: The positions keyed by borrower.
+        """
+        return self.entries.get(market_id.lower(), {})
+
+    def drain_dirty(self, market_id: str) -> Set[str]:
+        """
+        @:dev Get and reset the borrowers of a market that changed since the last call.
+
+        Args:
+            market_id (str): The market unique key.
+
+        Returns:
+            Set[str]: The changed borrowers.
+        """
+        return self.dirty.pop(market_id.lower(), set())
+
+    def apply(self, event: EventData):
+        """
+        @:dev Apply a single decoded Morpho event to the book.
+
+        Args:
+            event (EventData): The decoded event.
+        """
+        args = event.args
+        name = event.event
+        if name in ("CreateMarket", "AccrueInterest"):
+            # Interest only moves market totals, which are read from the market snapshot
+            return
+        market_id = Web3.to_hex(args["id"])
+        if name == "Supply":
+            self.__change(event, market_id, args["onBehalf"], supply_shares=args["shares"])
+        elif name == "Withdraw":
+            self.__change(event, market_id, args["onBehalf"], supply_shares=-args["shares"])
+        elif name == "Borrow":
+            self.__change(event, market_id, args["onBehalf"], borrow_shares=args["shares"])
+        elif name == "Repay":
+            self.__change(event, market_id, args["onBehalf"], borrow_shares=-args["shares"])
+        elif name == "SupplyCollateral":
+            self.__change(event, market_id, args["onBehalf"], collateral=args["assets"])
+        elif name == "WithdrawCollateral":
+            self.__change(event, market_id, args["onBehalf"], collateral=-args["assets"])
+        elif name == "Liquidate":
+            self.__change(event, market_id, args["borrower"],
+                          borrow_shares=-(args["repaidShares"] + args["badDebtShares"]),
+                          collateral=-args["seizedAssets"])
+
+    def __change(self, event: EventData, market_id: str, borrower: str, supply_shares: int = 0,
+                 borrow_shares: int = 0, collateral: int = 0):
+        """
+        @:dev Add a change to a position and record it in the undo log.
+
+        Args:
+            event (EventData): The event causing the change.
+            market_id (str): The market unique key.
+            borrower (str): The owner of the position.
+            supply_shares (int): The change of supply shares.
+            borrow_shares (int): The change of borrow shares.
+            collateral (int): The change of collateral.
+        """
+        positions = self.entries.setdefault(market_id, {})
+        entry = positions.setdefault(borrower, BookEntry())
+        entry.supply_shares += supply_shares
+        entry.borrow_shares += borrow_shares
+        entry.collateral += collateral
+        if entry.is_empty():
+            del positions[borrower]
+        self.dirty.setdefault(market_id, set()).add(borrower)
+        self.unsaved.setdefault(market_id, set()).add(borrower)
+        self.undo.append((event.blockNumber, market_id, borrower,
+                          BookEntry(supply_shares, borrow_shares, collateral)))
+
+    async def on_events(self, events: List[EventData]):
+        """
+        @:dev Event indexer handler applying a block range of events and persisting the changed
+        entries.
+
+        @:dev Events at or below the last persisted block were already applied before a restart
+        and are skipped.
+
+        Args:
+            events (List[EventData]): The decoded events of a block range, in block order.
+        """
+        events = [event for event in events if event.blockNumber > self.applied_through]
+        if not events:
+            return
+        for event in events:
+            try:
+                self.apply(event)
+            except Exception:
+                print(f"Error applying {event.event} event to the position book")
+                print(traceback.format_exc())
+        self.applied_through = events[-1].blockNumber
+        while self.undo and self.undo[0][0] <= self.applied_through - self.reorg_depth:
+            self.undo.popleft()
+        await self.save()
+
+    async def on_reorg(self, fork_block: int):
+        """
+        @:dev Event indexer reorg handler rolling back every change from the forked blocks.
+
+        Args:
+            fork_block (int): The first block that is no longer canonical.
+        """
+        while self.undo and self.undo[-1][0] >= fork_block:
+            _, market_id, borrower, change = self.undo.pop()
+            positions = self.entries.setdefault(market_id, {})
+            entry = positions.setdefault(borrower, BookEntry())
+            entry.supply_shares -= change.supply_shares
+            entry.borrow_shares -= change.borrow_shares
+            entry.collateral -= change.collateral
+            if entry.is_empty():
+                del positions[borrower]
+            self.dirty.setdefault(market_id, set()).add(borrower)
+            self.unsaved.setdefault(market_id, set()).add(borrower)
+        self.applied_through = min(self.applied_through, fork_block - 1)
+        await self.save()
@@ -0,0 +1,104 @@
+from enum import IntEnum
+from typing import Dict, Iterable, List, Optional
+
+from models.market_positions import MarketPosition
+
+
+class PositionSource(IntEnum):
+    # Positions read back from Redis, liquidated positions and suppliers seen by the indexer
+    CACHE = 0
+    # Positions streamed from the GraphQL API or the event-sourced position book
+    LIVE = 1
+
+
+class PositionIndex:
+    positions: Dict[str, MarketPosition]
+    sources: Dict[str, PositionSource]
+
+    def __init__(self):
+        """
+        @:dev The positions of one market keyed by lowercased borrower address.
+
+        @:dev Precedence when a borrower is seen more than once:
+        - a live position replaces a cached one, its balances are fresher, and clears the
+          cached liquidated flag because the borrower still shows up with a position
+        - a cached position never replaces a live one
+        - within the same source the first position wins, later duplicates (e.g. from API pages
+          shifting while they are read) are dropped
+        """
+        self.positions = {}
+        self.sources = {}
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def get(self, borrower: str) -> Optional[MarketPosition]:
+        """
+        @:dev Get the position of a borrower.
+
+        Args:
+            borrower (str): The borrower address, in any case.
+
+        Returns:
+            MarketPosition: The position, or None if the borrower is unknown.
+        """
+        return self.positions.get(borrower.lower())
+
+    def merge(self, positions: Iterable[MarketPosition], source: PositionSource) -> List[MarketPosition]:
+        """
+        @:dev Merge positions from a source following the precedence rules.
+
+        Args:
+            positions (Iterable[MarketPosition]): The positions to merge.
+            source (PositionSource): Where the positions come from.
+
+        Returns:
+            List[MarketPosition]: The positions that were added or replaced a lower precedence
+            entry, i.e. the ones still to evaluate.
+        """
+        merged = []
+        for position in positions:
+            if position is None or position.user is None or position.user.address is None:
+                continue
+            borrower = position.user.address.lower()
+            known = self.sources.get(borrower)
+            if known is not None and known >= source:
+                continue
+            if known is not None and source > known:
+                position.liquidated = False
+            self.positions[borrower] = position
+            self.sources[borrower] = source
+            merged.append(position)
+        return merged
+
+    def pending(self, source: Optional[PositionSource] = None) -> List[MarketPosition]:
+        """
+        @:dev Get the positions that are not liquidated.
+
+        Args:
+            source (PositionSource): Only return positions last merged from this source.
+
+        Returns:
+            List[MarketPosition]: The positions.
+        """
+        return [position for borrower, position in self.positions.items()
+                if not position.liquidated and (source is None or self.sources[borrower] == source)]
+
+    def mark_liquidated(self, borrowers: Iterable[str]) -> List[MarketPosition]:
+        """
+        @:dev Mark the positions of liquidated borrowers in a single pass.
+
+        Args:
+            borrowers (Iterable[str]): The liquidated borrower addresses, in any case.
+
+        Returns:
+            List[MarketPosition]: The positions newly marked as liquidated, each at most once.
+        """
+        liquidated = []
+        for borrower in borrowers:
+            position = self.positions.get(borrower.lower())
+            if position is None or position.liquidated:
+                continue
+            position.liquidated = True
+            liquidated.append(position)
+        return liquidated
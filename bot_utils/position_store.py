@@ -0,0 +1,159 @@
+from typing import Callable, Dict, Iterable, List, Optional
+
+from bot_utils.codec import decode
+from bot_utils.helpers import cache_codec, redis_instance, get_cache
+
+MARKETS_KEY = "markets:index"
+
+# Hashes already checked for a legacy JSON list during this run
+migrated = set()
+
+
+def positions_key(unique_key: str) -> str:
+    """
+    @:dev Get the Redis hash holding the cached positions of a market.
+
+    Args:
+        unique_key (str): The market unique key.
+
+    Returns:
+        str: The Redis key.
+    """
+    return f"positions:{unique_key.lower()}"
+
+
+async def store_hashes(writes: Dict[str, Dict[str, object]], only_new: bool = False,
+                       deletes: Optional[Dict[str, Iterable[str]]] = None) -> bool:
+    """
+    @:dev Write and delete fields of several hashes in one pipelined MULTI transaction.
+
+    Args:
+        writes (Dict[str, Dict[str, object]]): The fields to write, keyed by hash key and field.
+        only_new (bool): Only write fields that do not exist yet (HSETNX).
+        deletes (Dict[str, Iterable[str]]): The fields to delete, keyed by hash key.
+
+    Returns:
+        bool: True if the fields were successfully stored, False otherwise.
+    """
+    writes = {key: fields for key, fields in writes.items() if fields}
+    deletes = {key: list(fields) for key, fields in (deletes or {}).items() if fields}
+    if not writes and not deletes:
+        return True
+    try:
+        pipe = redis_instance.pipeline(transaction=True)
+        for key, fields in writes.items():
+            if only_new:
+                for field, value in fields.items():
+                    pipe.hsetnx(key, field, cache_codec.encode(value))
+            else:
+                pipe.hset(key, mapping={field: cache_codec.encode(value) for field, value in fields.items()})
+        for key, fields in deletes.items():
+            pipe.hdel(key, *fields)
+        await pipe.execute()
+        return True
+    except Exception as e:
+        print(f"Error storing hashes {list(writes)}, error: {e}")
+        return False
+
+
+async def get_hash(key: str, fields: Optional[List[str]] = None) -> Dict[str, object]:
+    """
+    @:dev Read a whole hash with HGETALL, or only the given fields with one batched HMGET.
+
+    Args:
+        key (str): The hash key.
+        fields (List[str]): The fields to read, every field if omitted.
+
+    Returns:
+        Dict[str, object]: The decoded values keyed by field, missing fields are left out.
+    """
+    if fields is None:
+        data = await redis_instance.hgetall(key)
+        return {field.decode() if isinstance(field, bytes) else field: decode(value)
+                for field, value in data.items()}
+    if not fields:
+        return {}
+    values = await redis_instance.hmget(key, fields)
+    return {field: decode(value) for field, value in zip(fields, values) if value is not None}
+
+
+async def migrate_legacy(key: str, legacy_key: str, field: Callable[[dict], str]):
+    """
+    @:dev Move a legacy JSON list stored with store_cache into a hash, once per run.
+
+    Args:
+        key (str): The hash key.
+        legacy_key (str): The key of the legacy JSON list.
+        field (Callable[[dict], str]): Get the hash field of a list item.
+    """
+    if key in migrated:
+        return
+    legacy = await get_cache(legacy_key)
+    items = legacy.get("data", [])
+    if isinstance(items, list) and items:
+        # Fields written since the upgrade are newer than the legacy list
+        if await store_hashes({key: {field(item): item for item in items}}, only_new=True):
+            await redis_instance.delete(legacy_key)
+            print(f"Migrated {len(items)} items from {legacy_key} to {key}")
+        else:
+            return
+    migrated.add(key)
+
+
+async def store_positions(unique_key: str, positions: List[dict], only_new: bool = False) -> bool:
+    """
+    @:dev Store changed positions of a market, one hash field per borrower.
+
+    Args:
+        unique_key (str): The market unique key.
+        positions (List[dict]): The positions as produced by MarketPosition.to_dict.
+        only_new (bool): Keep positions that are already cached untouched.
+
+    Returns:
+        bool: True if the positions were successfully stored, False otherwise.
+    """
+    await migrate_legacy(positions_key(unique_key), unique_key, lambda item: item["user"]["address"])
+    fields = {position["user"]["address"]: position for position in positions}
+    return await store_hashes({positions_key(unique_key): fields}, only_new=only_new)
+
+
+async def load_positions(unique_key: str, borrowers: Optional[List[str]] = None) -> List[dict]:
+    """
+    @:dev Read the cached positions of a market, migrating the legacy JSON list first.
+
+    Args:
+        unique_key (str): The market unique key.
+        borrowers (List[str]): Only read these borrowers, all positions if omitted.
+
+    Returns:
+        List[dict]: The cached positions.
+    """
+    await migrate_legacy(positions_key(unique_key), unique_key, lambda item: item["user"]["address"])
+    positions = await get_hash(positions_key(unique_key), borrowers)
+    return list(positions.values())
+
+
+async def store_markets(markets: List[dict]) -> bool:
+    """
+    @:dev Store markets in the market index, one hash field per market.
+
+    Args:
+        markets (List[dict]): The markets as produced by Market.to_dict.
+
+    Returns:
+        bool: True if the markets were successfully stored, False otherwise.
+    """
+    await migrate_legacy(MARKETS_KEY, "markets", lambda item: item["uniqueKey"])
+    return await store_hashes({MARKETS_KEY: {market["uniqueKey"]: market for market in markets}})
+
+
+async def load_markets() -> List[dict]:
+    """
+    @:dev Read the market index, migrating the legacy JSON list first.
+
+    Returns:
+        List[dict]: The cached markets.
+    """
+    await migrate_legacy(MARKETS_KEY, "markets", lambda item: item["uniqueKey"])
+    markets = await get_hash(MARKETS_KEY)
+    return list(markets.values())
@@ -0,0 +1,151 @@
+import asyncio
+from typing import AsyncIterator, List
+
+from bot_utils.graphql_client import GraphQLClient
+from models.market_positions import MarketPosition, MarketsPositionResponse
+
+# Largest page the Morpho API serves for a single marketPositions request
+MAX_PAGE_SIZE = 1000
+
+MARKET_POSITIONS_QUERY = """
+query MarketPositions($first: Int!, $skip: Int!, $uniqueKeys: [String!]) {
+  marketPositions(
+    first: $first
+    skip: $skip
+    orderBy: BorrowShares
+    orderDirection: Desc
+    where: {
+      marketUniqueKey_in: $uniqueKeys
+    }
+  ) {
+    pageInfo {
+      count
+      countTotal
+    }
+    items {
+      supplyShares
+      supplyAssets
+      supplyAssetsUsd
+      borrowShares
+      borrowAssets
+      borrowAssetsUsd
+      collateral
+      collateralUsd
+      market {
+        uniqueKey
+        lltv
+        oracleAddress
+        irmAddress
+        loanAsset {
+          address
+          symbol
+        }
+        collateralAsset {
+          address
+          symbol
+        }
+        state {
+          borrowApy
+          borrowAssets
+          borrowAssetsUsd
+          supplyApy
+          supplyAssets
+          supplyAssetsUsd
+          fee
+          utilization
+        }
+      }
+      user {
+        address
+      }
+    }
+  }
+}
+"""
+
+
+class PositionFetchError(Exception):
+    """
+    @:dev Raised when a page of positions could not be fetched, so callers can tell a failed
+    request from the end of the positions.
+    """
+
+
+def has_borrow(position: MarketPosition) -> bool:
+    """
+    @:dev Check whether a position carries any debt.
+
+    Args:
+        position (MarketPosition): The position to check.
+
+    Returns:
+        bool: True if the position has borrow shares, False otherwise.
+    """
+    return position.borrow_shares is not None and int(position.borrow_shares) > 0
+
+
+async def fetch_positions_page(client: GraphQLClient, unique_keys: List[str], skip: int,
+                               page_size: int) -> List[MarketPosition]:
+    """
+    @:dev Fetch a single page of market positions.
+
+    Args:
+        client (GraphQLClient): The shared GraphQL client.
+        unique_keys (List[str]): The unique keys of the markets to query.
+        skip (int): The number of positions to skip.
+        page_size (int): The number of positions to request.
+
+    Returns:
+        List[MarketPosition]: The positions in the page.
+
+    Raises:
+        PositionFetchError: If the request failed or the response carries errors.
+    """
+    variables = {"first": page_size, "skip": skip, "uniqueKeys": unique_keys}
+    position_data = await client.post(query=MARKET_POSITIONS_QUERY, variables=variables)
+    if position_data is None:
+        raise PositionFetchError(f"Request of the positions page at skip {skip} failed")
+    if position_data.get("errors"):
+        raise PositionFetchError(f"Error fetching positions page at skip {skip}: {position_data.get('errors')}")
+    return MarketsPositionResponse.from_dict(position_data).market_positions
+
+
+async def stream_market_positions(client: GraphQLClient, unique_keys: List[str],
+                                  page_size: int = MAX_PAGE_SIZE) -> AsyncIterator[List[MarketPosition]]:
+    """
+    @:dev Page through every borrow position of the given markets.
+
+    @:dev Positions are ordered by borrow shares, so paging stops at an empty page or at the
+    first position without debt. The next page is requested before the current one is yielded,
+    which lets the caller evaluate page n while page n + 1 is still loading.
+
+    Args:
+        client (GraphQLClient): The shared GraphQL client.
+        unique_keys (List[str]): The unique keys of the markets to query.
+        page_size (int): The number of positions per page, capped at the API limit.
+
+    Yields:
+        List[MarketPosition]: The borrow positions of each page as it arrives.
+
+    Raises:
+        PositionFetchError: If a page could not be fetched, the positions after it are unknown.
+    """
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    skip = 0
+    next_page = asyncio.create_task(fetch_positions_page(client, unique_keys, skip, page_size))
+    try:
+        while next_page is not None:
+            page = await next_page
+            next_page = None
+            if not page:
+                return
+            borrowers = [position for position in page if has_borrow(position)]
+            if len(page) == page_size and len(borrowers) == len(page):
+                skip += page_size
+                next_page = asyncio.create_task(
+                    fetch_positions_page(client, unique_keys, skip, page_size))
+            if borrowers:
+                yield borrowers
+    finally:
+        if next_page is not None:
+            next_page.cancel()
@@ -0,0 +1,160 @@
+import asyncio
+import traceback
+from dataclasses import dataclass, field
+from typing import Callable, Generic, List, Optional, Tuple, TypeVar
+
+from web3 import AsyncWeb3
+from web3.contract import AsyncContract
+
+from bot_utils.helpers import revert_reason
+
+K = TypeVar("K")
+Call = Tuple[str, bytes]
+# Chooses the calls of a bundle from their keys and gas estimates within a gas budget
+Packer = Callable[[List[K], List[int], int], List[int]]
+
+# Intrinsic gas of a transaction, paid once per bundle rather than once per call
+TX_BASE_GAS = 21000
+
+
+@dataclass
+class PreflightResult(Generic[K]):
+    keys: List[K] = field(default_factory=list)
+    calls: List[Call] = field(default_factory=list)
+    gas_per_call: List[int] = field(default_factory=list)
+    gas_limit: int = 0
+    block_number: Optional[int] = None
+    failed: List[Tuple[K, str]] = field(default_factory=list)
+
+
+class Preflight:
+    web3: AsyncWeb3
+    liquidator_contract: AsyncContract
+
+    def __init__(self, web3: AsyncWeb3, liquidator_contract: AsyncContract, gas_buffer: float = 0.2,
+                 max_gas: int = 30_000_000, max_concurrency: int = 8):
+        """
+        @:dev Simulates liquidation bundles against the latest block before they are sent.
+
+        @:dev The bundle is eth_called through tryAggregate from the sending account and calls
+        that would revert are dropped. Each remaining call gets its own gas estimate, the bundle is
+        trimmed to max_gas in the given order and the transaction gas limit is the bundle's own
+        estimate plus gas_buffer. A packer may choose which calls fit instead of trimming in order.
+
+        Args:
+            web3 (AsyncWeb3): AsyncWeb3 instance for blockchain interactions.
+            liquidator_contract (AsyncContract): The liquidator contract on the AsyncWeb3 instance.
+            gas_buffer (float): Fraction added on top of the bundle's gas estimate.
+            max_gas (int): The largest gas limit a bundle may use, capped by the block gas limit.
+            max_concurrency (int): The number of per-call gas estimates in flight at once.
+        """
+        self.web3 = web3
+        self.liquidator_contract = liquidator_contract
+        self.gas_buffer = gas_buffer
+        self.max_gas = max_gas
+        self.max_concurrency = max_concurrency
+
+    async def run(self, entries: List[Tuple[K, Call]], sender: str,
+                  pack: Optional[Packer] = None) -> PreflightResult[K]:
+        """
+        @:dev Simulate a bundle and size its transaction.
+
+        Args:
+            entries (List[Tuple[K, Call]]): The calls of the bundle in priority order, each
+            paired with its key.
+            sender (str): The account sending the bundle.
+            pack (Packer): Optional packer choosing the calls that fit the bundle gas limit,
+            returning their indices. Calls are kept in order until the limit when omitted.
+
+        Returns:
+            PreflightResult[K]: The calls that will succeed with their keys and gas estimates, the
+            gas limit of the bundle and the keys of the dropped calls with the reason. An empty
+            result means nothing should be sent.
+        """
+        result = PreflightResult()
+        if not entries:
+            return result
+        block = await self.web3.eth.get_block("latest")
+        result.block_number = block["number"]
+        max_gas = min(self.max_gas, int(block["gasLimit"] * 0.9))
+        transaction = {"from": sender}
+
+        calls = [call for _, call in entries]
+        outcomes = await self.liquidator_contract.functions.tryAggregate(False, calls).call(
+            transaction, block_identifier=result.block_number)
+        viable = []
+        for (key, call), (success, return_data) in zip(entries, outcomes):
+            if success:
+                viable.append((key, call))
+            else:
+                result.failed.append((key, revert_reason(return_data)))
+        if not viable:
+            return result
+
+        estimates = await self.estimate_calls([call for _, call in viable], transaction, result.block_number)
+        estimated = []
+        for (key, call), gas in zip(viable, estimates):
+            if gas is None:
+                result.failed.append((key, "gas estimation failed"))
+            else:
+                estimated.append((key, call, gas))
+        if pack is not None:
+            chosen = set(pack([key for key, _, _ in estimated], [gas for _, _, gas in estimated],
+                              max_gas - TX_BASE_GAS))
+        else:
+            chosen = None
+        used = TX_BASE_GAS
+        for index, (key, call, gas) in enumerate(estimated):
+            if chosen is not None and index not in chosen:
+                result.failed.append((key, "left out by bundle packing"))
+                continue
+            if used + gas > max_gas:
+                result.failed.append((key, f"bundle gas limit of {max_gas} reached"))
+                continue
+            used += gas
+            result.keys.append(key)
+            result.calls.append(call)
+            result.gas_per_call.append(gas)
+        if not result.calls:
+            return result
+
+        # Estimated with requireSuccess, without it a call running out of gas does not revert the
+        # bundle and the estimate settles on a limit too low for the calls under the 63/64 rule
+        try:
+            bundle_gas = await self.liquidator_contract.functions.tryAggregate(True, result.calls).estimate_gas(
+                transaction, block_identifier=result.block_number)
+        except Exception:
+            # A call reverting at the estimate's block makes it fail, the per-call estimates summed
+            # give every call the gas it needs alone but ignore warm storage shared between calls
+            print("Error estimating bundle gas, using the per-call estimates")
+            print(traceback.format_exc())
+            bundle_gas = used
+        bundle_gas = max(bundle_gas, used)
+        result.gas_limit = min(int(bundle_gas * (1 + self.gas_buffer)), max_gas)
+        return result
+
+    async def estimate_calls(self, calls: List[Call], transaction: dict, block_number: int) -> List[Optional[int]]:
+        """
+        @:dev Estimate the gas of every call on its own, without the transaction's intrinsic gas.
+
+        Args:
+            calls (List[Call]): The calls to estimate.
+            transaction (dict): The transaction fields used for the estimates.
+            block_number (int): The block to estimate against.
+
+        Returns:
+            List[Optional[int]]: The gas of each call, None if the estimate failed.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def estimate(call: Call) -> Optional[int]:
+            async with semaphore:
+                try:
+                    gas = await self.liquidator_contract.functions.tryAggregate(True, [call]).estimate_gas(
+                        transaction, block_identifier=block_number)
+                    return max(gas - TX_BASE_GAS, 0)
+                except Exception as error:
+                    print(f"Error estimating gas of a liquidation call: {error}")
+                    return None
+
+        return await asyncio.gather(*(estimate(call) for call in calls))
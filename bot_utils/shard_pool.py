@@ -0,0 +1,198 @@
+import asyncio
+import multiprocessing
+import traceback
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Dict, List, Optional, Set, Tuple
+
+from bot_utils.hash_ring import ConsistentHashRing
+from bot_utils.markets_behaviour import MarketsBehaviour
+from models.market_positions import MarketPosition
+
+SCAN = "scan"
+
+
+def run_worker(shard_id: int, unique_keys: List[str], settings: dict, connection: Connection):
+    """
+    @:dev Entry point of a worker process, scans its shard of markets whenever asked to.
+
+    Args:
+        shard_id (int): The shard served by the worker.
+        unique_keys (List[str]): The unique keys of the shard's markets.
+        settings (dict): The keyword arguments of MarketsBehaviour.
+        connection (Connection): The worker's end of the pipe to the coordinator.
+    """
+    try:
+        asyncio.run(serve(shard_id, unique_keys, settings, connection))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connection.close()
+
+
+async def serve(shard_id: int, unique_keys: List[str], settings: dict, connection: Connection):
+    """
+    @:dev Answer scan requests of the coordinator until it sends None. A request carries the
+    unique keys to scan, None for the whole shard.
+
+    @:dev Every reply is a ("ok", (positions, health factors)) or ("error", traceback) tuple, the
+    unhealthy positions and lowest health factors of the shard keyed by lowercased market unique
+    key.
+
+    Args:
+        shard_id (int): The shard served by the worker.
+        unique_keys (List[str]): The unique keys of the shard's markets.
+        settings (dict): The keyword arguments of MarketsBehaviour.
+        connection (Connection): The worker's end of the pipe to the coordinator.
+    """
+    # Scoped to the shard so the worker only snapshots and scans its own markets
+    markets_behaviour = MarketsBehaviour(**settings, unique_keys=unique_keys)
+    await markets_behaviour.init()
+    print(f"Shard {shard_id} scanning {len(markets_behaviour.markets)} markets")
+    loop = asyncio.get_running_loop()
+    while True:
+        command = await loop.run_in_executor(None, connection.recv)
+        if command is None:
+            return
+        _, scan_keys = command
+        try:
+            unhealthy = await markets_behaviour.scan_all(scan_keys)
+            connection.send(("ok", (unhealthy, markets_behaviour.min_health_factors(scan_keys))))
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+
+
+class ShardPool:
+    ring: ConsistentHashRing[int]
+    shards: Dict[int, List[str]]
+    workers: Dict[int, Tuple[BaseProcess, Connection]]
+
+    def __init__(self, settings: dict, processes: int, replicas: int = 64, scan_timeout: float = 300):
+        """
+        @:dev Process pool scanning markets on several CPU cores.
+
+        @:dev Markets are sharded across worker processes by consistent hashing of their unique
+        key, so a market stays on the same worker and its cached state stays warm. Each worker
+        runs its own event loop, clients and contracts. Workers only scan, the coordinator gathers
+        their unhealthy positions and is the single process sending transactions, so nonces are
+        never shared between processes. A worker that dies is restarted on the next scan, one that
+        does not reply within scan_timeout is terminated and restarted.
+
+        Args:
+            settings (dict): The keyword arguments of MarketsBehaviour, they must be picklable.
+            processes (int): The number of worker processes.
+            replicas (int): The number of virtual points of each worker on the hash ring.
+            scan_timeout (float): Seconds a worker gets to reply to a scan request.
+        """
+        self.settings = settings
+        self.scan_timeout = scan_timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.ring = ConsistentHashRing(range(processes), replicas=replicas)
+        self.shards = {}
+        self.workers = {}
+
+    def start(self, unique_keys: List[str]):
+        """
+        @:dev Shard the markets and start one worker per non-empty shard.
+
+        Args:
+            unique_keys (List[str]): The unique keys of all markets.
+        """
+        self.shards = self.ring.assign(sorted({unique_key.lower() for unique_key in unique_keys}))
+        for shard_id, keys in self.shards.items():
+            print(f"Shard {shard_id}: {len(keys)} markets")
+            self.__spawn(shard_id)
+
+    def __spawn(self, shard_id: int):
+        """
+        @:dev Start the worker of a shard.
+
+        Args:
+            shard_id (int): The shard.
+        """
+        parent, child = self.context.Pipe()
+        process = self.context.Process(target=run_worker, name=f"shard-{shard_id}", daemon=True,
+                                       args=(shard_id, self.shards[shard_id], self.settings, child))
+        process.start()
+        child.close()
+        self.workers[shard_id] = (process, parent)
+
+    async def scan(self, unique_keys: Optional[Set[str]] = None) -> Tuple[Dict[str, List[MarketPosition]],
+                                                                           Dict[str, Optional[float]]]:
+        """
+        @:dev Scan all shards in parallel.
+
+        Args:
+            unique_keys (Set[str]): Only scan the markets with these lowercased unique keys.
+
+        Returns:
+            Tuple[Dict[str, List[MarketPosition]], Dict[str, Optional[float]]]: The unhealthy
+            positions and the lowest health factor of each market keyed by lowercased market
+            unique key, markets of failed shards are missing.
+        """
+        loop = asyncio.get_running_loop()
+        shard_ids = [shard_id for shard_id, keys in self.shards.items()
+                     if unique_keys is None or any(key in unique_keys for key in keys)]
+        replies = await asyncio.gather(*(loop.run_in_executor(None, self.__request, shard_id, unique_keys)
+                                         for shard_id in shard_ids))
+        unhealthy: Dict[str, List[MarketPosition]] = {}
+        health_factors: Dict[str, Optional[float]] = {}
+        for reply in replies:
+            if reply is not None:
+                unhealthy.update(reply[0])
+                health_factors.update(reply[1])
+        return unhealthy, health_factors
+
+    def __request(self, shard_id: int,
+                  unique_keys: Optional[Set[str]] = None) -> Optional[Tuple[Dict[str, List[MarketPosition]],
+                                                                            Dict[str, Optional[float]]]]:
+        """
+        @:dev Ask a worker to scan its shard and wait for the reply, runs in a thread.
+
+        Args:
+            shard_id (int): The shard.
+            unique_keys (Set[str]): Only scan the markets with these lowercased unique keys.
+
+        Returns:
+            Tuple[Dict[str, List[MarketPosition]], Dict[str, Optional[float]]]: The shard's
+            unhealthy positions and lowest health factors, None if it failed.
+        """
+        process, connection = self.workers[shard_id]
+        try:
+            if not process.is_alive():
+                raise EOFError(f"worker exited with code {process.exitcode}")
+            connection.send((SCAN, unique_keys))
+            if not connection.poll(self.scan_timeout):
+                raise TimeoutError(f"no reply within {self.scan_timeout}s")
+            status, payload = connection.recv()
+        except (EOFError, OSError) as error:
+            print(f"Shard {shard_id} worker lost ({error}), restarting it")
+            if process.is_alive():
+                process.terminate()
+                process.join(1)
+            connection.close()
+            self.__spawn(shard_id)
+            return None
+        if status != "ok":
+            print(f"Shard {shard_id} scan failed: {payload}")
+            return None
+        return payload
+
+    def close(self, timeout: float = 10):
+        """
+        @:dev Stop all workers.
+
+        Args:
+            timeout (float): Seconds each worker gets to exit before it is terminated.
+        """
+        for process, connection in self.workers.values():
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process, connection in self.workers.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+            connection.close()
+        self.workers = {}
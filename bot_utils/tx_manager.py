@@ -0,0 +1,338 @@
+import asyncio
+import heapq
+import time
+import traceback
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from eth_account.signers.local import LocalAccount
+from web3 import AsyncWeb3
+from web3.contract.async_contract import AsyncContractFunction
+from web3.exceptions import TransactionNotFound
+from web3.types import TxReceipt
+
+GWEI = 10 ** 9
+
+ReceiptHandler = Callable[[Optional[TxReceipt]], Awaitable]
+
+
+class NonceManager:
+    web3: AsyncWeb3
+    address: str
+
+    def __init__(self, web3: AsyncWeb3, address: str):
+        """
+        @:dev Hands out nonces locally so concurrent senders never reuse one.
+
+        @:dev The first nonce comes from the account's pending transaction count, later ones are
+        incremented in memory. A nonce nothing was broadcast with is released and handed out
+        again first, so it does not leave a gap holding back the higher nonces already sent.
+        resync() reloads the next nonce from the chain after a failed send or a transaction that
+        never got mined, never below a nonce still reserved or in flight.
+        @:dev The manager also owns the background tasks following sent transactions until they
+        are mined, keyed by nonce, so senders return as soon as a transaction is broadcast.
+
+        Args:
+            web3 (AsyncWeb3): AsyncWeb3 instance for blockchain interactions.
+            address (str): The sending account.
+        """
+        self.web3 = web3
+        self.address = address
+        self.next_nonce: Optional[int] = None
+        self.lock = asyncio.Lock()
+        # Nonces handed out and not broadcast yet, and nonces given back unused (a heap)
+        self.reserved: Set[int] = set()
+        self.released: List[int] = []
+        self.in_flight: Dict[int, asyncio.Task] = {}
+
+    async def allocate(self) -> int:
+        """
+        @:dev Reserve the next nonce, the lowest released one first.
+
+        Returns:
+            int: The nonce.
+        """
+        async with self.lock:
+            if self.released:
+                nonce = heapq.heappop(self.released)
+            else:
+                if self.next_nonce is None:
+                    self.next_nonce = await self.web3.eth.get_transaction_count(self.address, "pending")
+                nonce = self.next_nonce
+                self.next_nonce += 1
+            self.reserved.add(nonce)
+            return nonce
+
+    def release(self, nonce: int):
+        """
+        @:dev Give back a reserved nonce nothing was broadcast with.
+
+        Args:
+            nonce (int): The nonce.
+        """
+        self.reserved.discard(nonce)
+        heapq.heappush(self.released, nonce)
+
+    async def resync(self):
+        """
+        @:dev Reload the next nonce from the chain, keeping it above every nonce still reserved or
+        in flight. Released nonces the chain already used are dropped.
+        """
+        async with self.lock:
+            pending = await self.web3.eth.get_transaction_count(self.address, "pending")
+            self.next_nonce = max([pending] + [nonce + 1 for nonce in self.reserved | set(self.in_flight)])
+            self.released = [nonce for nonce in self.released if nonce >= pending]
+            heapq.heapify(self.released)
+
+    def track(self, nonce: int, tracker: Awaitable):
+        """
+        @:dev Follow a sent transaction in the background until its tracker returns.
+
+        Args:
+            nonce (int): The nonce of the transaction.
+            tracker (Awaitable): The coroutine polling its receipt and replacing it while stuck.
+        """
+        task = asyncio.create_task(tracker)
+        self.reserved.discard(nonce)
+        self.in_flight[nonce] = task
+        task.add_done_callback(lambda _: self.in_flight.pop(nonce, None))
+
+
+class FeeStrategy:
+    web3: AsyncWeb3
+
+    def __init__(self, web3: AsyncWeb3, priority_fee_percentile: float = 50, history_blocks: int = 10,
+                 base_fee_multiplier: float = 2, max_fee_per_gas: Optional[int] = None,
+                 bump: float = 0.125):
+        """
+        @:dev EIP-1559 fee bidding from recent blocks.
+
+        @:dev The priority fee is the given percentile of the tips paid in the last history_blocks
+        blocks, the max fee leaves room for the base fee to rise for a few blocks. Replacements
+        raise both fees by at least bump, nodes reject replacements below 10%.
+
+        Args:
+            web3 (AsyncWeb3): AsyncWeb3 instance for blockchain interactions.
+            priority_fee_percentile (float): Percentile of recent priority fees to bid.
+            history_blocks (int): The number of recent blocks sampled.
+            base_fee_multiplier (float): Multiple of the next base fee covered by the max fee.
+            max_fee_per_gas (int): Optional cap on the max fee per gas, in wei.
+            bump (float): Fraction both fees are raised by when a transaction is replaced.
+        """
+        self.web3 = web3
+        self.priority_fee_percentile = priority_fee_percentile
+        self.history_blocks = history_blocks
+        self.base_fee_multiplier = base_fee_multiplier
+        self.max_fee_per_gas = max_fee_per_gas
+        self.bump = bump
+
+    async def fees(self) -> Tuple[int, int]:
+        """
+        @:dev Get the fees of a new transaction.
+
+        Returns:
+            Tuple[int, int]: The max fee per gas and the max priority fee per gas, in wei.
+        """
+        history = await self.web3.eth.fee_history(self.history_blocks, "latest",
+                                                  [self.priority_fee_percentile])
+        # The last base fee is the one of the next block
+        base_fee = history["baseFeePerGas"][-1]
+        tips = sorted(reward[0] for reward in history.get("reward", []) if reward)
+        priority_fee = tips[len(tips) // 2] if tips else await self.web3.eth.max_priority_fee
+        max_fee = int(base_fee * self.base_fee_multiplier) + priority_fee
+        return self.cap(max_fee, priority_fee)
+
+    def bumped(self, max_fee: int, priority_fee: int) -> Tuple[int, int]:
+        """
+        @:dev Get the fees of a replacement transaction.
+
+        Args:
+            max_fee (int): The max fee per gas of the transaction being replaced.
+            priority_fee (int): The max priority fee per gas of the transaction being replaced.
+
+        Returns:
+            Tuple[int, int]: The raised max fee per gas and max priority fee per gas.
+        """
+        return self.cap(int(max_fee * (1 + self.bump)) + 1, int(priority_fee * (1 + self.bump)) + 1)
+
+    def cap(self, max_fee: int, priority_fee: int) -> Tuple[int, int]:
+        """
+        @:dev Apply the max fee cap, the priority fee never exceeds the max fee.
+
+        Args:
+            max_fee (int): The max fee per gas.
+            priority_fee (int): The max priority fee per gas.
+
+        Returns:
+            Tuple[int, int]: The capped fees.
+        """
+        if self.max_fee_per_gas is not None:
+            max_fee = min(max_fee, self.max_fee_per_gas)
+        return max_fee, min(priority_fee, max_fee)
+
+
+class TransactionManager:
+    web3: AsyncWeb3
+    account: LocalAccount
+
+    def __init__(self, web3: AsyncWeb3, account: LocalAccount, fee_strategy: Optional[FeeStrategy] = None,
+                 poll_interval: float = 1.0, replace_after: float = 30, receipt_timeout: float = 180,
+                 max_replacements: int = 3):
+        """
+        @:dev Signs, sends and follows transactions of one account until they are mined.
+
+        @:dev Nonces come from a shared NonceManager so markets can submit in parallel. Sending
+        returns once the transaction is broadcast, its receipt is polled by a background task of
+        the NonceManager. A transaction still pending after replace_after seconds is replaced
+        with the same nonce and bumped fees, any of the sent versions may be the one that gets
+        mined.
+
+        Args:
+            web3 (AsyncWeb3): AsyncWeb3 instance for blockchain interactions.
+            account (LocalAccount): The sending account.
+            fee_strategy (FeeStrategy): The EIP-1559 fee strategy, default settings if omitted.
+            poll_interval (float): Seconds between receipt polls.
+            replace_after (float): Seconds without a receipt before the transaction is replaced.
+            receipt_timeout (float): Seconds after which the transaction is given up.
+            max_replacements (int): The largest number of replacements of one transaction.
+        """
+        self.web3 = web3
+        self.account = account
+        self.fee_strategy = fee_strategy if fee_strategy is not None else FeeStrategy(web3)
+        self.nonces = NonceManager(web3, account.address)
+        self.poll_interval = poll_interval
+        self.replace_after = replace_after
+        self.receipt_timeout = receipt_timeout
+        self.max_replacements = max_replacements
+        self.chain_id: Optional[int] = None
+
+    async def send(self, function: AsyncContractFunction, gas: int,
+                   on_receipt: Optional[ReceiptHandler] = None) -> str:
+        """
+        @:dev Send a contract call and follow it in the background until it is mined.
+
+        Args:
+            function (AsyncContractFunction): The contract call.
+            gas (int): The gas limit.
+            on_receipt (ReceiptHandler): Called with the receipt of the mined version, or None if
+            none was mined in time.
+
+        Returns:
+            str: The hash of the broadcast transaction.
+
+        Raises:
+            Exception: If the transaction could not be sent at all.
+        """
+        if self.chain_id is None:
+            self.chain_id = await self.web3.eth.chain_id
+        max_fee, priority_fee = await self.fee_strategy.fees()
+        # Built before a nonce is reserved, a call that cannot be built never holds one
+        transaction = await function.build_transaction({
+            "from": self.account.address,
+            "gas": gas,
+            "maxFeePerGas": max_fee,
+            "maxPriorityFeePerGas": priority_fee,
+            "chainId": self.chain_id,
+        })
+        nonce = await self.nonces.allocate()
+        transaction["nonce"] = nonce
+        try:
+            hashes = [await self.__broadcast(transaction)]
+        except Exception:
+            # Nothing was sent with this nonce, it goes to the next transaction unless the chain used it
+            self.nonces.release(nonce)
+            await self.nonces.resync()
+            raise
+        print(f"Sent transaction {hashes[0]} with nonce {nonce}, max fee {max_fee / GWEI:.2f} gwei, "
+              f"priority fee {priority_fee / GWEI:.2f} gwei")
+        self.nonces.track(nonce, self.__follow(transaction, hashes, on_receipt))
+        return hashes[0]
+
+    async def __follow(self, transaction: dict, hashes: List[str], on_receipt: Optional[ReceiptHandler]):
+        """
+        @:dev Poll the receipt of a sent transaction, replace it while it is stuck and hand the
+        receipt over.
+
+        Args:
+            transaction (dict): The fields of the sent transaction.
+            hashes (List[str]): The hashes of every version sent.
+            on_receipt (ReceiptHandler): Called with the receipt, None if none was mined in time.
+        """
+        receipt = await self.__wait(transaction, hashes)
+        if on_receipt is None:
+            return
+        try:
+            await on_receipt(receipt)
+        except Exception:
+            print(f"Error handling the receipt of transaction {hashes[0]}")
+            print(traceback.format_exc())
+
+    async def __wait(self, transaction: dict, hashes: List[str]) -> Optional[TxReceipt]:
+        """
+        @:dev Wait for any version of a transaction to be mined, replacing it with bumped fees
+        every replace_after seconds.
+
+        Args:
+            transaction (dict): The fields of the sent transaction.
+            hashes (List[str]): The hashes of every version sent, replacements are appended.
+
+        Returns:
+            TxReceipt: The receipt of the mined version, None if none was mined in time.
+        """
+        nonce = transaction["nonce"]
+        started = time.monotonic()
+        last_sent = started
+        replacements = 0
+        while time.monotonic() - started < self.receipt_timeout:
+            receipt = await self.__find_receipt(hashes)
+            if receipt is not None:
+                return receipt
+            if replacements < self.max_replacements and time.monotonic() - last_sent >= self.replace_after:
+                transaction["maxFeePerGas"], transaction["maxPriorityFeePerGas"] = self.fee_strategy.bumped(
+                    transaction["maxFeePerGas"], transaction["maxPriorityFeePerGas"])
+                try:
+                    hashes.append(await self.__broadcast(transaction))
+                    print(f"Replaced stuck transaction with nonce {nonce} by {hashes[-1]}, max fee "
+                          f"{transaction['maxFeePerGas'] / GWEI:.2f} gwei")
+                except Exception as error:
+                    # Usually a version already got mined, the next poll finds its receipt
+                    print(f"Error replacing transaction with nonce {nonce}: {error}")
+                replacements += 1
+                last_sent = time.monotonic()
+            await asyncio.sleep(self.poll_interval)
+        print(f"No receipt for nonce {nonce} after {self.receipt_timeout}s, giving up")
+        await self.nonces.resync()
+        return None
+
+    async def __broadcast(self, transaction: dict) -> str:
+        """
+        @:dev Sign and broadcast a transaction.
+
+        Args:
+            transaction (dict): The transaction fields.
+
+        Returns:
+            str: The transaction hash.
+        """
+        signed = self.account.sign_transaction(transaction)
+        tx_hash = await self.web3.eth.send_raw_transaction(signed.rawTransaction)
+        return AsyncWeb3.to_hex(tx_hash)
+
+    async def __find_receipt(self, hashes: List[str]) -> Optional[TxReceipt]:
+        """
+        @:dev Look for the receipt of any sent version of a transaction.
+
+        Args:
+            hashes (List[str]): The hashes of every version sent.
+
+        Returns:
+            TxReceipt: The receipt, None if no version is mined yet.
+        """
+        for tx_hash in reversed(hashes):
+            try:
+                return await self.web3.eth.get_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                continue
+            except Exception:
+                print(f"Error polling receipt of {tx_hash}")
+                print(traceback.format_exc())
+        return None
@@ -0,0 +1,129 @@
+from dataclasses import dataclass, fields as dataclass_fields, is_dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
+
+# Field kinds understood by compile_decoder, anything else is a nested decoder
+STR = "str"
+INT = "int"
+FLOAT = "float"
+BOOL = "bool"
+ANY = "any"
+
+
+@dataclass(frozen=True)
+class Field:
+    key: str
+    name: str
+    kind: Union[str, Callable[[Any], Any]]
+    many: bool = False
+    required: bool = False
+    default: Any = None
+
+
+def field_source(index: int, field: Field) -> List[str]:
+    """
+    @:dev Generate the statements decoding one field into local variable f<index>.
+
+    Args:
+        index (int): The position of the field in the schema.
+        field (Field): The field.
+
+    Returns:
+        List[str]: The source lines.
+    """
+    target = f"f{index}"
+    default = f"d{index}"
+    lines = [f"    v = get({field.key!r}, {default})"]
+    if field.many:
+        lines.append(f"    {target} = [n{index}(x) for x in v] if type(v) is list else None")
+    elif field.kind == STR:
+        lines.append(f"    {target} = v if type(v) is str else None")
+    elif field.kind == INT:
+        # str is checked second, big ints from the API and JSON caches arrive as strings
+        lines.append("    t = type(v)")
+        lines.append(f"    {target} = v if t is int else int(v) if t is str and v else None")
+    elif field.kind == FLOAT:
+        lines.append("    t = type(v)")
+        lines.append(f"    {target} = v if t is float else float(v) if t is int else None")
+    elif field.kind == BOOL:
+        lines.append(f"    {target} = v if type(v) is bool else {default}")
+    elif field.kind == ANY:
+        lines.append(f"    {target} = v")
+    else:
+        lines.append(f"    {target} = n{index}(v) if type(v) is dict else None")
+    if field.required:
+        lines.append(f"    if {target} is None:")
+        lines.append(f"        raise ValueError('Missing or invalid field {field.key} in ' + repr(obj)[:200])")
+    return lines
+
+
+def compile_decoder(cls: type, fields: List[Field], intern: Optional[Tuple[str, Dict[str, Any]]] = None,
+                    intern_when: Optional[List[str]] = None, intern_refresh: Optional[List[str]] = None,
+                    strict: bool = False) -> Callable[[Any], Any]:
+    """
+    @:dev Compile a decoder turning an API or cache dict into an instance of cls.
+
+    @:dev The generated function makes a single type check per field on the expected type and
+    never raises for missing or mistyped fields, they decode to None (or the field default).
+    Only fields marked required raise a ValueError, for responses carrying errors instead of data.
+
+    Args:
+        cls (type): The class to build, called with the fields in schema order.
+        fields (List[Field]): The schema of the class.
+        intern (Tuple[str, Dict[str, Any]]): Optional key field and registry, an instance already
+        registered under the lowercased key is returned without decoding anything else but the
+        fields listed in intern_refresh.
+        intern_when (List[str]): The keys of the fields that must decode to a value for an instance
+        to be registered, all fields if omitted. Partial instances are returned but never
+        registered, so they cannot shadow a complete decode of the same key.
+        intern_refresh (List[str]): The keys of mutable fields decoded again onto a registered
+        instance whenever a payload carries them, e.g. market state.
+        strict (bool): Raise a ValueError instead of returning None when obj is not a mapping.
+
+    Returns:
+        Callable[[Any], Any]: The decoder.
+
+    Raises:
+        TypeError: If the schema does not match the fields of a dataclass.
+    """
+    if is_dataclass(cls) and [field.name for field in dataclass_fields(cls)] != [field.name for field in fields]:
+        raise TypeError(f"Schema of {cls.__name__} does not list its fields in constructor order")
+    namespace: Dict[str, Any] = {"cls": cls, "Mapping": Mapping}
+    lines = ["def decode(obj):",
+             "    if type(obj) is not dict and not isinstance(obj, Mapping):"]
+    if strict:
+        lines.append(f"        raise ValueError('Expected an object for {cls.__name__}, got ' + repr(obj)[:200])")
+    else:
+        lines.append("        return None")
+    lines.append("    get = obj.get")
+    if intern is not None:
+        key, registry = intern
+        namespace["registry"] = registry
+        lines += [f"    k = get({key!r})",
+                  "    if type(k) is str:",
+                  "        k = k.lower()",
+                  "        interned = registry.get(k)",
+                  "        if interned is not None:"]
+        for index, field in enumerate(fields):
+            if intern_refresh is not None and field.key in intern_refresh:
+                lines += ["        " + line for line in field_source(index, field)]
+                lines += [f"            if f{index} is not None:",
+                          f"                interned.{field.name} = f{index}"]
+        lines.append("            return interned")
+    for index, field in enumerate(fields):
+        namespace[f"d{index}"] = field.default
+        if callable(field.kind):
+            namespace[f"n{index}"] = field.kind
+        lines += field_source(index, field)
+    # Positional arguments are cheaper than keywords, schemas list fields in constructor order
+    arguments = ", ".join(f"f{index}" for index in range(len(fields)))
+    lines.append(f"    result = cls({arguments})")
+    if intern is not None:
+        complete = [f"f{index} is not None" for index, field in enumerate(fields)
+                    if intern_when is None or field.key in intern_when]
+        lines += [f"    if type(k) is str and {' and '.join(complete) or 'True'}:",
+                  "        registry[k] = result"]
+    lines.append("    return result")
+    exec("\n".join(lines), namespace)
+    decoder = namespace["decode"]
+    decoder.__name__ = decoder.__qualname__ = f"decode_{cls.__name__}"
+    return decoder
@@ -1,7 +1,8 @@
 from enum import Enum
 from dataclasses import dataclass
-from typing import Any, Union, List, TypeVar, Type, cast, Callable, Mapping
+from typing import Any, Dict, List, Optional, TypeVar, Type, cast, Callable
 
+from models.decoders import BOOL, FLOAT, INT, STR, Field, compile_decoder
 from models.markets import State
 
 T = TypeVar("T")
@@ -28,15 +29,6 @@ def from_int(x: Any) -> int:
         return x
 
 
-def from_union(fs, x):
-    for f in fs:
-        try:
-            return f(x)
-        except:
-            pass
-    assert False
-
-
 def from_float(x: Any) -> float:
     if isinstance(x, (float, int)) and not isinstance(x, bool):
         return float(x)
@@ -54,25 +46,31 @@ def from_list(f: Callable[[Any], T], x: Any) -> List[T]:
 
 @dataclass
 class Asset:
+    __slots__ = ("address", "symbol")
     address: str
     symbol: str
 
     @staticmethod
     def from_dict(obj: Any) -> 'Asset':
-        if isinstance(obj, dict):
-            address = from_str(obj.get("address"))
-            symbol = from_str(obj.get("symbol"))
-            return Asset(address, symbol)
+        return decode_asset(obj)
 
     def to_dict(self) -> dict:
         result: dict = {"address": from_str(self.address), "symbol": from_str(self.symbol)}
         return result
 
 
+# One shared Market per unique key, referenced by every position of that market. Only markets
+# decoded with all their parameters are shared, partial ones from events or caches are not. The
+# state is refreshed from every payload carrying one. MarketsBehaviour clears it every cycle.
+interned_markets: Dict[str, 'Market'] = {}
+
+
 @dataclass
 class Market:
+    __slots__ = ("unique_key", "lltv", "oracle_address", "irm_address", "loan_asset",
+                 "collateral_asset", "state")
     unique_key: str
-    lltv: str
+    lltv: int
     oracle_address: str
     irm_address: str
     loan_asset: Asset
@@ -81,19 +79,10 @@ class Market:
 
     @staticmethod
     def from_dict(obj: Any) -> 'Market':
-        if isinstance(obj, dict):
-            unique_key = from_str(obj.get("uniqueKey"))
-            lltv = from_str(obj.get("lltv"))
-            oracle_address = from_str(obj.get("oracleAddress"))
-            irm_address = from_str(obj.get("irmAddress"))
-            loan_asset = Asset.from_dict(obj.get("loanAsset"))
-            collateral_asset = Asset.from_dict(obj.get("collateralAsset"))
-            state = State.from_dict(obj.get("state"))
-            return Market(unique_key, lltv, oracle_address, irm_address, loan_asset,
-                          collateral_asset, state=state)
+        return decode_market(obj)
 
     def to_dict(self) -> dict:
-        result: dict = {"uniqueKey": from_str(self.unique_key), "lltv": from_str(self.lltv),
+        result: dict = {"uniqueKey": from_str(self.unique_key), "lltv": from_int(self.lltv),
                         "oracleAddress": from_str(self.oracle_address),
                         "irmAddress": from_str(self.irm_address),
                         "loanAsset": to_class(Asset, self.loan_asset),
@@ -112,13 +101,12 @@ class Market:
 
 @dataclass
 class User:
+    __slots__ = ("address",)
     address: str
 
     @staticmethod
     def from_dict(obj: Any) -> 'User':
-        assert isinstance(obj, dict)
-        address = from_str(obj.get("address"))
-        return User(address)
+        return decode_user(obj)
 
     def to_dict(self) -> dict:
         result: dict = {"address": from_str(self.address)}
@@ -127,13 +115,16 @@ class User:
 
 @dataclass
 class MarketPosition:
-    supply_shares: Union[int, str]
-    supply_assets: Union[int, str]
+    __slots__ = ("supply_shares", "supply_assets", "supply_assets_usd", "borrow_shares",
+                 "borrow_assets", "borrow_assets_usd", "collateral", "collateral_usd", "market",
+                 "user", "liquidated", "health_factor", "healthy")
+    supply_shares: Optional[int]
+    supply_assets: Optional[int]
     supply_assets_usd: float
-    borrow_shares: Union[int, str]
-    borrow_assets: Union[int, str]
+    borrow_shares: Optional[int]
+    borrow_assets: Optional[int]
     borrow_assets_usd: float
-    collateral: Union[int, str]
+    collateral: Optional[int]
     collateral_usd: float
     market: Market
     user: User
@@ -143,56 +134,32 @@ class MarketPosition:
 
     @staticmethod
     def from_dict(obj: Any) -> 'MarketPosition':
-        if isinstance(obj, Mapping):
-            supply_shares = from_union([from_int, from_str], obj.get("supplyShares"))
-            supply_assets = from_union([from_int, from_str], obj.get("supplyAssets"))
-            supply_assets_usd = from_float(obj.get("supplyAssetsUsd"))
-            borrow_shares = from_union([from_int, from_str], obj.get("borrowShares"))
-            borrow_assets = from_union([from_int, from_str], obj.get("borrowAssets"))
-            borrow_assets_usd = from_float(obj.get("borrowAssetsUsd"))
-            collateral = from_union([from_int, from_str], obj.get("collateral"))
-            collateral_usd = from_float(obj.get("collateralUsd"))
-            market = Market.from_dict(obj.get("market"))
-            user = User.from_dict(obj.get("user"))
-            liquidated = obj.get("liquidated", False)
-            healthy = obj.get("healthy", False)
-            health_factor = from_float(obj.get("health_factor", 10000.0))
-            market_position = MarketPosition(supply_shares=supply_shares,
-                                             supply_assets=supply_assets,
-                                             supply_assets_usd=supply_assets_usd,
-                                             borrow_shares=borrow_shares,
-                                             borrow_assets=borrow_assets,
-                                             borrow_assets_usd=borrow_assets_usd,
-                                             collateral=collateral, collateral_usd=collateral_usd,
-                                             market=market,
-                                             user=user, liquidated=liquidated,
-                                             health_factor=health_factor, healthy=healthy)
-            return market_position
+        return decode_market_position(obj)
 
     def to_dict(self) -> dict:
-        result: dict = {"supplyShares": from_union([from_int, from_str], self.supply_shares),
-                        "supplyAssets": from_union([from_int, from_str], self.supply_assets),
+        result: dict = {"supplyShares": from_int(self.supply_shares),
+                        "supplyAssets": from_int(self.supply_assets),
                         "supplyAssetsUsd": to_float(self.supply_assets_usd),
-                        "borrowShares": from_union([from_int, from_str], self.borrow_shares),
-                        "borrowAssets": from_union([from_int, from_str], self.borrow_assets),
+                        "borrowShares": from_int(self.borrow_shares),
+                        "borrowAssets": from_int(self.borrow_assets),
                         "borrowAssetsUsd": to_float(self.borrow_assets_usd),
-                        "collateral": from_union([from_int, from_str], self.collateral),
+                        "collateral": from_int(self.collateral),
                         "collateralUsd": to_float(self.collateral_usd),
+                        "liquidated": self.liquidated,
                         "healthy": self.healthy,
-                        "health_factor": from_union([from_int, from_str],self.health_factor),
+                        "health_factor": to_float(self.health_factor),
                         "market": to_class(Market, self.market), "user": to_class(User, self.user)}
         return result
 
 
 @dataclass
 class MarketPositions:
+    __slots__ = ("items",)
     items: List[MarketPosition]
 
     @staticmethod
     def from_dict(obj: Any) -> 'MarketPositions':
-        assert isinstance(obj, dict)
-        items = from_list(MarketPosition.from_dict, obj.get("items"))
-        return MarketPositions(items)
+        return decode_market_positions(obj)
 
     def to_dict(self) -> dict:
         result: dict = {"items": from_list(lambda x: to_class(MarketPosition, x), self.items)}
@@ -201,13 +168,12 @@ class MarketPositions:
 
 @dataclass
 class Data:
+    __slots__ = ("market_positions",)
     market_positions: MarketPositions
 
     @staticmethod
     def from_dict(obj: Any) -> 'Data':
-        assert isinstance(obj, dict)
-        market_positions = MarketPositions.from_dict(obj.get("marketPositions"))
-        return Data(market_positions)
+        return decode_data(obj)
 
     def to_dict(self) -> dict:
         result: dict = {"marketPositions": to_class(MarketPositions, self.market_positions)}
@@ -216,12 +182,14 @@ class Data:
 
 @dataclass
 class MarketsPositionResponse:
+    __slots__ = ("market_positions",)
     market_positions: List[MarketPosition]
 
     @staticmethod
     def from_dict(obj: Any) -> 'MarketsPositionResponse':
-        assert isinstance(obj, dict)
-        data = Data.from_dict(obj.get("data"))
+        if not isinstance(obj, dict):
+            raise ValueError(f"Expected a marketPositions response, got {obj!r:.200}")
+        data = decode_data(obj.get("data"))
         return MarketsPositionResponse(data.market_positions.items)
 
     def to_dict(self) -> dict:
@@ -229,6 +197,52 @@ class MarketsPositionResponse:
         return result
 
 
+decode_asset = compile_decoder(Asset, [
+    Field("address", "address", STR),
+    Field("symbol", "symbol", STR),
+])
+
+decode_market = compile_decoder(Market, [
+    Field("uniqueKey", "unique_key", STR),
+    Field("lltv", "lltv", INT),
+    Field("oracleAddress", "oracle_address", STR),
+    Field("irmAddress", "irm_address", STR),
+    Field("loanAsset", "loan_asset", decode_asset),
+    Field("collateralAsset", "collateral_asset", decode_asset),
+    Field("state", "state", State.from_dict),
+], intern=("uniqueKey", interned_markets),
+    intern_when=["uniqueKey", "lltv", "oracleAddress", "irmAddress", "loanAsset", "collateralAsset"],
+    intern_refresh=["state"])
+
+decode_user = compile_decoder(User, [
+    Field("address", "address", STR),
+], strict=True)
+
+decode_market_position = compile_decoder(MarketPosition, [
+    Field("supplyShares", "supply_shares", INT),
+    Field("supplyAssets", "supply_assets", INT),
+    Field("supplyAssetsUsd", "supply_assets_usd", FLOAT),
+    Field("borrowShares", "borrow_shares", INT),
+    Field("borrowAssets", "borrow_assets", INT),
+    Field("borrowAssetsUsd", "borrow_assets_usd", FLOAT),
+    Field("collateral", "collateral", INT),
+    Field("collateralUsd", "collateral_usd", FLOAT),
+    Field("market", "market", decode_market),
+    Field("user", "user", decode_user),
+    Field("liquidated", "liquidated", BOOL, default=False),
+    Field("health_factor", "health_factor", FLOAT, default=10000.0),
+    Field("healthy", "healthy", BOOL, default=False),
+])
+
+decode_market_positions = compile_decoder(MarketPositions, [
+    Field("items", "items", decode_market_position, many=True, required=True),
+], strict=True)
+
+decode_data = compile_decoder(Data, [
+    Field("marketPositions", "market_positions", decode_market_positions, required=True),
+], strict=True)
+
+
 def markets_position_response_from_dict(s: Any) -> MarketsPositionResponse:
     return MarketsPositionResponse.from_dict(s)
 
@@ -1,7 +1,9 @@
 from dataclasses import dataclass
-from typing import Any, Union, Optional, List, TypeVar, Type, cast, Callable
+from typing import Any, Optional, List, TypeVar, Type, cast, Callable
 from enum import Enum
 
+from models.decoders import ANY, FLOAT, INT, STR, Field, compile_decoder
+
 T = TypeVar("T")
 EnumT = TypeVar("EnumT", bound=Enum)
 
@@ -21,20 +23,6 @@ def from_float(x: Any) -> float:
     return float(x)
 
 
-def from_union(fs, x):
-    for f in fs:
-        try:
-            return f(x)
-        except:
-            pass
-    assert False
-
-
-def from_none(x: Any) -> Any:
-    assert x is None
-    return x
-
-
 def to_float(x: Any) -> float:
     assert isinstance(x, (int, float))
     return x
@@ -62,10 +50,7 @@ class Asset:
 
     @staticmethod
     def from_dict(obj: Any) -> 'Asset':
-        assert isinstance(obj, dict)
-        address = from_str(obj.get("address"))
-        symbol = from_str(obj.get("symbol"))
-        return Asset(address, symbol)
+        return decode_asset(obj)
 
     def to_dict(self) -> dict:
         result: dict = {"address": from_str(self.address), "symbol": from_str(self.symbol),
@@ -76,9 +61,9 @@ class Asset:
 @dataclass
 class State:
     borrow_apy: float
-    borrow_assets: Union[int, str]
+    borrow_assets: int
     supply_apy: float
-    supply_assets: Union[int, str]
+    supply_assets: int
     fee: int
     utilization: float
     borrow_assets_usd: Optional[float] = None
@@ -86,35 +71,23 @@ class State:
 
     @staticmethod
     def from_dict(obj: Any) -> 'State':
-        if isinstance(obj, dict):
-            borrow_apy = from_float(obj.get("borrowApy"))
-            borrow_assets = from_union([from_int, from_str], obj.get("borrowAssets"))
-            supply_apy = from_float(obj.get("supplyApy"))
-            supply_assets = from_union([from_int, from_str], obj.get("supplyAssets"))
-            fee = from_int(obj.get("fee"))
-            utilization = from_float(obj.get("utilization"))
-            borrow_assets_usd = from_union([from_float, from_none], obj.get("borrowAssetsUsd"))
-            supply_assets_usd = from_union([from_float, from_none], obj.get("supplyAssetsUsd"))
-            return State(borrow_apy, borrow_assets, supply_apy, supply_assets, fee, utilization,
-                         borrow_assets_usd, supply_assets_usd)
+        return decode_state(obj)
 
     def to_dict(self) -> dict:
         result: dict = {"borrowApy": to_float(self.borrow_apy),
-                        "borrowAssets": from_union([from_int, from_str], self.borrow_assets),
+                        "borrowAssets": self.borrow_assets,
                         "supplyApy": to_float(self.supply_apy),
-                        "supplyAssets": from_union([from_int, from_str], self.supply_assets),
-                        "fee": from_int(self.fee), "utilization": to_float(self.utilization),
-                        "borrowAssetsUsd": from_union([to_float, from_none],
-                                                      self.borrow_assets_usd),
-                        "supplyAssetsUsd": from_union([to_float, from_none],
-                                                      self.supply_assets_usd)}
+                        "supplyAssets": self.supply_assets,
+                        "fee": self.fee, "utilization": to_float(self.utilization),
+                        "borrowAssetsUsd": self.borrow_assets_usd,
+                        "supplyAssetsUsd": self.supply_assets_usd}
         return result
 
 
 @dataclass
 class Market:
     unique_key: str
-    lltv: Union[int, str]
+    lltv: int
     oracle_address: str
     irm_address: str
     loan_asset: Asset
@@ -123,26 +96,26 @@ class Market:
 
     @staticmethod
     def from_dict(obj: Any) -> 'Market':
-        assert isinstance(obj, dict)
-        unique_key = from_str(obj.get("uniqueKey"))
-        lltv = obj.get("lltv")
-        oracle_address = from_str(obj.get("oracleAddress"))
-        irm_address = obj.get("irmAddress")
-        loan_asset = Asset.from_dict(obj.get("loanAsset"))
-        state = State.from_dict(obj.get("state"))
-        collateral_asset = from_union([Asset.from_dict, from_none], obj.get("collateralAsset"))
-        return Market(unique_key, lltv, oracle_address, irm_address, loan_asset, state,
-                      collateral_asset)
+        return decode_market(obj)
 
     def to_dict(self) -> dict:
         result: dict = {"uniqueKey": from_str(self.unique_key),
-                        "lltv": from_union([from_int, from_str], self.lltv),
+                        "lltv": from_int(self.lltv),
                         "oracleAddress": from_str(self.oracle_address),
                         "irmAddress": from_str( self.irm_address),
                         "loanAsset": to_class(Asset, self.loan_asset),
-                        "state": to_class(State, self.state),
-                        "collateralAsset": from_union([lambda x: to_class(Asset, x), from_none],
-                                                      self.collateral_asset)}
+                        "state": to_class(State, self.state) if self.state is not None else None,
+                        "collateralAsset": to_class(Asset, self.collateral_asset)
+                        if self.collateral_asset is not None else None}
+        return result
+
+    def to_market_param(self):
+        result = (from_str(self.loan_asset.address),
+                  from_str(self.collateral_asset.address),
+                  from_str(self.oracle_address),
+                  from_str(self.irm_address),
+                  int(self.lltv),
+                  )
         return result
 
 
@@ -152,9 +125,7 @@ class Markets:
 
     @staticmethod
     def from_dict(obj: Any) -> 'Markets':
-        assert isinstance(obj, dict)
-        items = from_list(Market.from_dict, obj.get("items"))
-        return Markets(items)
+        return decode_markets(obj)
 
     def to_dict(self) -> dict:
         result: dict = {"items": from_list(lambda x: to_class(Market, x), self.items)}
@@ -167,9 +138,7 @@ class Data:
 
     @staticmethod
     def from_dict(obj: Any) -> 'Data':
-        assert isinstance(obj, dict)
-        markets = Markets.from_dict(obj.get("markets")).items
-        return Data(markets)
+        return decode_data(obj)
 
     def to_dict(self) -> dict:
         result: dict = {"markets": to_class(Markets, self.markets)}
@@ -182,15 +151,50 @@ class MarketsResponse:
 
     @staticmethod
     def from_dict(obj: Any) -> 'MarketsResponse':
-        assert isinstance(obj, dict)
-        data = Data.from_dict(obj.get("data")).markets
-        return MarketsResponse(data)
+        if not isinstance(obj, dict):
+            raise ValueError(f"Expected a markets response, got {obj!r:.200}")
+        return MarketsResponse(decode_data(obj.get("data")).markets)
 
     def to_dict(self) -> dict:
         result: dict = {"markets": to_class(Data, self.markets)}
         return result
 
 
+decode_asset = compile_decoder(Asset, [
+    Field("address", "address", STR),
+    Field("symbol", "symbol", STR),
+], strict=True)
+
+decode_state = compile_decoder(State, [
+    Field("borrowApy", "borrow_apy", FLOAT),
+    Field("borrowAssets", "borrow_assets", INT),
+    Field("supplyApy", "supply_apy", FLOAT),
+    Field("supplyAssets", "supply_assets", INT),
+    Field("fee", "fee", ANY),
+    Field("utilization", "utilization", FLOAT),
+    Field("borrowAssetsUsd", "borrow_assets_usd", FLOAT),
+    Field("supplyAssetsUsd", "supply_assets_usd", FLOAT),
+])
+
+decode_market = compile_decoder(Market, [
+    Field("uniqueKey", "unique_key", STR, required=True),
+    Field("lltv", "lltv", INT),
+    Field("oracleAddress", "oracle_address", STR),
+    Field("irmAddress", "irm_address", STR),
+    Field("loanAsset", "loan_asset", decode_asset, required=True),
+    Field("state", "state", decode_state),
+    Field("collateralAsset", "collateral_asset", decode_asset),
+], strict=True)
+
+decode_markets = compile_decoder(Markets, [
+    Field("items", "items", decode_market, many=True, required=True),
+], strict=True)
+
+decode_data = compile_decoder(Data, [
+    Field("markets", "markets", lambda markets: decode_markets(markets).items, required=True),
+], strict=True)
+
+
 def markets_response_from_dict(s: Any) -> MarketsResponse:
     return MarketsResponse.from_dict(s)
 
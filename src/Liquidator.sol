@@ -119,6 +119,37 @@ contract Liquidator is Ownable, Multicall3 {
     ) public view returns (uint256 totalBorrowAssets) {
         totalBorrowAssets = morpho.expectedTotalBorrowAssets(marketParams);
     }
+    /// @notice Reads everything needed to compute health factors off-chain for a specific market.
+    /// @dev Borrow totals include the interest accrued up to the current block.
+    /// @param marketParams The parameters of the market.
+    /// @return price The collateral price returned by the market's oracle.
+    /// @return totalBorrowAssets The total borrow of assets in the market.
+    /// @return totalBorrowShares The total borrow shares in the market.
+    /// @return lastUpdate The timestamp of the market's last interest accrual.
+    function marketSnapshot(
+        MarketParams memory marketParams
+    )
+        public
+        view
+        returns (
+            uint256 price,
+            uint256 totalBorrowAssets,
+            uint256 totalBorrowShares,
+            uint256 lastUpdate
+        )
+    {
+        price = IOracle(marketParams.oracle).price();
+        (, , totalBorrowAssets, totalBorrowShares) = morpho
+            .expectedMarketBalances(marketParams);
+        lastUpdate = morpho.lastUpdate(marketParams.id());
+    }
+    /// @notice Reads the price of an oracle.
+    /// @dev Lets oracles be read through the delegatecall based multicall.
+    /// @param oracle The address of the oracle.
+    /// @return price The price returned by the oracle.
+    function oraclePrice(address oracle) public view returns (uint256 price) {
+        price = IOracle(oracle).price();
+    }
     // ---- MANAGING FUNCTIONS ----
     /// @notice Callback function for Morpho liquidations.
     /// @param data Encoded liquidation data.
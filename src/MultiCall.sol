@@ -19,6 +19,11 @@ abstract contract Multicall3 {
         address target;
         bytes callData;
     }
+
+    struct Result {
+        bool success;
+        bytes returnData;
+    }
     error NoEtherAllowed();
 
     /// @notice Backwards-compatible call aggregation with Multicall
@@ -45,4 +50,32 @@ abstract contract Multicall3 {
             }
         }
     }
+
+    /// @notice Aggregate calls without requiring success
+    /// @dev A failing call only reverts its own state changes, the other calls still apply
+    /// @param requireSuccess If true, require all calls to succeed
+    /// @param calls An array of Call structs
+    /// @return returnData An array of Result structs, the revert data of a failed call is returned as is
+    function tryAggregate(
+        bool requireSuccess,
+        Call[] calldata calls
+    ) public payable returns (Result[] memory returnData) {
+        uint256 length = calls.length;
+        returnData = new Result[](length);
+        Call calldata call;
+        if (msg.value > 0) {
+            revert NoEtherAllowed();
+        }
+        for (uint256 i = 0; i < length; ) {
+            Result memory result = returnData[i];
+            call = calls[i];
+            (result.success, result.returnData) = call.target.delegatecall(
+                call.callData
+            );
+            if (requireSuccess) require(result.success, "Multicall3: call failed");
+            unchecked {
+                ++i;
+            }
+        }
+    }
 }
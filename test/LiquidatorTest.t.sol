@@ -50,6 +50,29 @@ contract LiquidatorTest is LiquidatorBaseTest {
         );
         vm.stopPrank();
     }
+    function test_MarketSnapshot() public {
+        vm.selectFork(ethForkID);
+        vm.startPrank(spha);
+        (MarketParams memory marketParams, Id id) = _setUpMarket();
+        vm.stopPrank();
+        vm.startPrank(mike);
+        collateralToken.approve(address(liquidator), type(uint256).max);
+        morpho.setAuthorization(address(liquidator), true);
+        liquidator.supplyCollateral(marketParams, 10 ether);
+        liquidator.borrow(marketParams, 954);
+        vm.stopPrank();
+        (
+            uint256 price,
+            uint256 totalBorrowAssets,
+            uint256 totalBorrowShares,
+            uint256 lastUpdate
+        ) = liquidator.marketSnapshot(marketParams);
+        Market memory market = morpho.market(id);
+        assertEq(price, mockOracleLoanToken.price());
+        assertEq(totalBorrowAssets, 954);
+        assertEq(totalBorrowShares, market.totalBorrowShares);
+        assertEq(lastUpdate, market.lastUpdate);
+    }
     function test_SupplyOpenPosition_AndLiquidate() public {
         vm.selectFork(ethForkID);
         vm.startPrank(spha);
@@ -82,4 +105,79 @@ contract LiquidatorTest is LiquidatorBaseTest {
         liquidator.aggregate(calls);
         vm.stopPrank();
     }
+    function test_TryAggregate_IsolatesFailingCalls() public {
+        vm.selectFork(ethForkID);
+        vm.startPrank(spha);
+        (MarketParams memory marketParams, Id id) = _setUpMarket();
+        vm.stopPrank();
+        vm.startPrank(mike);
+        collateralToken.approve(address(liquidator), type(uint256).max);
+        morpho.setAuthorization(address(liquidator), true);
+        liquidator.supplyCollateral(marketParams, 10 ether);
+        liquidator.borrow(marketParams, 954);
+        vm.stopPrank();
+        vm.startPrank(spha);
+        Call[] memory calls = new Call[](2);
+        calls[0] = Call({
+            callData: abi.encodeWithSelector(
+                liquidator.userHealthFactor.selector,
+                marketParams,
+                id,
+                mike
+            ),
+            target: address(liquidator)
+        });
+        // The position is still healthy so the liquidation reverts
+        calls[1] = Call({
+            callData: abi.encodeWithSelector(
+                liquidator.fullLiquidationWithoutCollat.selector,
+                marketParams,
+                mike,
+                true
+            ),
+            target: address(liquidator)
+        });
+        Result[] memory results = liquidator.tryAggregate(false, calls);
+        assertTrue(results[0].success);
+        assertEq(
+            abi.decode(results[0].returnData, (uint256)),
+            liquidator.userHealthFactor(marketParams, id, mike)
+        );
+        assertFalse(results[1].success);
+
+        vm.expectRevert("Multicall3: call failed");
+        liquidator.tryAggregate(true, calls);
+
+        mockOracleLoanToken.updatePrice();
+        results = liquidator.tryAggregate(false, calls);
+        assertTrue(results[1].success);
+        assertEq(morpho.position(id, mike).borrowShares, 0);
+        vm.stopPrank();
+    }
+    function test_OraclePrice() public {
+        vm.selectFork(ethForkID);
+        vm.startPrank(spha);
+        (MarketParams memory marketParams, ) = _setUpMarket();
+        assertEq(
+            liquidator.oraclePrice(marketParams.oracle),
+            mockOracleLoanToken.price()
+        );
+
+        Call[] memory calls = new Call[](1);
+        calls[0] = Call({
+            callData: abi.encodeWithSelector(
+                liquidator.oraclePrice.selector,
+                marketParams.oracle
+            ),
+            target: address(liquidator)
+        });
+        mockOracleLoanToken.updatePrice();
+        Result[] memory results = liquidator.tryAggregate(false, calls);
+        assertTrue(results[0].success);
+        assertEq(
+            abi.decode(results[0].returnData, (uint256)),
+            mockOracleLoanToken.price()
+        );
+        vm.stopPrank();
+    }
 }
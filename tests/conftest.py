@@ -0,0 +1,4 @@
+import os
+
+# bot_utils.helpers needs the Redis URL at import, the client only connects on first use
+os.environ.setdefault("REDIS_HOST", "redis://localhost:6379")
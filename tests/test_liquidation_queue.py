@@ -0,0 +1,67 @@
+import itertools
+import random
+
+from bot_utils.liquidation_queue import LiquidationQueue, expected_profit_usd
+from models.market_positions import MarketPosition
+
+GWEI = 10 ** 9
+
+
+def position(borrower: str, borrow_usd: float, collateral_usd: float = 10 ** 9) -> MarketPosition:
+    return MarketPosition.from_dict({"borrowAssetsUsd": borrow_usd, "collateralUsd": collateral_usd,
+                                     "market": {"uniqueKey": "0x01", "lltv": "860000000000000000"},
+                                     "user": {"address": borrower}})
+
+
+def queue_of(borrow_usds, native_token_price_usd: float = 3000.0) -> LiquidationQueue:
+    queue = LiquidationQueue(native_token_price_usd=native_token_price_usd)
+    for index, borrow_usd in enumerate(borrow_usds):
+        queue.push(f"0x{index:040x}", ("0x", b""), position(f"0x{index:040x}", borrow_usd))
+    return queue
+
+
+def test_pack_stays_within_budget():
+    rng = random.Random(7)
+    for _ in range(50):
+        count = rng.randint(1, 40)
+        queue = queue_of([rng.uniform(10, 100_000) for _ in range(count)])
+        # A few candidates without USD values fill the gas left over
+        queue.push("unpriced", ("0x", b""), MarketPosition.from_dict({"user": {"address": "0x02"}}))
+        keys = [key for key, _ in queue.ranked()]
+        gas_per_call = [rng.randint(80_000, 900_000) for _ in keys]
+        budget = rng.randint(100_000, 5_000_000)
+
+        chosen = queue.pack(keys, gas_per_call, budget, GWEI)
+
+        assert chosen == sorted(set(chosen))
+        assert sum(gas_per_call[index] for index in chosen) <= budget
+
+
+def test_pack_drops_calls_that_cost_more_gas_than_they_earn():
+    queue = queue_of([10_000, 1])
+    keys = [key for key, _ in queue.ranked()]
+    gas_price = 10 * GWEI
+    # 300k gas at 10 gwei and 3000 USD costs 9 USD, the 1 USD debt earns about 0.04 USD
+    assert expected_profit_usd(position(keys[1], 1)) < queue.gas_cost_usd(300_000, gas_price)
+
+    assert queue.pack(keys, [300_000, 300_000], 10_000_000, gas_price) == [0]
+
+
+def test_pack_is_optimal_when_gas_fits_the_slots():
+    rng = random.Random(11)
+    for _ in range(100):
+        count = rng.randint(1, 10)
+        queue = queue_of([rng.uniform(10, 10_000) for _ in range(count)])
+        keys = [key for key, _ in queue.ranked()]
+        # Budgets below MAX_CAPACITY_SLOTS gas give one slot per gas unit, the knapsack is exact
+        gas_per_call = [rng.randint(10, 600) for _ in keys]
+        budget = rng.randint(100, 1_500)
+
+        def value(indices):
+            return sum(queue.profits[keys[index]] for index in indices)
+
+        best = max(value(subset) for size in range(count + 1)
+                   for subset in itertools.combinations(range(count), size)
+                   if sum(gas_per_call[index] for index in subset) <= budget)
+
+        assert abs(value(queue.pack(keys, gas_per_call, budget, 0)) - best) < 1e-6
@@ -0,0 +1,91 @@
+from eth_abi import encode
+from eth_utils import event_abi_to_log_topic
+from hexbytes import HexBytes
+from web3 import Web3
+
+from bot_utils.liquidation_results import decode_receipt
+
+LIQUIDATOR = "0x5FbDB2315678afecb367f032d93F642f64180aa3"
+LOAN_TOKEN = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+ALICE = "0x00000000000000000000000000000000000A11CE"
+BOB = "0x0000000000000000000000000000000000000B0B"
+CAROL = "0x00000000000000000000000000000000000CA201"
+
+LIQUIDATOR_EVENTS = [
+    {"type": "event", "name": "LiquidationResults", "anonymous": False, "inputs": [
+        {"name": "seizedAssets", "type": "uint256", "indexed": True},
+        {"name": "balance", "type": "uint256", "indexed": True},
+        {"name": "loanToken", "type": "address", "indexed": False},
+        {"name": "repaidAssets", "type": "uint256", "indexed": False},
+        {"name": "borrower", "type": "address", "indexed": True},
+    ]},
+    {"type": "event", "name": "Liqudated", "anonymous": False, "inputs": [
+        {"name": "data", "type": "tuple", "indexed": True, "internalType": "struct Liquidator.LiquidateData",
+         "components": [{"name": "collateralToken", "type": "address"}]},
+    ]},
+]
+
+liquidator = Web3().eth.contract(address=LIQUIDATOR, abi=LIQUIDATOR_EVENTS)
+
+
+def log(topics, data: bytes = b"", address: str = LIQUIDATOR) -> dict:
+    return {"address": address, "topics": [HexBytes(topic) for topic in topics], "data": HexBytes(data),
+            "logIndex": 0, "transactionIndex": 0, "transactionHash": HexBytes(b"\x01" * 32),
+            "blockHash": HexBytes(b"\x02" * 32), "blockNumber": 1}
+
+
+def callback_log() -> dict:
+    return log([event_abi_to_log_topic(liquidator.events.Liqudated().abi), b"\x03" * 32])
+
+
+def results_log(borrower: str, seized: int, repaid: int) -> dict:
+    return log([event_abi_to_log_topic(liquidator.events.LiquidationResults().abi),
+                encode(["uint256"], [seized]), encode(["uint256"], [0]), encode(["address"], [borrower])],
+               encode(["address", "uint256"], [LOAN_TOKEN, repaid]))
+
+
+def receipt(*logs, status: int = 1) -> dict:
+    return {"status": status, "logs": list(logs)}
+
+
+def test_reverted_middle_call_is_failed():
+    results = decode_receipt(liquidator, receipt(callback_log(), results_log(ALICE, 10, 9),
+                                                 callback_log(), results_log(CAROL, 30, 27)),
+                             [ALICE, BOB, CAROL])
+
+    assert [(outcome.key, outcome.call_index) for outcome in results.outcomes] == [(ALICE, 0), (CAROL, 2)]
+    assert [outcome.seized_assets for outcome in results.outcomes] == [10, 30]
+    assert [outcome.repaid_assets for outcome in results.outcomes] == [9, 27]
+    assert all(outcome.callback and outcome.loan_token == LOAN_TOKEN for outcome in results.outcomes)
+    assert results.failed == [BOB]
+
+
+def test_duplicate_borrower_results_go_to_their_next_call():
+    keys = ["first", "second", "third"]
+    borrowers = [ALICE, ALICE, BOB]
+
+    both = decode_receipt(liquidator, receipt(results_log(ALICE, 1, 1), results_log(ALICE, 2, 2)), keys, borrowers)
+    assert [(outcome.key, outcome.seized_assets) for outcome in both.outcomes] == [("first", 1), ("second", 2)]
+    assert both.failed == ["third"]
+
+    second_reverted = decode_receipt(liquidator, receipt(results_log(ALICE, 1, 1), results_log(BOB, 3, 3)),
+                                     keys, borrowers)
+    assert [outcome.call_index for outcome in second_reverted.outcomes] == [0, 2]
+    assert second_reverted.failed == ["second"]
+
+
+def test_logs_of_other_contracts_are_ignored():
+    other = results_log(ALICE, 1, 1)
+    other["address"] = LOAN_TOKEN
+
+    results = decode_receipt(liquidator, receipt(other), [ALICE])
+
+    assert results.outcomes == []
+    assert results.failed == [ALICE]
+
+
+def test_reverted_bundle_fails_every_call():
+    results = decode_receipt(liquidator, receipt(results_log(ALICE, 1, 1), status=0), [ALICE, BOB])
+
+    assert results.outcomes == []
+    assert results.failed == [ALICE, BOB]
@@ -0,0 +1,44 @@
+from models.market_positions import Market, interned_markets
+
+UNIQUE_KEY = "0xB323495F7E4148BE5643A4EA4A8221EEF163E4BCCFDEDC2A6F4696BAACBC86CC"
+
+FULL_MARKET = {
+    "uniqueKey": UNIQUE_KEY,
+    "lltv": "860000000000000000",
+    "oracleAddress": "0x48F7E36EB6B826B2dF4B2E630B62Cd25e89E40e2",
+    "irmAddress": "0x870aC11D48B15DB9a138Cf899d20F13F79Ba00BC",
+    "loanAsset": {"address": "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48", "symbol": "USDC"},
+    "collateralAsset": {"address": "0x7f39C581F595B53c5cb19bD0b3f8dA6c935E2Ca0", "symbol": "wstETH"},
+}
+
+
+def setup_function():
+    interned_markets.clear()
+
+
+def test_partial_market_is_not_interned():
+    partial = Market.from_dict({"uniqueKey": UNIQUE_KEY})
+    full = Market.from_dict(FULL_MARKET)
+
+    assert partial.lltv is None
+    assert full is not partial
+    assert full.lltv == 860000000000000000
+    assert full.oracle_address == FULL_MARKET["oracleAddress"]
+    assert full.collateral_asset.symbol == "wstETH"
+    assert interned_markets[UNIQUE_KEY.lower()] is full
+
+
+def test_full_market_is_shared():
+    full = Market.from_dict(FULL_MARKET)
+
+    assert Market.from_dict(dict(FULL_MARKET, uniqueKey=UNIQUE_KEY.lower())) is full
+    assert Market.from_dict({"uniqueKey": UNIQUE_KEY}) is full
+
+
+def test_shared_market_state_is_refreshed():
+    full = Market.from_dict(dict(FULL_MARKET, state={"utilization": 0.5}))
+    refreshed = Market.from_dict(dict(FULL_MARKET, state={"utilization": 0.9}))
+    cached = Market.from_dict({"uniqueKey": UNIQUE_KEY})
+
+    assert refreshed is full and cached is full
+    assert full.state.utilization == 0.9